@@ -0,0 +1,180 @@
+"""Count the Futures Toro allocates per operation on uncontended fast paths.
+
+Run from the repository root::
+
+    python -m benchmarks.allocations
+
+Each benchmark performs an operation that can finish immediately, such as
+acquiring a free lock, and reports how many Futures it created per operation
+and how long each operation took.
+"""
+
+import atexit
+import shutil
+import tempfile
+import timeit
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+import toro
+
+N = 100000
+
+_allocations = [0]
+_future_init = Future.__init__
+
+
+def _counting_init(self, *args, **kwargs):
+    _allocations[0] += 1
+    _future_init(self, *args, **kwargs)
+
+
+def event_wait():
+    event = toro.Event()
+    event.set()
+    return lambda: event.wait()
+
+
+def queue_put_get():
+    q = toro.Queue()
+
+    def op():
+        q.put(None)
+        q.get_nowait()
+    return op
+
+
+def bounded_queue_fill_drain():
+    # A bounded queue oscillating between empty and full, 100 items per
+    # operation.
+    q = toro.RingBufferQueue(maxsize=100)
+
+    def op():
+        for i in xrange(100):
+            q.put_nowait(i)
+        for i in xrange(100):
+            q.get_nowait()
+    return op
+
+
+def durable_queue_put_get():
+    # Compare with queue_put_get: the cost of logging each item.
+    directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory)
+    q = toro.DurableQueue(directory)
+
+    def op():
+        q.put(None)
+        q.get_nowait()
+        q.task_done()
+    return op
+
+
+def broadcast_queue_put_get():
+    # One put read by 10 subscribers.
+    q = toro.BroadcastQueue()
+    subscribers = [q.subscribe() for _ in range(10)]
+
+    def op():
+        q.put(None)
+        for subscriber in subscribers:
+            subscriber.get_nowait()
+    return op
+
+
+def pubsub_publish_get():
+    # One matching subscription among 1000.
+    hub = toro.PubSub()
+    for i in range(1000):
+        hub.subscribe('events.%d.*' % i)
+    subscription = hub.subscribe('events.42.*')
+
+    def op():
+        hub.publish('events.42.created', None)
+        subscription.get_nowait()
+    return op
+
+
+def queue_put_many_get_many():
+    # 100 items per operation.
+    q = toro.Queue()
+    items = range(100)
+
+    def op():
+        q.put_many(items)
+        q.get_many(100)
+    return op
+
+
+def semaphore_acquire_release():
+    sem = toro.Semaphore()
+
+    def op():
+        sem.acquire()
+        sem.release()
+    return op
+
+
+def lock_acquire_release():
+    lock = toro.Lock()
+
+    def op():
+        lock.acquire()
+        lock.release()
+    return op
+
+
+def rwlock_write_acquire_release():
+    lock = toro.RWLock(max_readers=1000)
+
+    def op():
+        lock.acquire_write()
+        lock.release_write()
+    return op
+
+
+def async_result_get():
+    result = toro.AsyncResult()
+    result.set('value')
+    return lambda: result.get()
+
+
+BENCHMARKS = [
+    event_wait,
+    queue_put_get,
+    bounded_queue_fill_drain,
+    durable_queue_put_get,
+    broadcast_queue_put_get,
+    pubsub_publish_get,
+    queue_put_many_get_many,
+    semaphore_acquire_release,
+    lock_acquire_release,
+    rwlock_write_acquire_release,
+    async_result_get,
+]
+
+
+def measure(setup):
+    op = setup()
+    op()  # Warm up caches.
+    _allocations[0] = 0
+    Future.__init__ = _counting_init
+    try:
+        seconds = timeit.Timer(op).timeit(N)
+    finally:
+        Future.__init__ = _future_init
+
+    return float(_allocations[0]) / N, seconds / N * 1e6
+
+
+def main():
+    IOLoop.current()
+    print '%-28s %12s %12s' % ('operation', 'futures/op', 'usec/op')
+    for setup in BENCHMARKS:
+        futures, usec = measure(setup)
+        print '%-28s %12.2f %12.2f' % (setup.__name__, futures, usec)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Measure the memory each Toro primitive occupies.
+
+Run from the repository root::
+
+    python -m benchmarks.memory
+
+The figure for each primitive is the sum of ``sys.getsizeof`` over the
+instance and every object it owns: its deques, lists, nested primitives and
+so on. Objects shared with the rest of the program, such as the IOLoop, are
+not counted. Primitives are measured freshly created and idle, with no
+waiters.
+"""
+
+import gc
+import sys
+import types
+
+from tornado.ioloop import IOLoop
+
+import toro
+
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType)
+
+
+def deep_size(obj, shared):
+    seen = set(id(o) for o in shared)
+    pending = [obj]
+    total = 0
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, _SHARED_TYPES):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        pending.extend(gc.get_referents(o))
+    return total
+
+
+def main():
+    io_loop = IOLoop.current()
+    shared = [io_loop, toro._null_result, toro._null_future]
+    primitives = [
+        ('AsyncResult', toro.AsyncResult),
+        ('Condition', toro.Condition),
+        ('Event', toro.Event),
+        ('Semaphore', toro.Semaphore),
+        ('BoundedSemaphore', toro.BoundedSemaphore),
+        ('KeyedSemaphore', toro.KeyedSemaphore),
+        ('Lock', toro.Lock),
+        ('RLock', toro.RLock),
+        ('RWLock', toro.RWLock),
+        ('Queue', toro.Queue),
+        ('PriorityQueue', toro.PriorityQueue),
+        ('LifoQueue', toro.LifoQueue),
+        ('JoinableQueue', toro.JoinableQueue),
+        ('SpillingQueue', toro.SpillingQueue),
+        ('CoalescingQueue', toro.CoalescingQueue),
+        ('BroadcastQueue', toro.BroadcastQueue),
+        ('PubSub', toro.PubSub),
+        ('ByteChannel', toro.ByteChannel),
+    ]
+
+    print '%-20s %8s' % ('primitive', 'bytes')
+    for name, factory in primitives:
+        print '%-20s %8d' % (name, deep_size(factory(), shared))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+Test toro.AdaptiveSemaphore.
+"""
+
+from datetime import timedelta
+from functools import partial
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, assert_raises, ContextManagerTestsMixin, pause
+
+
+class AdaptiveSemaphoreTests(AsyncTestCase):
+    def test_str(self):
+        sem = toro.AdaptiveSemaphore(limit=5)
+        self.assertTrue('AdaptiveSemaphore' in str(sem))
+        self.assertTrue('limit=5' in str(sem))
+        self.assertTrue('in_flight=0' in str(sem))
+
+    def test_constructor(self):
+        self.assertRaises(ValueError, toro.AdaptiveSemaphore, 0)
+        self.assertRaises(ValueError, toro.AdaptiveSemaphore, 5, 6)
+        self.assertRaises(ValueError, toro.AdaptiveSemaphore, 5, 1, 4)
+        self.assertRaises(ValueError, toro.AIMDLimit, backoff_ratio=1)
+        self.assertRaises(ValueError, toro.GradientLimit, tolerance=0.5)
+
+    def test_acquire_release(self):
+        sem = toro.AdaptiveSemaphore(limit=2)
+        self.assertTrue(sem.acquire().done())
+        self.assertTrue(sem.try_acquire())
+        self.assertEqual(2, sem.in_flight)
+        self.assertTrue(sem.locked())
+        self.assertFalse(sem.try_acquire())
+        sem.release()
+        sem.release()
+        self.assertRaises(ValueError, sem.release)
+
+        # No samples given, so the limit hasn't moved.
+        self.assertEqual(2, sem.limit)
+        self.assertEqual(None, sem.latency)
+
+    def test_aimd(self):
+        sem = toro.AdaptiveSemaphore(limit=4, max_limit=6)
+        for _ in range(4):
+            sem.try_acquire()
+
+        # Busy and successful: increase by one per sample, up to max_limit.
+        sem.release(latency=0.1)
+        self.assertEqual(5, sem.limit)
+        self.assertEqual(0.1, sem.latency)
+        self.assertEqual(0.1, sem.min_latency)
+        for _ in range(3):
+            sem.try_acquire()
+        sem.release(latency=0.1)
+        sem.try_acquire()
+        sem.release(latency=0.1)
+        self.assertEqual(6, sem.limit)
+
+        # Drop: multiplicative decrease.
+        sem.try_acquire()
+        sem.release(dropped=True)
+        self.assertEqual(5, sem.limit)
+
+    def test_aimd_threshold(self):
+        sem = toro.AdaptiveSemaphore(
+            limit=10, algorithm=toro.AIMDLimit(
+                backoff_ratio=0.5, latency_threshold=1))
+        sem.try_acquire()
+        sem.release(latency=2)
+        self.assertEqual(5, sem.limit)
+
+    def test_aimd_idle(self):
+        # Don't grow the limit while it's mostly unused.
+        sem = toro.AdaptiveSemaphore(limit=10)
+        sem.try_acquire()
+        sem.release(latency=0.1)
+        self.assertEqual(10, sem.limit)
+
+    def test_gradient(self):
+        sem = toro.AdaptiveSemaphore(
+            limit=16, algorithm=toro.GradientLimit(smoothing=1))
+        for _ in range(16):
+            sem.try_acquire()
+
+        # Latency at its minimum: grow by sqrt(limit).
+        sem.release(latency=0.1)
+        self.assertEqual(20, sem.limit)
+
+        # Latency far above the minimum: shrink, by at most half.
+        for _ in range(15):
+            sem.release(latency=10)
+        self.assertTrue(sem.limit < 20)
+        self.assertTrue(sem.latency > sem.min_latency)
+
+    def test_gradient_recovers(self):
+        sem = toro.AdaptiveSemaphore(limit=10, algorithm=toro.GradientLimit())
+        sem.try_acquire()
+        sem.release(dropped=True)
+        self.assertEqual(5, sem.limit)
+
+        # With the default smoothing, each sample adds under one permit:
+        # the fractions have to add up.
+        for _ in range(10):
+            n = sem.limit
+            for _ in range(n):
+                sem.try_acquire()
+            for _ in range(n):
+                sem.release(latency=0.01)
+        self.assertTrue(sem.limit >= 10)
+
+    def test_gradient_zero_latency(self):
+        sem = toro.AdaptiveSemaphore(
+            limit=16, algorithm=toro.GradientLimit(smoothing=1))
+        for _ in range(16):
+            sem.try_acquire()
+
+        # No latency at all is as good as it gets: grow.
+        sem.release(latency=0)
+        self.assertEqual(20, sem.limit)
+        sem.release(latency=0)
+        self.assertEqual(24, sem.limit)
+        self.assertEqual(14, sem.in_flight)
+
+    def test_algorithm_error(self):
+        class Broken(object):
+            def update(self, semaphore, latency, dropped):
+                raise ValueError()
+
+        sem = toro.AdaptiveSemaphore(limit=1, algorithm=Broken())
+        history = []
+        sem.try_acquire()
+        sem.acquire().add_done_callback(make_callback('acquire', history))
+        self.assertRaises(ValueError, sem.release, latency=0.1)
+
+        # The permit went to the waiter anyway.
+        self.assertEqual(['acquire'], history)
+        self.assertEqual(1, sem.in_flight)
+
+    def test_min_limit(self):
+        sem = toro.AdaptiveSemaphore(limit=2, min_limit=2)
+        sem.try_acquire()
+        sem.release(dropped=True)
+        self.assertEqual(2, sem.limit)
+
+    def test_shrink_below_in_flight(self):
+        sem = toro.AdaptiveSemaphore(
+            limit=4, algorithm=toro.AIMDLimit(backoff_ratio=0.5))
+        for _ in range(4):
+            sem.try_acquire()
+
+        history = []
+        sem.acquire().add_done_callback(make_callback('acquire', history))
+        sem.release(dropped=True)
+        self.assertEqual(2, sem.limit)
+        self.assertEqual(0, sem.counter)
+
+        # 3 in flight, limit 2: the waiter has to wait for two releases.
+        sem.release()
+        self.assertEqual([], history)
+        sem.release()
+        self.assertEqual(['acquire'], history)
+        self.assertEqual(2, sem.in_flight)
+
+    @gen_test
+    def test_context_manager_samples(self):
+        sem = toro.AdaptiveSemaphore(limit=1)
+        with (yield sem.acquire()):
+            yield pause(timedelta(seconds=0.05))
+
+        self.assertAlmostEqual(0.05, sem.latency, places=1)
+        self.assertEqual(2, sem.limit)
+
+        with assert_raises(ZeroDivisionError):
+            with (yield sem.acquire()):
+                1 / 0
+
+        self.assertEqual(1, sem.limit)
+        self.assertEqual(0, sem.in_flight)
+
+    @gen_test
+    def test_return_is_not_dropped(self):
+        sem = toro.AdaptiveSemaphore(limit=2)
+
+        @gen.coroutine
+        def f():
+            with (yield sem.acquire()):
+                sem.try_acquire()
+                raise gen.Return(42)
+
+        self.assertEqual(42, (yield f()))
+        self.assertEqual(3, sem.limit)
+        sem.release()
+
+    @gen_test
+    def test_acquire_timeout(self):
+        sem = toro.AdaptiveSemaphore(limit=1)
+        sem.acquire()
+        with assert_raises(toro.Timeout):
+            yield sem.acquire(deadline=timedelta(seconds=0.01))
+
+        sem.release()
+        self.assertEqual(0, sem.in_flight)
+
+    @gen_test
+    def test_contended(self):
+        sem = toro.AdaptiveSemaphore(limit=2)
+        active = [0]
+        peak = [0]
+
+        @gen.coroutine
+        def f():
+            with (yield sem.acquire()):
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+                self.assertTrue(active[0] <= sem.limit)
+                yield gen.Task(self.io_loop.add_callback)
+                active[0] -= 1
+
+        yield [f() for _ in range(20)]
+        self.assertEqual(0, sem.in_flight)
+        self.assertTrue(peak[0] > 2)  # The limit grew.
+
+
+class AdaptiveSemaphoreContextManagerTest(ContextManagerTestsMixin,
+                                          AsyncTestCase):
+    toro_class = staticmethod(partial(toro.AdaptiveSemaphore, 1))
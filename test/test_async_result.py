@@ -87,3 +87,22 @@ class TestAsyncResult(AsyncTestCase):
         self.assertTrue(result.ready())
         value = yield result.get(deadline=timedelta(seconds=.01))
         self.assertEqual('foo', value)
+
+    def test_ready_get_skips_deadline(self):
+        result = toro.AsyncResult(io_loop=self.io_loop)
+        result.set('foo')
+        future = result.get(deadline=timedelta(seconds=1))
+        self.assertEqual('foo', future.result())
+        self.assertEqual(0, len(toro._timer_wheel(self.io_loop)))
+
+    @gen_test
+    def test_timed_out_waiters_removed(self):
+        result = toro.AsyncResult(io_loop=self.io_loop)
+        futures = [result.get(deadline=timedelta(seconds=0.01))
+                   for _ in range(10)]
+        self.assertEqual(10, len(result.waiters))
+        for future in futures:
+            with assert_raises(toro.Timeout):
+                yield future
+
+        self.assertEqual(0, len(result.waiters))
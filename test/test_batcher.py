@@ -0,0 +1,124 @@
+"""
+Test toro.Batcher.
+"""
+
+from datetime import timedelta
+import time
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import assert_raises, pause
+
+
+class BatcherTests(AsyncTestCase):
+    def setUp(self):
+        super(BatcherTests, self).setUp()
+        self.batches = []
+
+    def double(self, items):
+        self.batches.append(items)
+        return [item * 2 for item in items]
+
+    def test_str(self):
+        batcher = toro.Batcher(self.double, max_size=5)
+        batcher.submit(1)
+        self.assertTrue('max_size=5' in str(batcher))
+        self.assertTrue('pending=1' in str(batcher))
+        self.assertEqual(1, len(batcher))
+        self.assertRaises(ValueError, toro.Batcher, self.double, 0)
+
+    def test_max_size(self):
+        batcher = toro.Batcher(self.double, max_size=3, max_delay=10)
+        futures = [batcher.submit(i) for i in range(7)]
+        self.assertEqual([[0, 1, 2], [3, 4, 5]], self.batches)
+        self.assertEqual([0, 2, 4, 6, 8, 10],
+                         [f.result() for f in futures[:6]])
+        self.assertFalse(futures[6].done())
+        batcher.flush()
+        self.assertEqual(12, futures[6].result())
+        self.assertEqual(0, len(batcher))
+
+        # Nothing to send.
+        batcher.flush()
+        self.assertEqual(3, len(self.batches))
+
+    @gen_test
+    def test_max_delay(self):
+        batcher = toro.Batcher(
+            self.double, max_delay=timedelta(seconds=0.02))
+        start = time.time()
+
+        @gen.coroutine
+        def caller(i):
+            if i % 2:
+                yield pause(timedelta(seconds=0.01))
+            raise gen.Return((yield batcher.submit(i)))
+
+        results = yield [caller(i) for i in range(6)]
+        self.assertEqual([0, 2, 4, 6, 8, 10], results)
+        self.assertEqual([[0, 2, 4, 1, 3, 5]], self.batches)
+        self.assertAlmostEqual(0.02, time.time() - start, places=1)
+
+    @gen_test
+    def test_async_fn(self):
+        @gen.coroutine
+        def fn(items):
+            yield pause(timedelta(seconds=0.01))
+            raise gen.Return([str(item) for item in items])
+
+        batcher = toro.Batcher(fn, max_delay=0.01)
+        results = yield [batcher.submit(i) for i in range(3)]
+        self.assertEqual(['0', '1', '2'], results)
+
+    @gen_test
+    def test_errors(self):
+        def fail(items):
+            raise ZeroDivisionError()
+
+        batcher = toro.Batcher(fail, max_size=2)
+        futures = [batcher.submit(i) for i in range(2)]
+        for future in futures:
+            with assert_raises(ZeroDivisionError):
+                yield future
+
+        @gen.coroutine
+        def fail_async(items):
+            yield pause(timedelta(seconds=0.01))
+            raise ZeroDivisionError()
+
+        batcher = toro.Batcher(fail_async, max_size=2)
+        futures = [batcher.submit(i) for i in range(2)]
+        for future in futures:
+            with assert_raises(ZeroDivisionError):
+                yield future
+
+        batcher = toro.Batcher(lambda items: items[:1], max_size=2)
+        futures = [batcher.submit(i) for i in range(2)]
+        for future in futures:
+            with assert_raises(ValueError):
+                yield future
+
+        # Not a sequence at all.
+        batcher = toro.Batcher(lambda items: None, max_size=2)
+        futures = [batcher.submit(i) for i in range(2)]
+        for future in futures:
+            with assert_raises(TypeError):
+                yield future
+
+    def test_callback_error(self):
+        def callback(future):
+            raise ZeroDivisionError()
+
+        errors = []
+        self.io_loop.handle_callback_exception = errors.append
+        batcher = toro.Batcher(self.double, max_size=2)
+        first = batcher.submit(1)
+        first.add_done_callback(callback)
+        second = batcher.submit(2)
+
+        # The error is reported, and the rest of the batch gets its results.
+        self.assertEqual([first], errors)
+        self.assertEqual(2, first.result())
+        self.assertEqual(4, second.result())
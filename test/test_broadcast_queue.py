@@ -0,0 +1,162 @@
+"""
+Test toro.BroadcastQueue.
+"""
+
+from datetime import timedelta
+from Queue import Empty, Full
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, assert_raises
+
+
+class BroadcastQueueTests(AsyncTestCase):
+    def test_str(self):
+        q = toro.BroadcastQueue(maxsize=1)
+        subscriber = q.subscribe()
+        q.put('a')
+        q.put('b')
+        self.assertTrue('BroadcastQueue' in str(q))
+        self.assertTrue('subscribers=1' in str(q))
+        self.assertTrue('putters[1]' in str(q))
+        self.assertTrue('qsize=1' in str(subscriber))
+
+    def test_constructor(self):
+        self.assertRaises(ValueError, toro.BroadcastQueue, -1)
+        self.assertRaises(ValueError, toro.BroadcastQueue, policy='foo')
+
+    def test_every_subscriber_gets_every_item(self):
+        q = toro.BroadcastQueue()
+        q.put('before')
+        a = q.subscribe()
+        b = q.subscribe()
+        self.assertTrue(a.empty())
+        for item in 'xyz':
+            q.put(item)
+
+        self.assertEqual(3, q.qsize())
+        self.assertEqual(['x', 'y', 'z'], [a.get_nowait() for _ in 'xyz'])
+        self.assertRaises(Empty, a.get_nowait)
+
+        # Items are kept for the slowest subscriber only.
+        self.assertEqual(3, q.qsize())
+        self.assertEqual('x', b.get_nowait())
+        self.assertEqual(2, q.qsize())
+        self.assertEqual(['y', 'z'], [b.get_nowait() for _ in 'yz'])
+        self.assertEqual(0, q.qsize())
+
+    def test_no_subscribers(self):
+        q = toro.BroadcastQueue(maxsize=1)
+        q.put_nowait('a')
+        q.put_nowait('b')
+        self.assertEqual(0, q.qsize())
+
+    def test_waiting_getters(self):
+        q = toro.BroadcastQueue()
+        history = []
+        subscribers = [q.subscribe() for _ in range(3)]
+        for i, subscriber in enumerate(subscribers):
+            subscriber.get().add_done_callback(make_callback(i, history))
+
+        q.put('a')
+        self.assertEqual([0, 1, 2], sorted(history))
+        self.assertEqual(0, q.qsize())
+
+    def test_block(self):
+        q = toro.BroadcastQueue(maxsize=2)
+        history = []
+        fast = q.subscribe()
+        slow = q.subscribe()
+        q.put('a')
+        q.put('b')
+        self.assertTrue(q.full())
+        self.assertRaises(Full, q.put_nowait, 'c')
+        q.put('c').add_done_callback(make_callback('put', history))
+
+        fast.get_nowait()
+        fast.get_nowait()
+        self.assertEqual([], history)
+        self.assertEqual('a', slow.get_nowait())
+        self.assertEqual(['put'], history)
+        self.assertEqual(['c'], [fast.get_nowait()])
+        self.assertEqual(['b', 'c'], [slow.get_nowait() for _ in 'bc'])
+
+    def test_drop(self):
+        q = toro.BroadcastQueue(maxsize=2, policy=toro.BroadcastQueue.DROP)
+        fast = q.subscribe()
+        slow = q.subscribe()
+        for i in range(5):
+            q.put_nowait(i)
+            self.assertEqual(i, fast.get_nowait())
+
+        self.assertEqual(0, fast.missed)
+        self.assertEqual(3, slow.missed)
+        self.assertEqual([3, 4], [slow.get_nowait() for _ in range(2)])
+        self.assertEqual(0, q.qsize())
+
+    def test_close(self):
+        q = toro.BroadcastQueue(maxsize=1)
+        history = []
+        a = q.subscribe()
+        b = q.subscribe()
+        q.put('x')
+        q.put('y').add_done_callback(make_callback('put', history))
+        a.get_nowait()
+        self.assertEqual([], history)
+
+        # Closing the slowest subscriber frees its items.
+        b.close()
+        self.assertEqual(['put'], history)
+        self.assertRaises(RuntimeError, b.get_nowait)
+        self.assertEqual('y', a.get_nowait())
+
+        a.get().add_done_callback(make_callback('get', history))
+        a.close()
+        self.assertEqual(['put', 'RuntimeError'], history)
+        self.assertEqual({}, q._cursors)
+
+    @gen_test
+    def test_get_timeout(self):
+        q = toro.BroadcastQueue()
+        subscriber = q.subscribe()
+        with assert_raises(toro.Timeout):
+            yield subscriber.get(deadline=timedelta(seconds=0.01))
+
+        q.put('a')
+        self.assertEqual('a', (yield subscriber.get()))
+
+    def test_log_compaction(self):
+        q = toro.BroadcastQueue()
+        a = q.subscribe()
+        b = q.subscribe()
+        for i in range(1000):
+            q.put(i)
+            a.get_nowait()
+            if i % 2:
+                b.get_nowait()
+                b.get_nowait()
+        self.assertTrue(len(q._log) < 200)
+
+    @gen_test
+    def test_fan_out(self):
+        q = toro.BroadcastQueue(maxsize=5)
+        results = [[] for _ in range(4)]
+
+        @gen.coroutine
+        def consumer(subscriber, result):
+            while True:
+                item = yield subscriber.get()
+                if item is None:
+                    break
+                result.append(item)
+                if len(result) % 3 == 0:
+                    yield gen.Task(self.io_loop.add_callback)
+
+        consumers = [consumer(q.subscribe(), result) for result in results]
+        for i in range(50):
+            yield q.put(i)
+        yield q.put(None)
+        yield consumers
+        self.assertEqual([range(50)] * 4, results)
@@ -0,0 +1,197 @@
+"""
+Test toro.ByteChannel.
+"""
+
+from datetime import timedelta
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, assert_raises
+
+
+class ByteChannelTests(AsyncTestCase):
+    def test_str(self):
+        channel = toro.ByteChannel(max_bytes=4)
+        channel.write('abcd')
+        channel.write('ef')
+        self.assertTrue('ByteChannel' in str(channel))
+        self.assertTrue('buffered=4' in str(channel))
+        self.assertTrue('max_bytes=4' in str(channel))
+        self.assertTrue('writers[1]' in str(channel))
+        repr(channel)
+
+    def test_constructor(self):
+        self.assertRaises(ValueError, toro.ByteChannel, 0)
+        self.assertEqual(None, toro.ByteChannel().max_bytes)
+
+    def test_read(self):
+        channel = toro.ByteChannel()
+        data = 'abcdef'
+        channel.write(data)
+        channel.write('gh')
+        self.assertEqual(8, len(channel))
+
+        view = channel.read(4).result()
+        self.assertTrue(isinstance(view, memoryview))
+        self.assertEqual('abcd', view)
+
+        # A read doesn't span writes.
+        self.assertEqual('ef', channel.read(4).result())
+        self.assertEqual('gh', channel.read(4).result())
+        self.assertEqual(0, len(channel))
+        self.assertRaises(ValueError, channel.read, 0)
+
+    def test_zero_copy(self):
+        channel = toro.ByteChannel()
+        data = bytearray('abcdef')
+        channel.write(data)
+        view = channel.read_exactly(3).result()
+        data[0] = 'x'
+        self.assertEqual('xbc', view)
+
+    def test_read_exactly(self):
+        channel = toro.ByteChannel()
+        history = []
+        future = channel.read_exactly(5)
+        future.add_done_callback(make_callback('read', history))
+        channel.write('abc')
+        self.assertEqual([], history)
+        channel.write('def')
+        self.assertEqual('abcde', future.result())
+        self.assertEqual('f', channel.read_exactly(1).result())
+        self.assertRaises(ValueError, channel.read_exactly, 0)
+
+    def test_read_until(self):
+        channel = toro.ByteChannel()
+        channel.write('GET / HTTP/1.1\r')
+        future = channel.read_until('\r\n')
+        self.assertFalse(future.done())
+
+        # The delimiter spans writes.
+        channel.write('\nHost: a')
+        self.assertEqual('GET / HTTP/1.1\r\n', future.result())
+        channel.write('\r\n\r\n')
+        self.assertEqual('Host: a\r\n', channel.read_until('\r\n').result())
+        self.assertEqual('\r\n', channel.read_until('\r\n').result())
+        self.assertEqual(0, len(channel))
+        self.assertRaises(ValueError, channel.read_until, '')
+
+    def test_read_until_small_writes(self):
+        channel = toro.ByteChannel()
+        future = channel.read_until('<end>')
+        for c in 'abc<en':
+            channel.write(c)
+        self.assertFalse(future.done())
+        channel.write('d>x')
+        self.assertEqual('abc<end>', future.result())
+        self.assertEqual('x', channel.read(10).result())
+
+    def test_readers_in_order(self):
+        channel = toro.ByteChannel()
+        history = []
+        channel.read_exactly(2).add_done_callback(make_callback('a', history))
+        channel.read(5).add_done_callback(make_callback('b', history))
+        channel.write('x')
+        self.assertEqual([], history)
+        channel.write('yz')
+        self.assertEqual(['a', 'b'], history)
+
+    def test_backpressure(self):
+        channel = toro.ByteChannel(max_bytes=4)
+        history = []
+        self.assertTrue(channel.write('abc').done())
+
+        # Under the limit: a write can take the buffer over it.
+        self.assertTrue(channel.write('defg').done())
+        channel.write('h').add_done_callback(make_callback('h', history))
+        self.assertEqual(7, len(channel))
+        self.assertEqual('abc', channel.read(10).result())
+        self.assertEqual([], history)
+        self.assertEqual('defg', channel.read(10).result())
+        self.assertEqual(['h'], history)
+
+    def test_reader_lets_writers_in(self):
+        channel = toro.ByteChannel(max_bytes=2)
+        channel.write('ab')
+        channel.write('cd')
+        self.assertEqual(2, len(channel))
+
+        # Needs more than the buffer holds: admit the waiting write.
+        future = channel.read_exactly(4)
+        self.assertEqual('abcd', future.result())
+
+    def test_read_until_keeps_limit(self):
+        channel = toro.ByteChannel(max_bytes=10)
+        future = channel.read_until('\n')
+        writes = [channel.write('x' * 10) for _ in range(1000)]
+        self.assertEqual(10, len(channel))
+        self.assertEqual(1, len([write for write in writes if write.done()]))
+
+        # The line can't fit in the channel: the read fails, not the writer.
+        self.assertRaises(ValueError, future.result)
+        self.assertEqual('x' * 10, channel.read(20).result())
+        self.assertTrue(writes[1].done())
+
+    def test_read_until_max_bytes(self):
+        channel = toro.ByteChannel()
+        channel.write('abc\n')
+        future = channel.read_until('\n', max_bytes=3)
+        self.assertRaises(ValueError, future.result)
+        future = channel.read_until('\n', max_bytes=4)
+        self.assertEqual('abc\n', future.result())
+
+        future = channel.read_until('\n', max_bytes=4)
+        channel.write('ab')
+        self.assertFalse(future.done())
+        channel.write('cd')
+        self.assertRaises(ValueError, future.result)
+        self.assertEqual(4, len(channel))
+        self.assertRaises(ValueError, channel.read_until, '\r\n', max_bytes=1)
+
+    @gen_test
+    def test_write_timeout(self):
+        channel = toro.ByteChannel(max_bytes=2)
+        channel.write('ab')
+        with assert_raises(toro.Timeout):
+            yield channel.write('cd', deadline=timedelta(seconds=0.01))
+
+        self.assertEqual('ab', channel.read(10).result())
+        self.assertEqual(0, len(channel))
+
+    @gen_test
+    def test_read_timeout(self):
+        channel = toro.ByteChannel()
+        history = []
+        future = channel.read_exactly(5, deadline=timedelta(seconds=0.01))
+        channel.read(5).add_done_callback(make_callback('read', history))
+        channel.write('abc')
+        with assert_raises(toro.Timeout):
+            yield future
+
+        # The next reader got the bytes the first was waiting for.
+        self.assertEqual(['read'], history)
+        self.assertEqual(0, len(channel))
+
+    @gen_test
+    def test_pipeline(self):
+        channel = toro.ByteChannel(max_bytes=16)
+        lines = ['line %d\n' % i for i in range(100)]
+
+        @gen.coroutine
+        def writer():
+            data = ''.join(lines)
+            for i in range(0, len(data), 7):
+                yield channel.write(data[i:i + 7])
+
+        @gen.coroutine
+        def reader():
+            result = []
+            for _ in lines:
+                line = yield channel.read_until('\n')
+                result.append(line.tobytes())
+            raise gen.Return(result)
+
+        _, result = yield [writer(), reader()]
+        self.assertEqual(lines, result)
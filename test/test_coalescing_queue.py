@@ -0,0 +1,105 @@
+"""
+Test toro.CoalescingQueue.
+"""
+
+from datetime import timedelta
+from Queue import Full
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, assert_raises
+
+
+class CoalescingQueueTests(AsyncTestCase):
+    def test_str(self):
+        q = toro.CoalescingQueue()
+        q.put('a', 1)
+        self.assertTrue("('a', 1)" in str(q))
+        self.assertTrue('tasks=1' in str(q))
+
+    def test_coalesce(self):
+        q = toro.CoalescingQueue()
+        q.put('a', 1)
+        q.put('b', 1)
+        q.put('a', 2)
+        self.assertEqual(2, q.qsize())
+        self.assertEqual(2, q.unfinished_tasks)
+        self.assertEqual(('a', 2), q.get_nowait())
+        self.assertEqual(('b', 1), q.get_nowait())
+
+        # Once got, a key is new again.
+        q.put('a', 3)
+        self.assertEqual(3, q.unfinished_tasks)
+        self.assertEqual(('a', 3), q.get_nowait())
+
+    def test_move_to_back(self):
+        q = toro.CoalescingQueue(move_to_back=True)
+        q.put('a', 1)
+        q.put('b', 1)
+        q.put('a', 2)
+        self.assertEqual([('b', 1), ('a', 2)], q.get_many(5).result())
+
+    def test_maxsize(self):
+        q = toro.CoalescingQueue(maxsize=2)
+        history = []
+        q.put_nowait('a', 1)
+        q.put_nowait('b', 1)
+        self.assertTrue(q.full())
+        self.assertRaises(Full, q.put_nowait, 'c', 1)
+
+        # A waiting key is replaced at once, full or not.
+        self.assertTrue(q.put('a', 2).done())
+        q.put_nowait('b', 2)
+        q.put('c', 1).add_done_callback(make_callback('put', history))
+        self.assertEqual([], history)
+        self.assertEqual(('a', 2), q.get_nowait())
+        self.assertEqual(['put'], history)
+        self.assertEqual([('b', 2), ('c', 1)], q.get_many(5).result())
+
+    def test_waiting_putters_coalesce(self):
+        q = toro.CoalescingQueue(maxsize=1)
+        q.put('a', 1)
+        q.put('b', 1)
+        q.put('b', 2)
+        self.assertEqual(('a', 1), q.get_nowait())
+        self.assertEqual(('b', 2), q.get_nowait())
+        self.assertTrue(q.empty())
+        q.task_done()
+        q.task_done()
+        self.assertRaises(ValueError, q.task_done)
+
+    def test_getter(self):
+        q = toro.CoalescingQueue()
+        future = q.get()
+        q.put('a', 1)
+        self.assertEqual(('a', 1), future.result())
+
+    @gen_test
+    def test_put_timeout(self):
+        q = toro.CoalescingQueue(maxsize=1)
+        q.put('a', 1)
+        with assert_raises(toro.Timeout):
+            yield q.put('b', 1, deadline=timedelta(seconds=0.01))
+
+        self.assertEqual(1, q.unfinished_tasks)
+
+    @gen_test
+    def test_join(self):
+        q = toro.CoalescingQueue()
+        processed = []
+
+        @gen.coroutine
+        def consumer():
+            while True:
+                key, value = yield q.get()
+                processed.append((key, value))
+                yield gen.Task(self.io_loop.add_callback)
+                q.task_done()
+
+        for i in range(10):
+            q.put(i % 3, i)
+        consumer()
+        yield q.join()
+        self.assertEqual([(0, 9), (1, 7), (2, 8)], processed)
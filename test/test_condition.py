@@ -134,3 +134,34 @@ class TestCondition(AsyncTestCase):
 
         c.notify_all()
         self.assertEqual(['Timeout', 0, 2], history)
+
+    @gen_test
+    def test_timed_out_waiters_removed(self):
+        # Waiters unlink themselves on timeout, wherever they are in line.
+        c = toro.Condition(self.io_loop)
+        history = []
+        c.wait().add_done_callback(make_callback(0, history))
+        for i in range(10):
+            c.wait(deadline=timedelta(seconds=0.01))
+
+        c.wait().add_done_callback(make_callback(1, history))
+        self.assertEqual(12, len(c.waiters))
+        yield gen.Task(self.io_loop.add_timeout, timedelta(seconds=0.05))
+        self.assertEqual(2, len(c.waiters))
+        c.notify_all()
+        self.assertEqual([0, 1], history)
+        self.assertEqual(0, len(c.waiters))
+
+    def test_waiters_resolved_elsewhere(self):
+        # A waiter resolved by someone else doesn't count as waiting.
+        c = toro.Condition(self.io_loop)
+        history = []
+        c.wait().set_result(None)
+        self.assertFalse(c.waiters)
+        c.notify()
+        c.wait().set_result(None)
+        c.wait().add_done_callback(make_callback(0, history))
+        self.assertTrue(c.waiters)
+        c.notify_all()
+        self.assertEqual([0], history)
+        self.assertFalse(c.waiters)
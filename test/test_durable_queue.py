@@ -0,0 +1,178 @@
+"""
+Test toro.DurableQueue.
+"""
+
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, pause
+
+
+class DurableQueueTests(AsyncTestCase):
+    def setUp(self):
+        super(DurableQueueTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'queue')
+        self.queues = []
+
+    def tearDown(self):
+        for q in self.queues:
+            q.close()
+        shutil.rmtree(self.directory)
+        super(DurableQueueTests, self).tearDown()
+
+    def make_queue(self, **kwargs):
+        q = toro.DurableQueue(self.path, **kwargs)
+        self.queues.append(q)
+        return q
+
+    def logs(self):
+        return sorted(
+            name for name in os.listdir(self.path) if name.endswith('.log'))
+
+    def test_constructor(self):
+        self.assertRaises(ValueError, toro.DurableQueue, self.path,
+                          sync_interval=-1)
+
+    def test_replay(self):
+        q = self.make_queue()
+        q.put_many(['a', {'b': 1}, ('c', None)])
+        self.assertEqual('a', q.get_nowait())
+        q.task_done()
+
+        # Got, but not done: replayed.
+        self.assertEqual({'b': 1}, q.get_nowait())
+        q.close()
+
+        q = self.make_queue()
+        self.assertEqual(2, q.qsize())
+        self.assertEqual(2, q.unfinished_tasks)
+        self.assertEqual([{'b': 1}, ('c', None)], q.get_many(5).result())
+
+        # New items follow the replayed ones.
+        q.put('d')
+        q.task_done()
+        q.task_done()
+        q.close()
+        q = self.make_queue()
+        self.assertEqual(['d'], q.get_many(5).result())
+
+    def test_crash(self):
+        q = self.make_queue(sync_interval=0)
+        q.put_many(range(5))
+        q.get_nowait()
+        q.task_done()
+
+        # Without close(): the next queue sees what was synced.
+        q = self.make_queue()
+        self.assertEqual(range(1, 5), q.get_many(10).result())
+
+    def test_torn_record(self):
+        q = self.make_queue()
+        q.put_many(['a', 'b'])
+        q.close()
+        log = os.path.join(self.path, self.logs()[0])
+        with open(log, 'r+b') as f:
+            data = f.read(100)
+            # Corrupt the last byte of 'b'.
+            end = len(data.rstrip('\0')) - 1
+            f.seek(end)
+            f.write('\xff')
+
+        q = self.make_queue()
+        self.assertEqual(['a'], q.get_many(5).result())
+
+        # Appends overwrite the torn record.
+        q.put('c')
+        q.close()
+        q = self.make_queue()
+        self.assertEqual(['a', 'c'], q.get_many(5).result())
+
+    def test_segments(self):
+        q = self.make_queue(segment_bytes=64)
+        q.put_many(range(20))
+        self.assertTrue(len(self.logs()) > 3)
+
+        # A record larger than a segment gets a segment of its own.
+        q.put('x' * 1000)
+        for _ in range(20):
+            q.get_nowait()
+            q.task_done()
+        q.sync()
+        self.assertEqual(1, len(self.logs()))
+        q.close()
+
+        q = self.make_queue(segment_bytes=64)
+        self.assertEqual(['x' * 1000], q.get_many(5).result())
+        q.task_done()
+        q.put('y')
+        q.sync()
+        self.assertEqual(1, len(self.logs()))
+
+    def test_reopen_bounded(self):
+        q = self.make_queue(maxsize=2)
+        q.put_many([1, 2])
+        q.get_nowait()
+        q.get_nowait()
+        q.put_many([3, 4])
+        q.close()
+
+        # Items got but not done are replayed too, beyond maxsize.
+        q = self.make_queue(maxsize=2)
+        self.assertEqual(4, q.qsize())
+        self.assertEqual(4, q.unfinished_tasks)
+        history = []
+        q.put(5).add_done_callback(make_callback('put', history))
+        self.assertEqual([1, 2, 3], q.get_many(3).result())
+        self.assertEqual(['put'], history)
+        self.assertEqual([4, 5], q.get_many(5).result())
+
+    def test_closed(self):
+        q = self.make_queue(maxsize=1)
+        history = []
+        q.put('a')
+        q.put('b').add_done_callback(make_callback('put', history))
+        q.close()
+        self.assertEqual(['RuntimeError'], history)
+        self.assertRaises(RuntimeError, q.put, 'c')
+        self.assertRaises(RuntimeError, q.put_nowait, 'c')
+        self.assertRaises(RuntimeError, q.put_many, ['c'])
+        self.assertRaises(RuntimeError, q.sync)
+        self.assertEqual('a', q.get_nowait())
+        self.assertRaises(RuntimeError, q.task_done)
+        q.close()  # No error.
+
+    @gen_test
+    def test_group_sync(self):
+        q = self.make_queue(sync_interval=timedelta(seconds=0.01))
+        q.put('a')
+        self.assertTrue(q._sync_timer is not None)
+        yield pause(timedelta(seconds=0.05))
+        self.assertTrue(q._sync_timer is None)
+
+    @gen_test
+    def test_join(self):
+        q = self.make_queue(maxsize=3)
+        result = []
+
+        @gen.coroutine
+        def consumer():
+            while True:
+                item = yield q.get()
+                result.append(item)
+                q.task_done()
+
+        consumer()
+        for i in range(20):
+            yield q.put(i)
+
+        yield q.join()
+        self.assertEqual(range(20), result)
+        q.close()
+        self.assertEqual(0, self.make_queue().qsize())
@@ -66,3 +66,10 @@ class TestEvent(AsyncTestCase):
         e.set()
         self.assertEqual(True, e.is_set())
         yield e.wait()
+
+    def test_set_event_shares_future(self):
+        # A set Event hands every waiter the same resolved Future.
+        e = toro.Event()
+        e.set()
+        self.assertTrue(e.wait() is e.wait())
+        self.assertTrue(e.wait().done())
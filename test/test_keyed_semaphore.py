@@ -0,0 +1,161 @@
+"""
+Test toro.KeyedSemaphore.
+"""
+
+from datetime import timedelta
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, assert_raises
+
+
+class KeyedSemaphoreTests(AsyncTestCase):
+    def test_str(self):
+        sem = toro.KeyedSemaphore(2, max_total=5)
+        sem.acquire('a')
+        self.assertTrue('KeyedSemaphore' in str(sem))
+        self.assertTrue('value=2' in str(sem))
+        self.assertTrue('keys=1' in str(sem))
+        self.assertTrue('max_total=5' in str(sem))
+        repr(sem)
+
+    def test_constructor(self):
+        self.assertRaises(ValueError, toro.KeyedSemaphore, 0)
+        self.assertRaises(ValueError, toro.KeyedSemaphore, 1, 0)
+
+    def test_per_key(self):
+        sem = toro.KeyedSemaphore(2)
+        self.assertTrue(sem.acquire('a').done())
+        self.assertTrue(sem.acquire('a').done())
+        self.assertTrue(sem.locked('a'))
+        self.assertEqual(0, sem.counter('a'))
+
+        # Other keys are independent.
+        self.assertFalse(sem.locked('b'))
+        self.assertEqual(2, sem.counter('b'))
+        self.assertTrue(sem.try_acquire('b'))
+
+        history = []
+        sem.acquire('a').add_done_callback(make_callback('a', history))
+        self.assertFalse(sem.try_acquire('a'))
+        sem.release('b')
+        self.assertEqual([], history)
+        sem.release('a')
+        self.assertEqual(['a'], history)
+        self.assertEqual(2, sem.total)
+
+    def test_idle_keys_freed(self):
+        sem = toro.KeyedSemaphore(1)
+        for i in range(100):
+            sem.acquire(i)
+        self.assertEqual(100, len(sem))
+        for i in range(100):
+            sem.release(i)
+        self.assertEqual(0, len(sem))
+
+        # A failed try_acquire or a locked() check doesn't create state.
+        sem.acquire('a')
+        self.assertFalse(sem.try_acquire('a'))
+        self.assertFalse(sem.locked('b'))
+        self.assertEqual(1, len(sem))
+
+    def test_release_unheld(self):
+        sem = toro.KeyedSemaphore(2)
+        self.assertRaises(ValueError, sem.release, 'a')
+        sem.acquire('a')
+        sem.release('a')
+        self.assertRaises(ValueError, sem.release, 'a')
+
+    @gen_test
+    def test_timeout_frees_key(self):
+        sem = toro.KeyedSemaphore(1)
+        sem.acquire('a')
+        with assert_raises(toro.Timeout):
+            yield sem.acquire('a', deadline=timedelta(seconds=0.01))
+
+        sem.release('a')
+        self.assertEqual(0, len(sem))
+
+    def test_max_total(self):
+        sem = toro.KeyedSemaphore(2, max_total=3)
+        history = []
+        for key in 'aab':
+            sem.acquire(key)
+        self.assertEqual(3, sem.total)
+        self.assertTrue(sem.locked('c'))
+        self.assertFalse(sem.try_acquire('c'))
+
+        # 'c' and 'd' wait for a global unit, 'a' for its key.
+        for key in 'cad':
+            sem.acquire(key).add_done_callback(make_callback(key, history))
+
+        # Releasing 'a' lets the second 'a' join the global line behind 'd'.
+        sem.release('a')
+        self.assertEqual(['c'], history)
+        sem.release('b')
+        self.assertEqual(['c', 'd'], history)
+        sem.release('c')
+        self.assertEqual(['c', 'd', 'a'], history)
+        self.assertEqual(3, sem.total)
+
+        # A waiter's reserved unit of its key can't be released.
+        sem.acquire('e')
+        self.assertRaises(ValueError, sem.release, 'e')
+
+    @gen_test
+    def test_max_total_timeout(self):
+        sem = toro.KeyedSemaphore(1, max_total=1)
+        history = []
+        sem.acquire('a')
+        waiter = sem.acquire('b', deadline=timedelta(seconds=0.01))
+        sem.acquire('b').add_done_callback(make_callback('b', history))
+        with assert_raises(toro.Timeout):
+            yield waiter
+
+        # The second 'b' took the first one's place in the global line.
+        sem.release('a')
+        self.assertEqual(['b'], history)
+        sem.release('b')
+        self.assertEqual(0, len(sem))
+        self.assertEqual(0, sem.total)
+
+    @gen_test
+    def test_context_manager(self):
+        sem = toro.KeyedSemaphore(2)
+        with (yield sem.acquire('a')) as yielded:
+            self.assertTrue(yielded is None)
+            self.assertEqual(1, sem.counter('a'))
+
+        self.assertEqual(0, len(sem))
+
+        with assert_raises(ZeroDivisionError):
+            with (yield sem.acquire('a')):
+                1 / 0
+
+        self.assertEqual(0, len(sem))
+
+        with assert_raises(RuntimeError):
+            with sem:
+                pass
+
+    @gen_test
+    def test_contended(self):
+        sem = toro.KeyedSemaphore(2, max_total=5)
+        active = {}
+        peak = {}
+
+        @gen.coroutine
+        def f(key):
+            with (yield sem.acquire(key)):
+                active[key] = active.get(key, 0) + 1
+                peak[key] = max(peak.get(key, 0), active[key])
+                self.assertTrue(sum(active.values()) <= 5)
+                yield gen.Task(self.io_loop.add_callback)
+                active[key] -= 1
+
+        yield [f(i % 4) for i in range(40)]
+        self.assertEqual(dict((i, 2) for i in range(4)), peak)
+        self.assertEqual(0, len(sem))
+        self.assertEqual(0, sem.total)
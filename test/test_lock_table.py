@@ -0,0 +1,104 @@
+"""
+Test toro.LockTable.
+"""
+
+from datetime import timedelta
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, assert_raises
+
+
+class BaseLockTableTests(object):
+    stripes = None
+
+    def make_table(self):
+        return toro.LockTable(stripes=self.stripes)
+
+    def test_acquire_release(self):
+        table = self.make_table()
+        self.assertFalse(table.locked('a'))
+        self.assertTrue(table.acquire('a').done())
+        self.assertTrue(table.locked('a'))
+        self.assertFalse(table.acquire('a').done())
+        table.release('a')
+        self.assertTrue(table.locked('a'))
+        table.release('a')
+        self.assertFalse(table.locked('a'))
+        self.assertRaises(RuntimeError, table.release, 'a')
+
+    def test_acquire_callback(self):
+        table = self.make_table()
+        history = []
+        table.acquire('a').add_done_callback(make_callback('acq1', history))
+        table.acquire('a').add_done_callback(make_callback('acq2', history))
+        table.release('a')
+        history.append('release')
+        self.assertEqual(['acq1', 'acq2', 'release'], history)
+
+    @gen_test
+    def test_acquire_timeout(self):
+        table = self.make_table()
+        yield table.acquire('a')
+        with assert_raises(toro.Timeout):
+            yield table.acquire('a', deadline=timedelta(seconds=0.01))
+
+        self.assertTrue(table.locked('a'))
+        table.release('a')
+        self.assertFalse(table.locked('a'))
+
+    @gen_test
+    def test_context_manager(self):
+        table = self.make_table()
+        history = []
+
+        @gen.coroutine
+        def f(key, i):
+            with (yield table.acquire(key)):
+                history.append((key, i))
+                yield gen.Task(self.io_loop.add_callback)
+                history.append((key, i))
+
+        yield [f(key, i) for key in 'ab' for i in range(3)]
+        for key in 'ab':
+            # Each key's critical sections didn't overlap.
+            events = [i for k, i in history if k == key]
+            self.assertEqual([0, 0, 1, 1, 2, 2], events)
+            self.assertFalse(table.locked(key))
+
+        with assert_raises(RuntimeError):
+            with table:
+                pass
+
+
+class LazyLockTableTests(BaseLockTableTests, AsyncTestCase):
+    def test_keys_dropped(self):
+        table = self.make_table()
+        for i in range(100):
+            table.acquire(i)
+        self.assertTrue('keys=100' in str(table))
+        for i in range(100):
+            table.release(i)
+        self.assertTrue('keys=0' in str(table))
+
+    def test_independent_keys(self):
+        table = self.make_table()
+        self.assertTrue(table.acquire('a').done())
+        self.assertTrue(table.acquire('b').done())
+
+
+class StripedLockTableTests(BaseLockTableTests, AsyncTestCase):
+    stripes = 8
+
+    def test_str(self):
+        self.assertTrue('stripes=8' in str(self.make_table()))
+        self.assertRaises(ValueError, toro.LockTable, 0)
+
+    def test_shared_stripe(self):
+        table = toro.LockTable(stripes=1)
+        table.acquire('a')
+        self.assertTrue(table.locked('b'))
+        self.assertFalse(table.acquire('b').done())
+
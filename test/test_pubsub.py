@@ -0,0 +1,153 @@
+"""
+Test toro.PubSub.
+"""
+
+from datetime import timedelta
+from Queue import Empty
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, assert_raises
+
+
+class PubSubTests(AsyncTestCase):
+    def test_str(self):
+        hub = toro.PubSub(maxsize=5)
+        subscription = hub.subscribe('a.*')
+        self.assertTrue('subscriptions=1' in str(hub))
+        self.assertTrue('policy=block' in str(hub))
+        self.assertTrue("pattern='a.*'" in str(subscription))
+
+    def test_constructor(self):
+        self.assertRaises(ValueError, toro.PubSub, -1)
+        self.assertRaises(ValueError, toro.PubSub, policy='foo')
+
+    def test_patterns(self):
+        hub = toro.PubSub()
+        patterns = ['a.b.c', 'a.*.c', 'a.#', '#', '*.b', 'a.b.c.#', 'x']
+        subscriptions = dict((p, hub.subscribe(p)) for p in patterns)
+        self.assertEqual(len(patterns), len(hub))
+        expected = {
+            'a.b.c': ['a.b.c', 'a.*.c', 'a.#', '#', 'a.b.c.#'],
+            'a.x.c': ['a.*.c', 'a.#', '#'],
+            'a': ['a.#', '#'],
+            'z.b': ['#', '*.b'],
+            'a.b': ['a.#', '#', '*.b'],
+            'y': ['#'],
+        }
+
+        for topic, matches in sorted(expected.items()):
+            hub.publish(topic, 'message')
+            for pattern, subscription in subscriptions.items():
+                if pattern in matches:
+                    self.assertEqual(
+                        (topic, 'message'), subscription.get_nowait())
+                else:
+                    self.assertRaises(Empty, subscription.get_nowait)
+
+    def test_bad_patterns(self):
+        hub = toro.PubSub()
+        self.assertRaises(ValueError, hub.subscribe, 'a.#.b')
+        self.assertRaises(ValueError, hub.publish, 'a.*', None)
+        self.assertRaises(ValueError, hub.publish, 'a.#', None)
+
+    def test_close(self):
+        hub = toro.PubSub()
+        a = hub.subscribe('a.b.c')
+        b = hub.subscribe('a.b.#')
+        hub.publish('a.b.c', 1)
+        a.close()
+        a.close()
+        hub.publish('a.b.c', 2)
+        self.assertEqual(('a.b.c', 1), a.get_nowait())
+        self.assertRaises(Empty, a.get_nowait)
+        self.assertEqual(2, b.qsize())
+
+        # The trie is pruned.
+        b.close()
+        self.assertEqual(0, len(hub))
+        self.assertEqual({}, hub._root.children)
+
+    def test_drop_newest(self):
+        hub = toro.PubSub(maxsize=2, policy=toro.PubSub.DROP_NEWEST)
+        subscription = hub.subscribe('t')
+        for i in range(4):
+            self.assertTrue(hub.publish('t', i).done())
+        self.assertEqual(2, subscription.dropped)
+        self.assertEqual([0, 1], [subscription.get_nowait()[1]
+                                  for _ in range(2)])
+
+    def test_drop_oldest(self):
+        hub = toro.PubSub(maxsize=2, policy=toro.PubSub.DROP_OLDEST)
+        subscription = hub.subscribe('t')
+        for i in range(4):
+            hub.publish('t', i)
+        self.assertEqual(2, subscription.dropped)
+        self.assertEqual([2, 3], [subscription.get_nowait()[1]
+                                  for _ in range(2)])
+
+    def test_block(self):
+        hub = toro.PubSub(maxsize=1)
+        history = []
+        a = hub.subscribe('t')
+        b = hub.subscribe('t')
+        hub.publish('t', 1)
+        hub.publish('t', 2).add_done_callback(make_callback('publish', history))
+        a.get_nowait()
+        self.assertEqual([], history)
+        b.get_nowait()
+        self.assertEqual(['publish'], history)
+
+    def test_close_unblocks_publishers(self):
+        hub = toro.PubSub(maxsize=1)
+        history = []
+        a = hub.subscribe('t')
+        b = hub.subscribe('t')
+        hub.publish('t', 1)
+        hub.publish('t', 2).add_done_callback(make_callback('publish', history))
+        a.get_nowait()
+        self.assertEqual([], history)
+
+        # b is closed without reading: the publisher waits only for a.
+        b.close()
+        self.assertEqual(['publish'], history)
+        self.assertEqual(('t', 2), a.get_nowait())
+        self.assertEqual(('t', 1), b.get_nowait())
+        self.assertRaises(Empty, b.get_nowait)
+
+    @gen_test
+    def test_block_timeout(self):
+        hub = toro.PubSub(maxsize=1)
+        a = hub.subscribe('t')
+        hub.publish('t', 1)
+        with assert_raises(toro.Timeout):
+            yield hub.publish('t', 2, deadline=timedelta(seconds=0.01))
+
+        self.assertEqual(1, a.qsize())
+
+    @gen_test
+    def test_subscribers(self):
+        hub = toro.PubSub(maxsize=2)
+        received = {}
+
+        @gen.coroutine
+        def subscriber(region):
+            subscription = hub.subscribe('orders.%s.*' % region)
+            received[region] = []
+            while True:
+                topic, message = yield subscription.get()
+                if message is None:
+                    break
+                received[region].append(message)
+
+        subscribers = [subscriber(region) for region in ('eu', 'us')]
+        for i in range(10):
+            yield hub.publish('orders.eu.created', i)
+            yield hub.publish('orders.us.created', -i)
+        yield hub.publish('orders.eu.done', None)
+        yield hub.publish('orders.us.done', None)
+        yield subscribers
+        self.assertEqual(range(10), received['eu'])
+        self.assertEqual([-i for i in range(10)], received['us'])
@@ -8,6 +8,7 @@ There are three sections, one each for tests that are
 3. written specifically for Toro.
 """
 
+import collections
 import time
 from datetime import timedelta
 from Queue import Empty, Full
@@ -343,6 +344,21 @@ class TestQueue3(AsyncTestCase):
         self.assertEqual(1, q.get_nowait())
         yield future
 
+    def test_fast_path_skips_deadline(self):
+        # Operations that complete immediately don't schedule a timeout.
+        q = toro.Queue(maxsize=1)
+        wheel = toro._timer_wheel(self.io_loop)
+        q.put(1, deadline=timedelta(seconds=1))
+        self.assertEqual(0, len(wheel))
+        self.assertEqual(1, q.get(deadline=timedelta(seconds=1)).result())
+        self.assertEqual(0, len(wheel))
+
+        # Now the get has to wait.
+        q.get(deadline=timedelta(seconds=1))
+        self.assertEqual(1, len(wheel))
+        q.put_nowait(2)
+        self.assertEqual(0, len(wheel))
+
     @gen_test
     def test_put_nowait_unblocks_getter(self):
         q = toro.Queue(maxsize=1)
@@ -400,6 +416,38 @@ class TestQueueTimeouts3(AsyncTestCase):
         self.assertAlmostEqual(0.1, duration, places=1)
 
 
+    @gen_test
+    def test_timed_out_putters_removed(self):
+        q = toro.Queue(1)
+        q.put_nowait(0)
+        q.put(1)
+        q.put(2, deadline=timedelta(seconds=0.01))
+        q.put(3)
+        self.assertEqual(3, len(q.putters))
+        yield pause(timedelta(seconds=0.05))
+        self.assertEqual(2, len(q.putters))
+        self.assertEqual([0, 1, 3], [q.get_nowait() for _ in range(3)])
+
+    def test_getter_resolved_elsewhere(self):
+        q = toro.Queue()
+        q.get().set_result('x')
+        q.put_nowait('a')
+        self.assertEqual('a', q.get_nowait())
+
+    @gen_test
+    def test_timed_out_getters_removed(self):
+        q = toro.Queue()
+        first = q.get()
+        q.get(deadline=timedelta(seconds=0.01))
+        last = q.get()
+        yield pause(timedelta(seconds=0.05))
+        self.assertEqual(2, len(q.getters))
+        q.put_nowait('a')
+        q.put_nowait('b')
+        self.assertEqual('a', first.result())
+        self.assertEqual('b', last.result())
+
+
 class TestJoinableQueue3(AsyncTestCase):
     def test_str(self):
         q = toro.JoinableQueue()
@@ -482,3 +530,399 @@ class TestJoinableQueue3(AsyncTestCase):
 
         q.task_done()
         yield q.join()  # The Event is set again.
+
+
+class TestQueueBatch3(AsyncTestCase):
+    type2test = toro.Queue
+    target_order = [3, 1, 4, 1, 5, 9, 2, 6]
+
+    def test_get_many_order(self):
+        # get_many returns items in the order get would.
+        items = [3, 1, 4, 1, 5, 9, 2, 6]
+        q = self.type2test()
+        q.put_many(items)
+        self.assertEqual(8, q.qsize())
+        first = q.get_many(3).result()
+        rest = q.get_many(100).result()
+        self.assertEqual(self.target_order, first + rest)
+        self.assertTrue(q.empty())
+        self.assertRaises(ValueError, q.get_many, 0)
+
+    def test_put_many_fills_free_slots(self):
+        q = self.type2test(maxsize=3)
+        q.put_nowait(0)
+        future = q.put_many([1, 2, 3, 4])
+        self.assertFalse(future.done())
+        self.assertEqual(3, q.qsize())
+        self.assertTrue('putters[1]' in str(q))
+
+        # Each item taken lets one more of the remainder in.
+        q.get_nowait()
+        self.assertFalse(future.done())
+        q.get_many(2)
+        self.assertTrue(future.done())
+        self.assertEqual(2, q.qsize())
+        self.assertFalse(q.putters)
+
+    def test_put_many_wakes_getters(self):
+        q = self.type2test()
+        history = []
+        q.get().add_done_callback(make_callback('get', history))
+        q.get_many(2).add_done_callback(make_callback('get_many', history))
+        q.get().add_done_callback(make_callback('get', history))
+        self.assertTrue(q.put_many(['a', 'b', 'c', 'd', 'e']).done())
+        self.assertEqual(['get', 'get_many', 'get'], history)
+        self.assertEqual(1, q.qsize())
+
+    def test_get_many_blocks_only_while_empty(self):
+        q = self.type2test()
+        future = q.get_many(10)
+        self.assertFalse(future.done())
+        q.put('a')
+        self.assertEqual(['a'], future.result())
+
+    def test_get_many_unblocks_putters(self):
+        q = self.type2test(maxsize=2)
+        q.put_many([1, 2])
+        put = q.put(3)
+        self.assertFalse(put.done())
+        self.assertEqual(2, len(q.get_many(5).result()))
+        self.assertTrue(put.done())
+        self.assertEqual([3], q.get_many(5).result())
+
+    @gen_test
+    def test_put_many_timeout(self):
+        q = self.type2test(maxsize=2)
+        with assert_raises(toro.Timeout):
+            yield q.put_many([1, 2, 3, 4], deadline=timedelta(seconds=0.01))
+
+        # The items that didn't fit are dropped.
+        self.assertEqual(2, q.qsize())
+        self.assertFalse(q.putters)
+
+    @gen_test
+    def test_get_many_timeout(self):
+        q = self.type2test()
+        with assert_raises(toro.Timeout):
+            yield q.get_many(5, deadline=timedelta(seconds=0.01))
+
+        self.assertFalse(q.getters)
+        q.put('a')
+        self.assertEqual(1, q.qsize())
+
+
+class TestLifoQueueBatch3(TestQueueBatch3):
+    type2test = toro.LifoQueue
+    target_order = [6, 2, 9, 5, 1, 4, 1, 3]
+
+
+class TestPriorityQueueBatch3(TestQueueBatch3):
+    type2test = toro.PriorityQueue
+    target_order = [1, 1, 2, 3, 4, 5, 6, 9]
+
+    def test_put_many_small_batch(self):
+        # A batch smaller than the heap is pushed item by item.
+        q = self.type2test()
+        q.put_many(range(10, 0, -1))
+        q.put_many([5, 0])
+        self.assertEqual([0, 1, 2, 3, 4, 5, 5],
+                         q.get_many(7).result())
+
+
+class TestJoinableQueueBatch3(TestQueueBatch3):
+    type2test = toro.JoinableQueue
+
+    @gen_test
+    def test_task_count(self):
+        q = self.type2test(maxsize=2)
+        q.get()
+        q.put_many([1, 2, 3, 4])
+
+        # Like a blocked put, a parked item counts once it's in the queue.
+        self.assertEqual(3, q.unfinished_tasks)
+        self.assertEqual(2, len(q.get_many(10).result()))
+        self.assertEqual(4, q.unfinished_tasks)
+        self.assertEqual(1, len(q.get_many(10).result()))
+        for _ in range(4):
+            q.task_done()
+
+        yield q.join()
+
+
+class TestQueueLinger3(AsyncTestCase):
+    @gen_test
+    def test_linger(self):
+        q = toro.Queue()
+        future = q.get_batch(10, linger=timedelta(seconds=0.05))
+        self.assertFalse(future.done())
+        start = time.time()
+        q.put('a')
+        q.put_many(['b', 'c'])
+        self.assertFalse(future.done())
+        self.assertEqual(0, q.qsize())
+
+        # Items arriving later in the linger window join the batch, which
+        # is due 50ms after the first item, not the last.
+        yield pause(timedelta(seconds=0.02))
+        q.put('d')
+        batch = yield future
+        self.assertEqual(['a', 'b', 'c', 'd'], batch)
+        self.assertAlmostEqual(0.05, time.time() - start, places=1)
+        self.assertFalse(q.getters)
+
+    def test_full_batch_resolves_at_once(self):
+        q = toro.Queue()
+        future = q.get_batch(3, linger=10)
+        q.put('a')
+        q.put_many(['b', 'c', 'd'])
+        self.assertEqual(['a', 'b', 'c'], future.result())
+        self.assertEqual(1, q.qsize())
+
+        # Enough items already there: no waiting.
+        q.put_many(['e', 'f'])
+        self.assertEqual(['d', 'e', 'f'], q.get_batch(3, linger=10).result())
+
+    @gen_test
+    def test_available_items_start_linger(self):
+        q = toro.Queue()
+        q.put('a')
+        future = q.get_batch(3, linger=0.01)
+        self.assertFalse(future.done())
+        self.assertEqual(['a'], (yield future))
+
+    def test_lingering_batch_is_served_first(self):
+        q = toro.Queue()
+        history = []
+        future = q.get_batch(3, linger=10)
+        q.get().add_done_callback(make_callback('get', history))
+        q.put('a')
+        q.put('b')
+        self.assertEqual([], history)
+        q.put('c')
+        self.assertEqual(['a', 'b', 'c'], future.result())
+        q.put('d')
+        self.assertEqual(['get'], history)
+
+    @gen_test
+    def test_deadline_for_first_item(self):
+        q = toro.Queue()
+        with assert_raises(toro.Timeout):
+            yield q.get_batch(3, linger=10, deadline=timedelta(seconds=0.01))
+
+        self.assertFalse(q.getters)
+
+        # Once the first item is in, only the linger bound applies.
+        future = q.get_batch(
+            3, linger=0.05, deadline=timedelta(seconds=0.01))
+        q.put('a')
+        self.assertEqual(['a'], (yield future))
+
+    def test_unblocks_putters(self):
+        q = toro.Queue(maxsize=2)
+        q.put_many(['a', 'b', 'c', 'd', 'e'])
+        future = q.get_batch(4, linger=10)
+        self.assertEqual(['a', 'b', 'c', 'd'], future.result())
+        self.assertEqual(['e'], q.get_many(5).result())
+        self.assertFalse(q.putters)
+
+    def test_no_linger(self):
+        q = toro.Queue()
+        future = q.get_batch(3, linger=0)
+        q.put_many(['a', 'b'])
+        self.assertEqual(['a', 'b'], future.result())
+        self.assertRaises(ValueError, q.get_batch, 0, 1)
+
+
+class TestQueueBytes3(AsyncTestCase):
+    def test_str(self):
+        q = toro.Queue(max_bytes=10)
+        q.put('abc')
+        self.assertTrue('bytes=3/10' in str(q))
+        self.assertEqual(10, q.max_bytes)
+        self.assertEqual(None, toro.Queue().max_bytes)
+
+    def test_constructor(self):
+        self.assertRaises(ValueError, toro.Queue, max_bytes=0)
+        self.assertRaises(ValueError, toro.Queue, max_bytes=-1)
+
+    def test_put_blocks(self):
+        q = toro.Queue(max_bytes=5)
+        history = []
+        self.assertTrue(q.put('abc').done())
+        self.assertEqual(3, q.qbytes())
+        self.assertFalse(q.full())
+        self.assertRaises(Full, q.put_nowait, 'def')
+        q.put('def').add_done_callback(make_callback('def', history))
+        self.assertEqual(['abc'], [item for item in q.queue])
+
+        # A small item waits behind the big one, first come, first served.
+        q.put('g').add_done_callback(make_callback('g', history))
+        self.assertEqual([], history)
+        self.assertEqual('abc', q.get_nowait())
+        self.assertEqual(['def', 'g'], history)
+        self.assertEqual(4, q.qbytes())
+        self.assertEqual(['def', 'g'], q.get_many(5).result())
+        self.assertEqual(0, q.qbytes())
+
+    def test_oversized_item(self):
+        q = toro.Queue(max_bytes=5)
+        history = []
+        q.put('a')
+        q.put('abcdefgh').add_done_callback(make_callback('big', history))
+        self.assertEqual([], history)
+
+        # It fits once the queue is empty, and fills it.
+        q.get_nowait()
+        self.assertEqual(['big'], history)
+        self.assertTrue(q.full())
+        self.assertEqual(8, q.qbytes())
+
+    def test_maxsize_and_max_bytes(self):
+        q = toro.Queue(maxsize=2, max_bytes=100)
+        q.put_nowait('a')
+        q.put_nowait('b')
+        self.assertTrue(q.full())
+        self.assertRaises(Full, q.put_nowait, 'c')
+
+    def test_sizeof(self):
+        q = toro.Queue(max_bytes=10, sizeof=lambda item: item)
+        q.put_many([3, 4, 5])
+        self.assertEqual(7, q.qbytes())
+        self.assertEqual(1, len(q.putters))
+        self.assertEqual(3, q.get_nowait())
+        self.assertEqual(9, q.qbytes())
+        self.assertFalse(q.putters)
+
+        # A sizeof without max_bytes only tracks the total.
+        q = toro.Queue(sizeof=len)
+        q.put_many(['abc'] * 100)
+        self.assertEqual(300, q.qbytes())
+        self.assertFalse(q.full())
+        self.assertEqual(0, toro.Queue().qbytes())
+
+    def test_getter_takes_oversized_item(self):
+        q = toro.Queue(max_bytes=2)
+        future = q.get()
+        q.put('abcd')
+        self.assertEqual('abcd', future.result())
+        self.assertEqual(0, q.qbytes())
+
+    @gen_test
+    def test_timeout_refills(self):
+        q = toro.Queue(max_bytes=5)
+        history = []
+        q.put('abc')
+        big = q.put('abcd', deadline=timedelta(seconds=0.01))
+        q.put('de').add_done_callback(make_callback('de', history))
+        with assert_raises(toro.Timeout):
+            yield big
+
+        # The small item behind the big one fit once it timed out.
+        self.assertEqual(['de'], history)
+        self.assertEqual(5, q.qbytes())
+
+    def test_subclass(self):
+        class StackQueue(toro.Queue):
+            def _init(self, maxsize):
+                self.queue = []
+
+            def _get(self):
+                return self.queue.pop()
+
+            def _put(self, item):
+                self.queue.append(item)
+
+        q = StackQueue(max_bytes=4)
+        q.put_many(['ab', 'cd', 'e'])
+        self.assertEqual(4, q.qbytes())
+        self.assertEqual('cd', q.get_nowait())
+        self.assertEqual(['e', 'ab'], q.get_many(2).result())
+        self.assertEqual(0, q.qbytes())
+
+    def test_joinable(self):
+        q = toro.JoinableQueue(max_bytes=4)
+        q.put_many(['ab', 'cd', 'e'])
+        self.assertEqual(2, q.unfinished_tasks)
+        q.get_nowait()
+        self.assertEqual(3, q.unfinished_tasks)
+        self.assertEqual(3, q.qbytes())
+
+
+class TestRingBuffer(AsyncTestCase):
+    def test_wraparound(self):
+        ring = toro._RingBuffer(3)
+        for i in range(10):
+            ring.append(i)
+            ring.append(i + 100)
+            self.assertEqual([i, i + 100], list(ring))
+            self.assertEqual(i, ring.popleft())
+            self.assertEqual(i + 100, ring.popleft())
+            self.assertFalse(ring)
+
+        self.assertRaises(IndexError, ring.popleft)
+        for i in range(3):
+            ring.append(i)
+        self.assertRaises(IndexError, ring.append, 3)
+        self.assertEqual('_RingBuffer([0, 1, 2])', repr(ring))
+
+    def test_grow(self):
+        capacity = toro._RING_PREALLOCATE * 3
+        ring = toro._RingBuffer(capacity)
+        ring.append('a')
+        ring.popleft()
+        for i in range(capacity):
+            ring.append(i)
+        self.assertEqual(range(capacity), list(ring))
+        self.assertRaises(IndexError, ring.append, capacity)
+        self.assertEqual(0, ring.popleft())
+
+    def test_bounded_queue(self):
+        q = toro.RingBufferQueue(maxsize=2)
+        self.assertTrue(isinstance(q.queue, toro._RingBuffer))
+        self.assertRaises(ValueError, toro.RingBufferQueue, 0)
+
+        # A plain Queue keeps its deque, for subclasses that rely on it.
+        self.assertTrue(
+            isinstance(toro.Queue(maxsize=2).queue, collections.deque))
+
+        # Over and over, fill the queue, wait to put, then drain it.
+        for i in range(5):
+            q.put_many(['a', 'b', 'c'])
+            self.assertEqual('a', q.get_nowait())
+            self.assertEqual(['b', 'c'], q.get_many(5).result())
+
+        self.assertTrue(q.empty())
+        self.assertFalse(q.putters)
+
+        # A fractional maxsize rounds up, like the deque-based queue's did.
+        q = toro.RingBufferQueue(maxsize=1.5)
+        q.put_many(['a', 'b', 'c'])
+        self.assertEqual(2, q.qsize())
+
+    def test_put_many_to_batch_getter(self):
+        q = toro.RingBufferQueue(maxsize=2)
+        future = q.get_many(10)
+        put = q.put_many(range(10))
+
+        # The getter gets what the queue holds; the rest queue up.
+        self.assertEqual([0, 1], future.result())
+        self.assertEqual([2, 3], q.get_many(10).result())
+        self.assertEqual([4, 5], q.get_many(10).result())
+        self.assertFalse(put.done())
+        for i in range(6, 10):
+            self.assertEqual(i, q.get_nowait())
+        self.assertTrue(put.done())
+
+    def test_bounded_subclass_uses_deque(self):
+        class PeekQueue(toro.Queue):
+            def _get(self):
+                return self.queue.pop()
+
+            def peek(self):
+                return self.queue[0]
+
+        q = PeekQueue(maxsize=2)
+        q.put('a')
+        q.put('b')
+        self.assertEqual('a', q.peek())
+        self.assertEqual('b', q.get_nowait())
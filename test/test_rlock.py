@@ -0,0 +1,129 @@
+"""
+Test toro.RLock.
+"""
+
+from datetime import timedelta
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, assert_raises, pause
+
+
+class RLockTests(AsyncTestCase):
+    def test_str(self):
+        lock = toro.RLock()
+        # No errors in various states.
+        str(lock)
+        with toro.owner_context():
+            lock.acquire()
+            lock.acquire()
+        self.assertTrue('count=2' in str(lock))
+
+    def test_no_owner(self):
+        lock = toro.RLock()
+        self.assertRaises(RuntimeError, lock.acquire)
+        self.assertRaises(RuntimeError, lock.release)
+        self.assertFalse(lock.owned())
+
+    def test_reentrant(self):
+        lock = toro.RLock()
+        with toro.owner_context():
+            self.assertTrue(lock.acquire().done())
+            self.assertTrue(lock.acquire().done())
+            self.assertTrue(lock.owned())
+            lock.release()
+            self.assertTrue(lock.locked())
+            lock.release()
+            self.assertFalse(lock.locked())
+            self.assertRaises(RuntimeError, lock.release)
+
+    def test_other_owner(self):
+        lock = toro.RLock()
+        history = []
+        first = toro.owner_context()
+        with first:
+            lock.acquire()
+
+        with toro.owner_context():
+            lock.acquire().add_done_callback(make_callback('second', history))
+            self.assertFalse(lock.owned())
+            self.assertRaises(RuntimeError, lock.release)
+
+        self.assertEqual([], history)
+        with first:
+            lock.release()
+
+        self.assertEqual(['second'], history)
+        self.assertTrue(lock.locked())
+
+    @gen_test
+    def test_nested_coroutines(self):
+        lock = toro.RLock()
+        history = []
+
+        @gen.coroutine
+        def inner(name):
+            with (yield lock.acquire()):
+                self.assertTrue(lock.owned())
+                yield pause(timedelta(seconds=0.01))
+                history.append(name + ' inner')
+
+        @gen.coroutine
+        def outer(name):
+            with (yield lock.acquire()):
+                history.append(name + ' outer')
+                yield inner(name)
+                yield pause(timedelta(seconds=0.01))
+                yield inner(name)
+
+        futures = []
+        for name in ('a', 'b'):
+            with toro.owner_context():
+                futures.append(outer(name))
+
+        yield futures
+        self.assertEqual([
+            'a outer', 'a inner', 'a inner',
+            'b outer', 'b inner', 'b inner',
+        ], history)
+        self.assertFalse(lock.locked())
+
+    @gen_test
+    def test_acquire_timeout(self):
+        lock = toro.RLock()
+        with toro.owner_context():
+            lock.acquire()
+
+        with toro.owner_context():
+            future = lock.acquire(deadline=timedelta(seconds=0.01))
+
+        with assert_raises(toro.Timeout):
+            yield future
+
+        self.assertTrue('waiters' not in str(lock))
+
+    @gen_test
+    def test_context_manager_exception(self):
+        lock = toro.RLock()
+
+        @gen.coroutine
+        def f():
+            with (yield lock.acquire()):
+                with (yield lock.acquire()):
+                    1 / 0
+
+        with toro.owner_context():
+            future = f()
+
+        with assert_raises(ZeroDivisionError):
+            yield future
+
+        self.assertFalse(lock.locked())
+
+    def test_with_lock(self):
+        lock = toro.RLock()
+        with assert_raises(RuntimeError):
+            with lock:
+                pass
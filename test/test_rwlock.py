@@ -386,3 +386,344 @@ class RWLockTests3(AsyncTestCase):
 
         with assert_raises(RuntimeError):
             lock.release_read()
+
+    def test_write_independent_of_max_readers(self):
+        lock = toro.RWLock(max_readers=10 ** 9)
+        future = lock.acquire_write()
+        self.assertTrue(future.done())
+        self.assertTrue(lock.locked())
+        lock.release_write()
+        self.assertTrue(lock.acquire_write() is future)
+
+    @gen_test
+    def test_write_timeout_leaves_no_state(self):
+        lock = toro.RWLock(max_readers=3)
+        yield lock.acquire_read()
+        with assert_raises(toro.Timeout):
+            yield lock.acquire_write(deadline=timedelta(seconds=0.01))
+
+        # The timed-out writer holds nothing, so readers fill the lock.
+        yield lock.acquire_read()
+        yield lock.acquire_read()
+        self.assertTrue(lock.locked())
+        for _ in range(3):
+            lock.release_read()
+        self.assertFalse(lock.locked())
+        self.assertRaises(RuntimeError, lock.release_write)
+
+    def test_fifo(self):
+        lock = toro.RWLock(max_readers=5)
+        history = []
+        lock.acquire_read()
+        lock.acquire_write().add_done_callback(make_callback('w', history))
+
+        # A reader behind a waiting writer waits, though there's room.
+        lock.acquire_read().add_done_callback(make_callback('r1', history))
+        lock.acquire_read().add_done_callback(make_callback('r2', history))
+        self.assertEqual([], history)
+        self.assertTrue('waiters[3]' in str(lock))
+        lock.release_read()
+        self.assertEqual(['w'], history)
+
+        # Releasing the writer admits both readers.
+        lock.release_write()
+        self.assertEqual(['w', 'r1', 'r2'], history)
+        self.assertTrue('readers=2/5' in str(lock))
+
+    @gen_test
+    def test_writer_timeout_admits_readers(self):
+        lock = toro.RWLock(max_readers=5)
+        history = []
+        lock.acquire_read()
+        writer = lock.acquire_write(deadline=timedelta(seconds=0.01))
+        lock.acquire_read().add_done_callback(make_callback('r', history))
+        with assert_raises(toro.Timeout):
+            yield writer
+
+        self.assertEqual(['r'], history)
+
+
+class RWLockPolicyTests(AsyncTestCase):
+    def _waiters(self, lock, names, history):
+        for name in names:
+            if name.startswith('w'):
+                future = lock.acquire_write()
+            else:
+                future = lock.acquire_read()
+            future.add_done_callback(make_callback(name, history))
+
+    def test_str(self):
+        lock = toro.RWLock(policy=toro.RWLock.PHASE_FAIR)
+        self.assertTrue('policy=phase_fair' in str(lock))
+        self.assertEqual(toro.RWLock.PHASE_FAIR, lock.policy)
+        self.assertRaises(ValueError, toro.RWLock, 1, None, 'foo')
+        self.assertRaises(ValueError, toro.RWLock, 0)
+
+    def test_reader_preference(self):
+        lock = toro.RWLock(
+            max_readers=10, policy=toro.RWLock.READER_PREFERENCE)
+        history = []
+        lock.acquire_read()
+        self._waiters(lock, ['w1', 'r1'], history)
+
+        # The reader passes the waiting writer.
+        self.assertEqual(['r1'], history)
+        lock.release_read()
+        self.assertEqual(['r1'], history)
+        lock.release_read()
+        self.assertEqual(['r1', 'w1'], history)
+
+        # Readers waiting on a writer go before the next writer.
+        self._waiters(lock, ['w2', 'r2', 'r3'], history)
+        lock.release_write()
+        self.assertEqual(['r1', 'w1', 'r2', 'r3'], history)
+
+    def test_writer_preference(self):
+        lock = toro.RWLock(
+            max_readers=10, policy=toro.RWLock.WRITER_PREFERENCE)
+        history = []
+        lock.acquire_read()
+        self._waiters(lock, ['w1', 'r1', 'w2', 'r2'], history)
+
+        # Both writers go before any reader; then the readers go together.
+        self.assertEqual([], history)
+        lock.release_read()
+        self.assertEqual(['w1'], history)
+        lock.release_write()
+        self.assertEqual(['w1', 'w2'], history)
+        lock.release_write()
+        self.assertEqual(['w1', 'w2', 'r1', 'r2'], history)
+
+    def test_phase_fair(self):
+        lock = toro.RWLock(max_readers=10, policy=toro.RWLock.PHASE_FAIR)
+        history = []
+        lock.acquire_read()
+        self._waiters(lock, ['w1', 'r1', 'w2', 'r2'], history)
+
+        # The writer waits only for the current reader.
+        lock.release_read()
+        self.assertEqual(['w1'], history)
+
+        # Then all waiting readers go at once, ahead of the second writer.
+        lock.release_write()
+        self.assertEqual(['w1', 'r1', 'r2'], history)
+
+        # New readers wait behind the writer.
+        self._waiters(lock, ['r3'], history)
+        lock.release_read()
+        lock.release_read()
+        self.assertEqual(['w1', 'r1', 'r2', 'w2'], history)
+        lock.release_write()
+        self.assertEqual(['w1', 'r1', 'r2', 'w2', 'r3'], history)
+
+    def test_phase_fair_batch_limited(self):
+        lock = toro.RWLock(max_readers=2, policy=toro.RWLock.PHASE_FAIR)
+        history = []
+        lock.acquire_write()
+        self._waiters(lock, ['r1', 'r2', 'r3', 'w1'], history)
+        lock.release_write()
+        self.assertEqual(['r1', 'r2'], history)
+        self.assertTrue(lock.locked())
+
+    @gen_test
+    def test_writer_timeout(self):
+        for policy in (toro.RWLock.WRITER_PREFERENCE,
+                       toro.RWLock.PHASE_FAIR):
+            lock = toro.RWLock(max_readers=10, policy=policy)
+            history = []
+            lock.acquire_read()
+            writer = lock.acquire_write(deadline=timedelta(seconds=0.01))
+            self._waiters(lock, ['r1'], history)
+            self.assertEqual([], history)
+            with assert_raises(toro.Timeout):
+                yield writer
+
+            # The blocked reader is let in once no writer wants the lock.
+            self.assertEqual(['r1'], history)
+
+    @gen_test
+    def test_context_managers(self):
+        for policy in (toro.RWLock.FIFO, toro.RWLock.READER_PREFERENCE,
+                       toro.RWLock.WRITER_PREFERENCE, toro.RWLock.PHASE_FAIR):
+            lock = toro.RWLock(max_readers=3, policy=policy)
+            active = []
+
+            @gen.coroutine
+            def reader():
+                with (yield lock.acquire_read()):
+                    active.append('r')
+                    self.assertFalse('w' in active)
+                    self.assertTrue(len(active) <= 3)
+                    yield gen.Task(self.io_loop.add_callback)
+                    active.remove('r')
+
+            @gen.coroutine
+            def writer():
+                with (yield lock.acquire_write()):
+                    self.assertEqual([], active)
+                    active.append('w')
+                    yield gen.Task(self.io_loop.add_callback)
+                    active.remove('w')
+
+            yield [writer() if i % 4 == 0 else reader() for i in range(20)]
+            self.assertFalse(lock.locked())
+            self.assertTrue('readers=0/3' in str(lock))
+
+
+class RWLockUpgradeTests(AsyncTestCase):
+    def test_one_upgrader(self):
+        lock = toro.RWLock(max_readers=10)
+        history = []
+        self.assertTrue(lock.acquire_upgradeable().done())
+        self.assertTrue('upgrader' in str(lock))
+
+        # Readers share the lock with the upgrader; a second upgrader waits.
+        self.assertTrue(lock.acquire_read().done())
+        lock.acquire_upgradeable().add_done_callback(
+            make_callback('upgradeable', history))
+        self.assertEqual([], history)
+        lock.release_upgradeable()
+        self.assertEqual(['upgradeable'], history)
+        lock.release_upgradeable()
+        lock.release_read()
+        self.assertFalse(lock.locked())
+        self.assertRaises(RuntimeError, lock.release_upgradeable)
+
+    @gen_test
+    def test_upgrade(self):
+        lock = toro.RWLock(max_readers=10)
+        history = []
+        lock.acquire_upgradeable()
+        lock.acquire_read()
+        upgrade = lock.upgrade()
+        upgrade.add_done_callback(make_callback('upgrade', history))
+        self.assertTrue('upgrading' in str(lock))
+        self.assertRaises(RuntimeError, lock.upgrade)
+
+        # New readers and writers wait behind the pending upgrade.
+        lock.acquire_read().add_done_callback(make_callback('read', history))
+        lock.acquire_write().add_done_callback(
+            make_callback('write', history))
+        self.assertEqual([], history)
+        lock.release_read()
+        self.assertEqual(['upgrade'], history)
+        self.assertTrue(lock.locked())
+        self.assertRaises(RuntimeError, lock.release_write)
+
+        # Downgrade lets the waiting reader in, but not the writer.
+        lock.downgrade()
+        self.assertEqual(['upgrade', 'read'], history)
+        self.assertTrue('upgrader' in str(lock))
+        lock.release_read()
+        lock.release_upgradeable()
+        self.assertEqual(['upgrade', 'read', 'write'], history)
+
+    def test_upgrade_uncontended(self):
+        lock = toro.RWLock(max_readers=10)
+        lock.acquire_upgradeable()
+        self.assertTrue(lock.upgrade().done())
+        self.assertTrue('upgraded' in str(lock))
+        lock.release_upgradeable()
+        self.assertFalse(lock.locked())
+        self.assertTrue(lock.acquire_write().done())
+
+    def test_upgrade_without_hold(self):
+        lock = toro.RWLock(max_readers=10)
+        self.assertRaises(RuntimeError, lock.upgrade)
+        lock.acquire_read()
+        self.assertRaises(RuntimeError, lock.upgrade)
+        self.assertRaises(RuntimeError, lock.downgrade)
+
+    @gen_test
+    def test_upgrade_timeout(self):
+        lock = toro.RWLock(max_readers=10)
+        history = []
+        lock.acquire_upgradeable()
+        lock.acquire_read()
+        upgrade = lock.upgrade(deadline=timedelta(seconds=0.01))
+        lock.acquire_read().add_done_callback(make_callback('read', history))
+        with assert_raises(toro.Timeout):
+            yield upgrade
+
+        # Still an upgradeable reader; the blocked reader got in.
+        self.assertEqual(['read'], history)
+        self.assertTrue('upgrader' in str(lock))
+        self.assertFalse(lock.upgrade().done())
+
+    @gen_test
+    def test_write_downgrade(self):
+        lock = toro.RWLock(
+            max_readers=10, policy=toro.RWLock.WRITER_PREFERENCE)
+        history = []
+        with (yield lock.acquire_write()):
+            lock.acquire_read().add_done_callback(
+                make_callback('read1', history))
+            lock.acquire_write().add_done_callback(
+                make_callback('write', history))
+            lock.acquire_read().add_done_callback(
+                make_callback('read2', history))
+            lock.downgrade()
+
+            # Readers go even though a writer is waiting.
+            self.assertEqual(['read1', 'read2'], history)
+            self.assertFalse(lock.locked())
+            lock.release_read()
+            lock.release_read()
+
+        # Leaving the block released the downgraded hold.
+        self.assertEqual(['read1', 'read2', 'write'], history)
+
+    @gen_test
+    def test_write_downgrade_fifo(self):
+        lock = toro.RWLock(max_readers=10)
+        history = []
+        with (yield lock.acquire_write()):
+            lock.acquire_read().add_done_callback(
+                make_callback('read1', history))
+            lock.acquire_write().add_done_callback(
+                make_callback('write', history))
+            lock.acquire_read().add_done_callback(
+                make_callback('read2', history))
+            lock.downgrade()
+
+            # Only readers ahead of the waiting writer go.
+            self.assertEqual(['read1'], history)
+            lock.release_read()
+
+        self.assertEqual(['read1', 'write'], history)
+
+    @gen_test
+    def test_refresh_once(self):
+        lock = toro.RWLock(max_readers=10)
+        state = {'stale': True, 'refreshes': 0}
+
+        @gen.coroutine
+        def get():
+            with (yield lock.acquire_upgradeable()):
+                if state['stale']:
+                    yield lock.upgrade()
+                    yield gen.Task(self.io_loop.add_callback)
+                    state['stale'] = False
+                    state['refreshes'] += 1
+                    lock.downgrade()
+                self.assertFalse(state['stale'])
+
+        @gen.coroutine
+        def read():
+            with (yield lock.acquire_read()):
+                yield gen.Task(self.io_loop.add_callback)
+
+        yield [get() if i % 2 else read() for i in range(20)]
+        self.assertEqual(1, state['refreshes'])
+        self.assertFalse(lock.locked())
+
+    @gen_test
+    def test_context_manager(self):
+        lock = toro.RWLock(max_readers=10)
+        with (yield lock.acquire_upgradeable()) as yielded:
+            self.assertTrue(yielded is None)
+            yield lock.upgrade()
+            self.assertTrue(lock.locked())
+
+        self.assertFalse(lock.locked())
+        self.assertTrue(lock.acquire_write().done())
@@ -112,6 +112,22 @@ class BaseSemaphoreTests(object):
         sem.release()
         yield sem.acquire()
 
+    def test_try_acquire_nowait(self):
+        sem = self.semtype(2)
+        self.assertTrue(sem.try_acquire())
+        self.assertTrue(sem.try_acquire())
+        self.assertFalse(sem.try_acquire())
+        self.assertEqual(0, sem.counter)
+        sem.release()
+        self.assertTrue(sem.try_acquire())
+
+    def test_large_value(self):
+        # Construction doesn't depend on the value.
+        sem = self.semtype(10 ** 9)
+        self.assertEqual(10 ** 9, sem.counter)
+        sem.acquire()
+        self.assertEqual(10 ** 9 - 1, sem.counter)
+
     @gen_test
     def test_default_value(self):
         # The default initial value is 1.
@@ -240,6 +256,39 @@ class SemaphoreTests2(AsyncTestCase):
             'wait1', 'wait2', 'release3'
         ], history)
 
+    @gen_test
+    def test_acquire_timeout_removes_waiter(self):
+        sem = toro.Semaphore(0)
+        history = []
+        sem.acquire().add_done_callback(make_callback('acquire1', history))
+        with assert_raises(toro.Timeout):
+            yield sem.acquire(deadline=timedelta(seconds=0.01))
+
+        sem.acquire().add_done_callback(make_callback('acquire3', history))
+        self.assertTrue('waiters[2]' in str(sem))
+        sem.release()
+        sem.release()
+        self.assertEqual(['acquire1', 'acquire3'], history)
+        self.assertEqual(0, sem.counter)
+
+    def test_uncontended_acquire_shares_future(self):
+        sem = toro.Semaphore(2)
+        future = sem.acquire()
+        self.assertTrue(future is sem.acquire())
+        self.assertEqual(0, sem.counter)
+
+        # Contended acquire gets its own Future.
+        contended = sem.acquire()
+        self.assertFalse(contended is future)
+        self.assertFalse(contended.done())
+        sem.release()
+        self.assertTrue(contended.done())
+
+        # Exiting the shared context manager releases each time.
+        with future.result():
+            pass
+        self.assertEqual(1, sem.counter)
+
 
 class SemaphoreContextManagerTest(ContextManagerTestsMixin, AsyncTestCase):
 
@@ -0,0 +1,139 @@
+"""
+Test toro.SpillingQueue.
+"""
+
+import os
+import shutil
+import tempfile
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback
+
+
+class SpillingQueueTests(AsyncTestCase):
+    def setUp(self):
+        super(SpillingQueueTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(SpillingQueueTests, self).tearDown()
+
+    def make_queue(self, **kwargs):
+        return toro.SpillingQueue(directory=self.directory, **kwargs)
+
+    def files(self):
+        return os.listdir(self.directory)
+
+    def test_str(self):
+        q = self.make_queue(memory_items=2)
+        q.put_many(range(5))
+        self.assertTrue('memory=2' in str(q))
+        self.assertTrue('spilled=3' in str(q))
+        q.close()
+
+    def test_constructor(self):
+        self.assertRaises(ValueError, self.make_queue, memory_items=0)
+        self.assertRaises(ValueError, self.make_queue, segment_items=0)
+
+    def test_spill_and_read_back(self):
+        q = self.make_queue(memory_items=3, segment_items=4)
+        for i in range(20):
+            q.put_nowait(i)
+
+        self.assertEqual(20, q.qsize())
+        self.assertEqual(17, q.spilled())
+        self.assertEqual(5, len(self.files()))
+        self.assertEqual(range(20), [q.get_nowait() for _ in range(20)])
+        self.assertTrue(q.empty())
+        self.assertEqual(0, q.spilled())
+        self.assertEqual([], self.files())
+
+    def test_interleaved(self):
+        q = self.make_queue(memory_items=2, segment_items=3)
+        expected = []
+        result = []
+        n = 0
+        for i in range(50):
+            for _ in range(i % 4):
+                q.put_nowait(n)
+                expected.append(n)
+                n += 1
+            if q.qsize():
+                result.append(q.get_nowait())
+
+        while q.qsize():
+            result.append(q.get_nowait())
+        self.assertEqual(expected, result)
+        self.assertEqual([], self.files())
+
+    def test_objects(self):
+        q = self.make_queue(memory_items=1, compress=True)
+        items = [{'a': [1, 2]}, ('x' * 1000, None), u'\u1234']
+        for item in items:
+            q.put(item)
+        self.assertEqual(items, q.get_many(10).result())
+
+    def test_serializer(self):
+        class Serializer(object):
+            @staticmethod
+            def dumps(item):
+                return str(item)
+
+            @staticmethod
+            def loads(data):
+                return int(data)
+
+        q = self.make_queue(memory_items=1, serializer=Serializer)
+        q.put_many([1, 2, 3])
+        self.assertEqual([1, 2, 3], q.get_many(3).result())
+
+    def test_compress(self):
+        q = self.make_queue(memory_items=1, compress=True)
+        q.put_many(['a', 'b' * 10000])
+        path = os.path.join(self.directory, self.files()[0])
+        self.assertTrue(os.path.getsize(path) < 1000)
+        self.assertEqual(['a', 'b' * 10000], q.get_many(2).result())
+
+    def test_maxsize(self):
+        q = self.make_queue(memory_items=1, maxsize=3)
+        history = []
+        q.put_many([1, 2, 3])
+        q.put(4).add_done_callback(make_callback('put', history))
+        self.assertEqual(2, q.spilled())
+        self.assertEqual(1, q.get_nowait())
+        self.assertEqual(['put'], history)
+        self.assertEqual([2, 3, 4], q.get_many(5).result())
+
+    def test_close(self):
+        q = self.make_queue(memory_items=1)
+        q.put_many(range(10))
+        self.assertTrue(self.files())
+        q.close()
+        self.assertEqual([], self.files())
+        self.assertEqual(1, q.qsize())
+
+    @gen_test
+    def test_join(self):
+        q = self.make_queue(memory_items=5, segment_items=10)
+        result = []
+
+        @gen.coroutine
+        def consumer():
+            while True:
+                item = yield q.get()
+                result.append(item)
+                q.task_done()
+
+        for _ in range(3):
+            consumer()
+
+        for i in range(100):
+            yield q.put(i)
+
+        yield q.join()
+        self.assertEqual(range(100), sorted(result))
+        self.assertEqual([], self.files())
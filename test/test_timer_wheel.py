@@ -0,0 +1,206 @@
+"""
+Test toro's timing wheel for deadlines.
+"""
+
+from datetime import timedelta
+import time
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import assert_raises
+
+
+class FakeIOLoop(object):
+    """Just enough of an IOLoop to drive a _TimerWheel by hand."""
+    def __init__(self):
+        self.now = 1000.0
+        self.timeouts = []
+
+    def time(self):
+        return self.now
+
+    def add_timeout(self, deadline, callback):
+        timeout = [deadline, callback]
+        self.timeouts.append(timeout)
+        return timeout
+
+    def remove_timeout(self, timeout):
+        self.timeouts.remove(timeout)
+
+    def handle_callback_exception(self, callback):
+        raise
+
+    def advance(self, seconds):
+        self.now += seconds
+        for timeout in sorted(self.timeouts):
+            if timeout[0] <= self.now:
+                self.timeouts.remove(timeout)
+                timeout[1]()
+
+
+class TestTimerWheel(AsyncTestCase):
+    def setUp(self):
+        super(TestTimerWheel, self).setUp()
+        self.loop = FakeIOLoop()
+        self.wheel = toro._TimerWheel(self.loop, 1)
+
+    def test_fires_in_order(self):
+        history = []
+        for delay in (300, 5, 70000, 1, 20000):
+            self.wheel.call_at(
+                self.loop.now + delay,
+                lambda delay=delay: history.append(delay))
+
+        self.assertEqual(5, len(self.wheel))
+
+        # Never more than one IOLoop timeout for the whole wheel.
+        self.assertEqual(1, len(self.loop.timeouts))
+        for _ in range(80000):
+            self.loop.advance(1)
+            self.assertTrue(len(self.loop.timeouts) <= 1)
+
+        self.assertEqual([1, 5, 300, 20000, 70000], history)
+        self.assertEqual(0, len(self.wheel))
+
+    def test_never_early(self):
+        fired = []
+        self.wheel.call_at(self.loop.now + 2.5, lambda: fired.append(True))
+        self.loop.advance(2)
+        self.assertEqual([], fired)
+        self.loop.advance(1)
+        self.assertEqual([True], fired)
+
+    def test_past_deadline(self):
+        fired = []
+        self.wheel.call_at(self.loop.now - 10, lambda: fired.append(True))
+        self.loop.advance(0)
+        self.assertEqual([True], fired)
+
+    def test_beyond_span(self):
+        fired = []
+        delay = 2 ** 33
+        self.wheel.call_at(self.loop.now + delay, lambda: fired.append(True))
+        self.loop.advance(delay - 1)
+        self.assertEqual([], fired)
+        self.loop.advance(1)
+        self.assertEqual([True], fired)
+
+    def test_cancel(self):
+        fired = []
+        timers = [
+            self.wheel.call_at(self.loop.now + i, lambda i=i: fired.append(i))
+            for i in range(1, 4)]
+
+        timers[1].cancel()
+        timers[1].cancel()  # No error
+        self.assertEqual(2, len(self.wheel))
+        self.loop.advance(5)
+        self.assertEqual([1, 3], fired)
+
+    def test_timedelta(self):
+        fired = []
+        self.wheel.call_at(timedelta(seconds=3), lambda: fired.append(True))
+        self.loop.advance(3)
+        self.assertEqual([True], fired)
+        self.assertRaises(TypeError, self.wheel.call_at, 'foo', lambda: None)
+
+    def test_reschedule_for_sooner_timer(self):
+        fired = []
+        self.wheel.call_at(self.loop.now + 100, lambda: fired.append(100))
+        self.wheel.call_at(self.loop.now + 10, lambda: fired.append(10))
+        self.assertEqual(1, len(self.loop.timeouts))
+        self.loop.advance(10)
+        self.assertEqual([10], fired)
+
+    def test_cascade_at_level_boundary(self):
+        # When the wheel stops at a multiple of 256 ticks, the cascade due
+        # there must run before later level-0 timers fire.
+        self.loop.now = 0
+        fired = {}
+
+        def at(name, tick):
+            self.wheel.call_at(
+                tick, lambda: fired.setdefault(name, self.loop.now))
+
+        at('a', 20)
+        at('d', 255)
+        at('b', 300)  # In level 1 until the cascade at tick 256.
+        self.loop.advance(25)
+        at('c', 270)  # In level 0.
+        for _ in range(400):
+            self.loop.advance(1)
+
+        self.assertEqual(
+            {'a': 25, 'd': 255, 'c': 270, 'b': 300}, fired)
+
+    def test_deadlines_crossing_levels(self):
+        fired = []
+        start = self.loop.now
+        delays = [255, 256, 257, 511, 512, 600, 16383, 16384, 16385, 20000]
+        for delay in delays:
+            self.wheel.call_at(
+                start + delay,
+                lambda delay=delay: fired.append(
+                    (delay, self.loop.now - start)))
+
+        # Add timers between firings, so the wheel's position varies.
+        self.loop.advance(256 - self.loop.now % 256)
+        self.wheel.call_at(
+            self.loop.now + 20,
+            lambda: fired.append(('late', None)))
+        while self.loop.now - start < 20001:
+            self.loop.advance(1)
+
+        self.assertEqual(
+            [(delay, delay) for delay in delays],
+            [entry for entry in fired if entry[0] != 'late'])
+        self.assertEqual(len(delays) + 1, len(fired))
+        self.assertEqual(0, len(self.wheel))
+
+
+class TestTimerResolution(AsyncTestCase):
+    def test_set_timer_resolution(self):
+        self.assertRaises(ValueError, toro.set_timer_resolution, 0)
+        toro.set_timer_resolution(0.05, io_loop=self.io_loop)
+        self.assertEqual(0.05, toro._timer_wheel(self.io_loop).resolution)
+
+        toro.Condition(self.io_loop).wait(deadline=timedelta(seconds=1))
+        with assert_raises(RuntimeError):
+            toro.set_timer_resolution(0.01, io_loop=self.io_loop)
+
+    @gen_test
+    def test_many_waiters_one_timeout(self):
+        c = toro.Condition(self.io_loop)
+        n_timeouts = len(self.io_loop._timeouts)
+        futures = [c.wait(deadline=timedelta(seconds=0.1))
+                   for _ in range(100)]
+
+        self.assertEqual(n_timeouts + 1, len(self.io_loop._timeouts))
+        st = time.time()
+        for future in futures:
+            with assert_raises(toro.Timeout):
+                yield future
+
+        duration = time.time() - st
+        self.assertAlmostEqual(0.1, duration, places=1)
+
+    def test_io_loop(self):
+        custom_loop = IOLoop()
+        c = toro.Condition(io_loop=custom_loop)
+        history = []
+
+        @gen.coroutine
+        def f():
+            try:
+                yield c.wait(deadline=timedelta(seconds=0.01))
+            except toro.Timeout:
+                history.append('timeout')
+            custom_loop.stop()
+
+        custom_loop.add_callback(f)
+        custom_loop.start()
+        custom_loop.close(all_fds=True)
+        self.assertEqual(['timeout'], history)
@@ -0,0 +1,153 @@
+"""
+Test toro.WeightedSemaphore and toro.BoundedWeightedSemaphore.
+"""
+
+from datetime import timedelta
+
+from tornado import gen
+from tornado.testing import gen_test, AsyncTestCase
+
+import toro
+from test import make_callback, assert_raises, ContextManagerTestsMixin
+
+
+class WeightedSemaphoreTests(AsyncTestCase):
+    def test_str(self):
+        sem = toro.WeightedSemaphore(10)
+        self.assertTrue('WeightedSemaphore' in str(sem))
+        self.assertTrue('counter=10' in str(sem))
+        self.assertTrue('policy=fifo' in str(sem))
+
+    def test_constructor(self):
+        self.assertRaises(ValueError, toro.WeightedSemaphore, -1)
+        self.assertRaises(ValueError, toro.WeightedSemaphore, 1, None, 'foo')
+
+    def test_weight(self):
+        sem = toro.WeightedSemaphore(10)
+        self.assertRaises(ValueError, sem.acquire, 0)
+        self.assertRaises(ValueError, sem.release, 0)
+        self.assertTrue(sem.acquire(4).done())
+        self.assertEqual(6, sem.counter)
+        self.assertTrue(sem.acquire(6).done())
+        self.assertTrue(sem.locked())
+        sem.release(10)
+        self.assertEqual(10, sem.counter)
+
+    def test_try_acquire(self):
+        sem = toro.WeightedSemaphore(5)
+        self.assertTrue(sem.try_acquire(3))
+        self.assertFalse(sem.try_acquire(3))
+        self.assertTrue(sem.try_acquire(2))
+        self.assertEqual(0, sem.counter)
+
+    def test_release_wakes_all_that_fit(self):
+        sem = toro.WeightedSemaphore(0)
+        history = []
+        for weight in (2, 3, 4):
+            sem.acquire(weight).add_done_callback(
+                make_callback(weight, history))
+
+        sem.release(6)
+        self.assertEqual([2, 3], history)
+        self.assertEqual(1, sem.counter)
+        sem.release(3)
+        self.assertEqual([2, 3, 4], history)
+        self.assertEqual(0, sem.counter)
+
+    def test_fifo(self):
+        # A big request at the head holds back smaller ones behind it.
+        sem = toro.WeightedSemaphore(5)
+        history = []
+        sem.acquire(8).add_done_callback(make_callback(8, history))
+        sem.acquire(1).add_done_callback(make_callback(1, history))
+        self.assertEqual([], history)
+        self.assertFalse(sem.try_acquire(1))
+        sem.release(3)
+        self.assertEqual([8], history)
+        self.assertEqual(0, sem.counter)
+
+    def test_best_fit(self):
+        sem = toro.WeightedSemaphore(
+            0, policy=toro.WeightedSemaphore.BEST_FIT)
+        history = []
+        for weight in (8, 2, 3, 1):
+            sem.acquire(weight).add_done_callback(
+                make_callback(weight, history))
+
+        # The largest request that fits goes first, then the next largest.
+        sem.release(4)
+        self.assertEqual([3, 1], history)
+
+        # A new request that fits doesn't wait behind the big one.
+        sem.release(1)
+        self.assertTrue(sem.acquire(1).done())
+        sem.release(8)
+        self.assertEqual([3, 1, 8], history)
+
+    @gen_test
+    def test_timeout_unblocks_line(self):
+        sem = toro.WeightedSemaphore(5)
+        history = []
+        big = sem.acquire(8, deadline=timedelta(seconds=0.01))
+        sem.acquire(3).add_done_callback(make_callback(3, history))
+        self.assertEqual([], history)
+        with assert_raises(toro.Timeout):
+            yield big
+
+        self.assertEqual([3], history)
+        self.assertEqual(2, sem.counter)
+
+    @gen_test
+    def test_context_manager_weight(self):
+        sem = toro.WeightedSemaphore(10)
+        with (yield sem.acquire(7)):
+            self.assertEqual(3, sem.counter)
+
+        self.assertEqual(10, sem.counter)
+
+        # Contended.
+        sem.acquire(10)
+
+        @gen.coroutine
+        def f():
+            with (yield sem.acquire(4)):
+                self.assertEqual(6, sem.counter)
+
+        future = f()
+        sem.release(10)
+        yield future
+        self.assertEqual(10, sem.counter)
+
+    @gen_test
+    def test_wait(self):
+        sem = toro.WeightedSemaphore(3)
+        sem.acquire(3)
+        future = sem.wait()
+        self.assertFalse(future.done())
+        sem.release(1)
+        yield future
+
+
+class BoundedWeightedSemaphoreTests(AsyncTestCase):
+    def test_release_too_much(self):
+        sem = toro.BoundedWeightedSemaphore(5)
+        sem.acquire(3)
+        sem.release(2)
+        self.assertRaises(ValueError, sem.release, 2)
+        sem.release(1)
+        self.assertEqual(5, sem.counter)
+
+    def test_weight_too_large(self):
+        sem = toro.BoundedWeightedSemaphore(5)
+        self.assertRaises(ValueError, sem.acquire, 6)
+        self.assertRaises(ValueError, sem.try_acquire, 6)
+
+
+class WeightedSemaphoreContextManagerTest(ContextManagerTestsMixin,
+                                          AsyncTestCase):
+    toro_class = toro.WeightedSemaphore
+
+
+class BoundedWeightedSemaphoreContextManagerTest(ContextManagerTestsMixin,
+                                                 AsyncTestCase):
+    toro_class = toro.BoundedWeightedSemaphore
@@ -1,12 +1,21 @@
-import contextlib
+import datetime
 import heapq
 import collections
+import math
+import mmap
+import numbers
+import os
+import struct
+import tempfile
+import weakref
+import zlib
 from functools import partial
 from Queue import Full, Empty
+import cPickle as pickle
 
-import tornado
-from tornado import ioloop
 from tornado import gen
+from tornado import ioloop
+from tornado import stack_context
 from tornado.concurrent import Future
 
 
@@ -22,10 +31,20 @@ __all__ = [
 
     # Primitives
     'AsyncResult', 'Event', 'Condition',  'Semaphore', 'BoundedSemaphore',
-    'Lock',
+    'WeightedSemaphore', 'BoundedWeightedSemaphore', 'AdaptiveSemaphore',
+    'AIMDLimit', 'GradientLimit', 'KeyedSemaphore', 'Lock', 'RLock',
+    'owner_context', 'LockTable',
 
     # Queues
-    'Queue', 'PriorityQueue', 'LifoQueue', 'JoinableQueue'
+    'Queue', 'PriorityQueue', 'LifoQueue', 'RingBufferQueue', 'JoinableQueue',
+    'SpillingQueue', 'DurableQueue', 'CoalescingQueue', 'BroadcastQueue',
+    'PubSub', 'ByteChannel',
+
+    # Batching
+    'Batcher',
+
+    # Configuration
+    'set_timer_resolution',
 ]
 
 
@@ -47,8 +66,279 @@ class Timeout(Exception):
         return "Timeout"
 
 
+def _timedelta_to_seconds(td):
+    """Equivalent to td.total_seconds() (introduced in Python 2.7)."""
+    return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10 ** 6) \
+        / float(10 ** 6)
+
+
+class _WheelTimer(object):
+    """A callback scheduled in a :class:`_TimerWheel`."""
+
+    # Reduce memory overhead when there are lots of pending waiters.
+    __slots__ = ('wheel', 'expiry', 'callback', 'slot')
+
+    def __init__(self, wheel, expiry, callback):
+        self.wheel = wheel
+        self.expiry = expiry
+        self.callback = callback
+        self.slot = None
+
+    def cancel(self):
+        """Unschedule the callback. Safe to call more than once."""
+        if self.slot is not None:
+            self.slot.discard(self)
+            self.slot = None
+            self.wheel._count -= 1
+
+
+class _TimerWheel(object):
+    """A hierarchical timing wheel that runs callbacks on an IOLoop.
+
+    All Toro deadlines on an IOLoop share one wheel, so scheduling and
+    cancelling a deadline are O(1) and the IOLoop holds a single timeout for
+    the whole wheel instead of one per waiter.
+
+    Time is divided into ticks of `resolution` seconds. Deadlines are rounded
+    up to a whole tick, so a callback never runs early and runs at most one
+    tick late. The first level has 256 slots of one tick each; each of the
+    four levels above it has 64 slots, each spanning a full turn of the level
+    below. Timers cascade down a level whenever the level below wraps around.
+    """
+
+    # Bits of the tick number used to index each level.
+    _LEVEL_BITS = (8, 6, 6, 6, 6)
+
+    def __init__(self, io_loop, resolution):
+        self._io_loop_ref = weakref.ref(io_loop)
+        self.resolution = resolution
+        self._levels = []
+        self._shifts = []
+        shift = 0
+        for bits in self._LEVEL_BITS:
+            self._levels.append([None] * (1 << bits))
+            self._shifts.append(shift)
+            shift += bits
+
+        self._span = 1 << shift  # Ticks covered by the whole wheel
+        self._current = 0        # The next tick to process
+        self._count = 0          # Pending timers
+        self._timeout = None     # The IOLoop timeout that drives the wheel
+        self._wakeup = None      # Tick number at which _timeout fires
+        self._running = False
+
+    @property
+    def io_loop(self):
+        return self._io_loop_ref()
+
+    def __len__(self):
+        return self._count
+
+    def _now(self):
+        # Tolerate float error so a wakeup scheduled for tick N sees tick N.
+        return int(math.floor(
+            self.io_loop.time() / self.resolution + 1e-6))
+
+    def call_at(self, deadline, callback):
+        """Run `callback` with no arguments after `deadline`.
+
+        `deadline` is a unix timestamp (as returned by ``io_loop.time()``) or
+        a ``datetime.timedelta`` relative to the current time. Returns a
+        :class:`_WheelTimer` with a ``cancel()`` method.
+        """
+        if isinstance(deadline, numbers.Real):
+            seconds = deadline
+        elif isinstance(deadline, datetime.timedelta):
+            seconds = self.io_loop.time() + _timedelta_to_seconds(deadline)
+        else:
+            raise TypeError("Unsupported deadline %r" % deadline)
+
+        if not self._count and not self._running:
+            # Nothing is in the wheel, so it's safe to move it to now.
+            self._current = self._now()
+
+        expiry = max(int(math.ceil(seconds / self.resolution)), self._current)
+        timer = _WheelTimer(self, expiry, callback)
+        self._insert(timer)
+        self._count += 1
+        if not self._running and (
+                self._timeout is None or expiry < self._wakeup):
+            self._schedule(expiry)
+
+        return timer
+
+    def _insert(self, timer):
+        delta = timer.expiry - self._current
+        expiry = timer.expiry
+        if delta >= self._span:
+            # Too far out: park it in the last slot, it'll cascade back here.
+            expiry = self._current + self._span - 1
+            delta = self._span - 1
+
+        for level, shift in enumerate(self._shifts):
+            limit = 1 << (shift + self._LEVEL_BITS[level])
+            if delta < limit:
+                slots = self._levels[level]
+                index = (expiry >> shift) & (len(slots) - 1)
+                slot = slots[index]
+                if slot is None:
+                    slot = slots[index] = set()
+                slot.add(timer)
+                timer.slot = slot
+                return
+
+    def _cascade(self, level):
+        slots = self._levels[level]
+        index = (self._current >> self._shifts[level]) & (len(slots) - 1)
+        slot = slots[index]
+        slots[index] = None
+        return slot
+
+    def _schedule(self, tick):
+        io_loop = self.io_loop
+        if self._timeout is not None:
+            io_loop.remove_timeout(self._timeout)
+
+        self._wakeup = tick
+
+        # Don't let whichever coroutine happened to schedule the wakeup
+        # capture the wheel in its stack context.
+        with stack_context.NullContext():
+            self._timeout = io_loop.add_timeout(
+                tick * self.resolution, self._run)
+
+    def _run(self):
+        self._timeout = None
+        self._running = True
+        try:
+            self._advance(self._now())
+        finally:
+            self._running = False
+
+        if self._count:
+            self._schedule(self._next_event())
+
+    def _advance(self, target):
+        level_0 = self._levels[0]
+        mask = len(level_0) - 1
+        while self._count:
+            # Skip straight past ticks with nothing to fire or cascade.
+            tick = self._next_event()
+            if tick > target:
+                break
+
+            self._current = tick
+            if not tick & mask:
+                # Level 0 wrapped, cascade the levels above, highest first.
+                level = 1
+                while (level < len(self._levels) - 1 and not
+                       (tick >> self._shifts[level]) & (
+                           len(self._levels[level]) - 1)):
+                    level += 1
+
+                for lvl in range(level, 0, -1):
+                    timers = self._cascade(lvl)
+                    if timers:
+                        for timer in timers:
+                            self._insert(timer)
+
+            slot = level_0[tick & mask]
+            level_0[tick & mask] = None
+
+            # Timers scheduled by callbacks must land in a later tick.
+            self._current = tick + 1
+            if slot:
+                self._fire(slot)
+
+        if not self._count:
+            self._current = max(self._current, target + 1)
+
+    def _fire(self, slot):
+        io_loop = self.io_loop
+        while slot:
+            timer = slot.pop()
+            timer.slot = None
+            self._count -= 1
+            try:
+                timer.callback()
+            except Exception:
+                io_loop.handle_callback_exception(timer.callback)
+
+    def _next_event(self):
+        # The first tick at or after _current with a busy level-0 slot or a
+        # busy slot to cascade from a higher level.
+        current = self._current
+        level_0 = self._levels[0]
+        mask = len(level_0) - 1
+        # A cascade is due at the next multiple of 256 ticks, which is current
+        # itself if it is one: _advance moves past a tick once processed.
+        boundary = ((current - 1) | mask) + 1
+        for tick in range(current, current + len(level_0)):
+            if level_0[tick & mask]:
+                if tick < boundary:
+                    return tick
+                best = tick
+                break
+        else:
+            best = None
+
+        for level in range(1, len(self._levels)):
+            slots = self._levels[level]
+            shift = self._shifts[level]
+            size = len(slots)
+            turn = -(-current >> shift)  # Next multiple of 2 ** shift
+            for i in range(size):
+                if slots[(turn + i) & (size - 1)]:
+                    tick = (turn + i) << shift
+                    if best is None or tick < best:
+                        best = tick
+                    break
+
+        return best
+
+_timer_wheels = weakref.WeakKeyDictionary()
+
+_default_resolution = 0.01
+
+
+def _timer_wheel(io_loop):
+    try:
+        return _timer_wheels[io_loop]
+    except KeyError:
+        wheel = _timer_wheels[io_loop] = _TimerWheel(
+            io_loop, _default_resolution)
+        return wheel
+
+
+def set_timer_resolution(resolution, io_loop=None):
+    """Set the granularity, in seconds, of Toro's deadlines on an IOLoop.
+
+    Toro tracks the deadlines of all waiters on an IOLoop in one timing
+    wheel, which rounds each deadline up to a multiple of `resolution`. A
+    coarser resolution means fewer wakeups; a finer one means more precise
+    timeouts. The default is 0.01 seconds.
+
+    Raises ``RuntimeError`` if any deadlines are pending on the IOLoop.
+
+    :Parameters:
+      - `resolution`: Positive number of seconds.
+      - `io_loop`: Optional custom IOLoop.
+    """
+    if resolution <= 0:
+        raise ValueError("resolution must be positive")
+
+    io_loop = io_loop or ioloop.IOLoop.current()
+    wheel = _timer_wheels.get(io_loop)
+    if wheel is not None and len(wheel):
+        raise RuntimeError("can't change resolution with deadlines pending")
+
+    _timer_wheels[io_loop] = _TimerWheel(io_loop, resolution)
+
+
 class _TimeoutFuture(Future):
 
+    __slots__ = ('io_loop', '_timer', '_owner', '_prev', '_next')
+
     def __init__(self, deadline, io_loop):
         """Create a Future with optional deadline.
 
@@ -61,11 +351,18 @@ class _TimeoutFuture(Future):
 
         super(_TimeoutFuture, self).__init__()
         self.io_loop = io_loop
+        self._owner = None  # The _WaiterList this Future is waiting in
         if deadline is not None:
-            callback = partial(self.set_exception, Timeout())
-            self._timeout_handle = io_loop.add_timeout(deadline, callback)
+            self._timer = _timer_wheel(io_loop).call_at(
+                deadline, self._on_timeout)
         else:
-            self._timeout_handle = None
+            self._timer = None
+
+    def _on_timeout(self):
+        self._timer = None
+        if self._owner is not None:
+            self._owner.discard(self)
+        self.set_exception(Timeout())
 
     def set_result(self, result):
         self._cancel_timeout()
@@ -76,19 +373,204 @@ class _TimeoutFuture(Future):
         super(_TimeoutFuture, self).set_exception(exception)
 
     def _cancel_timeout(self):
-        if self._timeout_handle:
-            self.io_loop.remove_timeout(self._timeout_handle)
-            self._timeout_handle = None
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+
+class _PutterFuture(_TimeoutFuture):
+    """A _TimeoutFuture for a blocked :meth:`Queue.put`, holding its item."""
+
+    __slots__ = ('item', )
+
+    def __init__(self, item, deadline, io_loop):
+        super(_PutterFuture, self).__init__(deadline, io_loop)
+        self.item = item
+
+
+class _BatchPutterFuture(_TimeoutFuture):
+    """A _TimeoutFuture for a blocked :meth:`Queue.put_many`, holding the
+    items not yet in the queue."""
+
+    __slots__ = ('items', )
+
+    def __init__(self, items, deadline, io_loop):
+        super(_BatchPutterFuture, self).__init__(deadline, io_loop)
+        self.items = items
+
+
+class _BatchGetterFuture(_TimeoutFuture):
+    """A _TimeoutFuture for a blocked :meth:`Queue.get_many`."""
+
+    __slots__ = ('max_items', )
+
+    def __init__(self, max_items, deadline, io_loop):
+        super(_BatchGetterFuture, self).__init__(deadline, io_loop)
+        self.max_items = max_items
+
+
+class _LingerFuture(_BatchGetterFuture):
+    """A _BatchGetterFuture for :meth:`Queue.get_batch`.
+
+    Once it has its first items it rejoins the head of the line with
+    `max_items` lowered, and a single timer resolves it with what it has
+    collected after `linger` seconds.
+    """
+
+    __slots__ = ('linger', 'items')
+
+    def __init__(self, max_items, linger, deadline, io_loop):
+        super(_LingerFuture, self).__init__(max_items, deadline, io_loop)
+        self.linger = linger
+        self.items = []
 
+    def start_linger(self):
+        if self.linger is not None:
+            self._cancel_timeout()
+            self._timer = _timer_wheel(self.io_loop).call_at(
+                self.io_loop.time() + self.linger, self._on_linger)
+            self.linger = None
 
-class _ContextManagerList(list):
-    def __enter__(self, *args, **kwargs):
-        for obj in self:
-            obj.__enter__(*args, **kwargs)
+    def _on_linger(self):
+        self._timer = None
+        if self._owner is not None:
+            self._owner.discard(self)
+        self.set_result(self.items)
 
-    def __exit__(self, *args, **kwargs):
-        for obj in self:
-            obj.__exit__(*args, **kwargs)
+
+class _WaiterList(object):
+    """A FIFO of waiting _TimeoutFutures.
+
+    An intrusive doubly-linked list: each Future stores its own links, so a
+    waiter that times out unlinks itself in O(1) and the list only ever
+    holds live waiters.
+    """
+
+    __slots__ = ('_head', '_tail', '_len')
+
+    def __init__(self):
+        self._head = self._tail = None
+        self._len = 0
+
+    def __len__(self):
+        # Counts waiters resolved by someone else and not yet unlinked, so
+        # it's an upper bound; truth-testing the list is exact.
+        return self._len
+
+    def __nonzero__(self):
+        return self._prune() is not None
+
+    def __iter__(self):
+        waiter = self._head
+        while waiter is not None:
+            # Read the link first, in case the caller removes this waiter.
+            next_waiter = waiter._next
+            yield waiter
+            waiter = next_waiter
+
+    def __repr__(self):
+        return '<%s [%s]>' % (type(self).__name__, self._len)
+
+    def append(self, waiter):
+        assert waiter._owner is None, "waiter already in a list"
+        waiter._owner = self
+        waiter._prev = self._tail
+        waiter._next = None
+        if self._tail is None:
+            self._head = waiter
+        else:
+            self._tail._next = waiter
+        self._tail = waiter
+        self._len += 1
+
+    def appendleft(self, waiter):
+        assert waiter._owner is None, "waiter already in a list"
+        waiter._owner = self
+        waiter._prev = None
+        waiter._next = self._head
+        if self._head is None:
+            self._tail = waiter
+        else:
+            self._head._prev = waiter
+        self._head = waiter
+        self._len += 1
+
+    def remove(self, waiter):
+        """Unlink `waiter`, which must be in this list."""
+        assert waiter._owner is self, "waiter not in this list"
+        prev_waiter, next_waiter = waiter._prev, waiter._next
+        if prev_waiter is None:
+            self._head = next_waiter
+        else:
+            prev_waiter._next = next_waiter
+        if next_waiter is None:
+            self._tail = prev_waiter
+        else:
+            next_waiter._prev = prev_waiter
+        waiter._owner = waiter._prev = waiter._next = None
+        self._len -= 1
+
+    def discard(self, waiter):
+        """Unlink `waiter`, which has timed out."""
+        self.remove(waiter)
+
+    def _prune(self):
+        # Unlink waiters someone else resolved from the head, and return the
+        # first one that isn't done yet, or None.
+        waiter = self._head
+        while waiter is not None and waiter.done():
+            self.remove(waiter)
+            waiter = self._head
+        return waiter
+
+    def popleft(self):
+        """Unlink and return the first waiter that isn't done yet.
+
+        Raises IndexError if there's none, which can't happen if the list
+        tested true.
+        """
+        waiter = self._prune()
+        if waiter is None:
+            raise IndexError('pop from an empty _WaiterList')
+        self.remove(waiter)
+        return waiter
+
+    def peek(self):
+        """The first waiter that isn't done yet, or None."""
+        return self._prune()
+
+
+class _NotifyingWaiterList(_WaiterList):
+    """A _WaiterList that calls `on_discard(waiter)` after a waiter times out.
+
+    For primitives where a departing waiter can let others proceed, e.g. a
+    large request at the head of a weighted semaphore's line.
+    """
+
+    __slots__ = ('on_discard', )
+
+    def __init__(self, on_discard):
+        super(_NotifyingWaiterList, self).__init__()
+        self.on_discard = on_discard
+
+    def discard(self, waiter):
+        self.remove(waiter)
+        self.on_discard(waiter)
+
+
+class _ContextManager(object):
+    """Runs a callback at the end of a "with" block."""
+
+    __slots__ = ('exit_callback', )
+
+    def __init__(self, exit_callback):
+        self.exit_callback = exit_callback
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, typ, value, traceback):
+        self.exit_callback()
 
 
 class _ContextManagerFuture(Future):
@@ -102,40 +584,34 @@ class _ContextManagerFuture(Future):
 
     At the end of the block, the Future's exit callback is run. Used for
     Lock.acquire, Semaphore.acquire, RWLock.acquire_read / acquire_write.
+
+    If `wrapped` is None the Future is resolved at once. The context manager
+    holds no per-block state, so a resolved instance can be handed out again
+    and again.
     """
+    __slots__ = ('exit_callback', )
+
     def __init__(self, wrapped, exit_callback):
         super(_ContextManagerFuture, self).__init__()
-        wrapped.add_done_callback(self._done_callback)
         self.exit_callback = exit_callback
+        if wrapped is None:
+            self.set_result(_ContextManager(exit_callback))
+        else:
+            wrapped.add_done_callback(self._done_callback)
 
     def _done_callback(self, wrapped):
         if wrapped.exception():
             self.set_exception(wrapped.exception())
         else:
-            self.set_result(wrapped.result())
-
-    def result(self):
-        if self.exception():
-            raise self.exception()
-
-        # Otherwise return a context manager that cleans up after the block.
-        @contextlib.contextmanager
-        def f():
-            try:
-                yield
-            finally:
-                self.exit_callback()
-        return f()
-
-
-def _consume_expired_waiters(waiters):
-    # Delete waiters at the head of the queue who've timed out
-    while waiters and waiters[0].done():
-        waiters.popleft()
+            self.set_result(_ContextManager(self.exit_callback))
 
 
 _null_result = object()
 
+# Shared by operations that finish at once with no per-caller result.
+_null_future = Future()
+_null_future.set_result(None)
+
 
 class AsyncResult(object):
     """A one-time event that stores a value or an exception.
@@ -150,10 +626,13 @@ class AsyncResult(object):
       - `io_loop`: Optional custom IOLoop.
     """
 
+    __slots__ = ('io_loop', 'value', 'waiters', '_future', '__weakref__')
+
     def __init__(self, io_loop=None):
         self.io_loop = io_loop or ioloop.IOLoop.current()
         self.value = _null_result
-        self.waiters = []
+        self.waiters = _WaiterList()
+        self._future = None  # Resolved Future, shared by get() once ready
 
     def __str__(self):
         result = '<%s ' % (self.__class__.__name__, )
@@ -172,10 +651,8 @@ class AsyncResult(object):
             raise AlreadySet
 
         self.value = value
-        waiters, self.waiters = self.waiters, []
-        for waiter in waiters:
-            if not waiter.done():  # Might have timed out
-                waiter.set_result(value)
+        while self.waiters:
+            self.waiters.popleft().set_result(value)
 
     def ready(self):
         return self.value is not _null_result
@@ -191,10 +668,14 @@ class AsyncResult(object):
             (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for
             a deadline relative to the current time.
         """
-        future = _TimeoutFuture(deadline, self.io_loop)
         if self.ready():
-            future.set_result(self.value)
+            future = self._future
+            if future is None:
+                future = self._future = Future()
+                future.set_result(self.value)
         else:
+            # Only register the deadline if we actually have to wait.
+            future = _TimeoutFuture(deadline, self.io_loop)
             self.waiters.append(future)
 
         return future
@@ -219,9 +700,11 @@ class Condition(object):
       - `io_loop`: Optional custom IOLoop.
     """
 
+    __slots__ = ('io_loop', 'waiters', '__weakref__')
+
     def __init__(self, io_loop=None):
         self.io_loop = io_loop or ioloop.IOLoop.current()
-        self.waiters = collections.deque()  # Queue of _Waiter objects
+        self.waiters = _WaiterList()  # Queue of _TimeoutFutures
 
     def __str__(self):
         result = '<%s' % (self.__class__.__name__, )
@@ -251,10 +734,8 @@ class Condition(object):
         """
         waiters = []  # Waiters we plan to run right now
         while n and self.waiters:
-            waiter = self.waiters.popleft()
-            if not waiter.done():  # Might have timed out
-                n -= 1
-                waiters.append(waiter)
+            waiters.append(self.waiters.popleft())
+            n -= 1
 
         for waiter in waiters:
             waiter.set_result(None)
@@ -278,6 +759,8 @@ class Event(object):
       - `io_loop`: Optional custom IOLoop.
     """
 
+    __slots__ = ('io_loop', 'condition', '_flag', '__weakref__')
+
     def __init__(self, io_loop=None):
         self.io_loop = io_loop or ioloop.IOLoop.current()
         self.condition = Condition(io_loop=io_loop)
@@ -316,18 +799,82 @@ class Event(object):
             deadline relative to the current time.
         """
         if self._flag:
-            future = _TimeoutFuture(None, self.io_loop)
-            future.set_result(None)
-            return future
+            return _null_future
         else:
             return self.condition.wait(deadline)
 
 
+# Slots a _RingBuffer allocates up front; larger ones grow as they fill.
+_RING_PREALLOCATE = 4096
+
+
+class _RingBuffer(object):
+    """A FIFO of at most `capacity` items in a preallocated list.
+
+    Storage for a bounded Queue: unlike a deque, which allocates and frees a
+    block every 64 items as the queue fills and drains, its steady state
+    allocates nothing. Very large capacities are allocated in steps, doubling
+    up to `capacity`, so that a huge bound doesn't cost memory until it's
+    used.
+    """
+
+    __slots__ = ('_buf', '_head', '_len', '_capacity')
+
+    def __init__(self, capacity):
+        self._buf = [None] * min(capacity, _RING_PREALLOCATE)
+        self._head = 0
+        self._len = 0
+        self._capacity = capacity
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        buf, size = self._buf, len(self._buf)
+        for i in xrange(self._len):
+            yield buf[(self._head + i) % size]
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, list(self))
+
+    def append(self, item):
+        size = len(self._buf)
+        if self._len == size:
+            if size == self._capacity:
+                raise IndexError('append to a full _RingBuffer')
+            self._grow()
+            size = len(self._buf)
+        self._buf[(self._head + self._len) % size] = item
+        self._len += 1
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('pop from an empty _RingBuffer')
+        buf = self._buf
+        item = buf[self._head]
+        buf[self._head] = None  # Don't keep the item alive.
+        self._head = (self._head + 1) % len(buf)
+        self._len -= 1
+        return item
+
+    def _grow(self):
+        items = list(self)
+        new_size = min(2 * len(self._buf), self._capacity)
+        self._buf = items + [None] * (new_size - len(items))
+        self._head = 0
+
+
 class Queue(object):
     """Create a queue object with a given maximum size.
 
     If `maxsize` is 0 (the default) the queue size is unbounded.
 
+    If `max_bytes` is given, the queue is also bounded by the total size of
+    its items, as measured by `sizeof` (``len`` by default): a put blocks
+    while the item wouldn't fit. An item larger than `max_bytes` is let into
+    an empty queue, so it can't block forever. `sizeof` must return the same
+    size for an item each time it's called.
+
     Unlike the `standard Queue`_, you can reliably know this Queue's size
     with :meth:`qsize`, since your single-threaded Tornado application won't
     be interrupted between calling :meth:`qsize` and doing an operation on the
@@ -342,12 +889,20 @@ class Queue(object):
     :Parameters:
       - `maxsize`: Optional size limit (no limit by default).
       - `io_loop`: Optional custom IOLoop.
+      - `max_bytes`: Optional limit on the total size of the items.
+      - `sizeof`: Optional function returning an item's size. If given
+        without `max_bytes`, the size is tracked for :meth:`qbytes` but not
+        limited.
 
     .. _`Gevent's Queue`: http://www.gevent.org/gevent.queue.html
 
     .. _`standard Queue`: http://docs.python.org/library/queue.html#Queue.Queue
     """
-    def __init__(self, maxsize=0, io_loop=None):
+    __slots__ = (
+        'io_loop', '_maxsize', '_max_bytes', '_sizeof', '_bytes', 'getters',
+        'putters', 'queue', '__weakref__')
+
+    def __init__(self, maxsize=0, io_loop=None, max_bytes=None, sizeof=None):
         self.io_loop = io_loop or ioloop.IOLoop.current()
         if maxsize is None:
             raise TypeError("maxsize can't be None")
@@ -355,12 +910,22 @@ class Queue(object):
         if maxsize < 0:
             raise ValueError("maxsize can't be negative")
 
-        self._maxsize = maxsize
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError("max_bytes must be None or positive")
 
-        # _TimeoutFutures
-        self.getters = collections.deque([])
-        # Pairs of (item, _TimeoutFuture)
-        self.putters = collections.deque([])
+        self._maxsize = maxsize
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof or (len if max_bytes else None)
+        self._bytes = 0
+
+        # _TimeoutFutures and _BatchGetterFutures
+        self.getters = _WaiterList()
+        # _PutterFutures and _BatchPutterFutures
+        if max_bytes:
+            # When a big item times out, smaller ones behind it may fit.
+            self.putters = _NotifyingWaiterList(self._on_putter_discard)
+        else:
+            self.putters = _WaiterList()
         self._init(maxsize)
 
     # These three are overridable in subclasses.
@@ -373,6 +938,98 @@ class Queue(object):
     def _put(self, item):
         self.queue.append(item)
 
+    # Subclasses may override these two to move items in bulk.
+    def _get_many(self, n):
+        return [self._get() for _ in xrange(n)]
+
+    def _put_many(self, items):
+        for item in items:
+            self._put(item)
+
+    # The rest of Queue moves items with these, which keep qbytes() current.
+    def _push(self, item):
+        self._put(item)
+        if self._sizeof is not None:
+            self._bytes += self._sizeof(item)
+
+    def _pop(self):
+        item = self._get()
+        if self._sizeof is not None:
+            self._bytes -= self._sizeof(item)
+        return item
+
+    def _push_many(self, items):
+        self._put_many(items)
+        if self._sizeof is not None:
+            self._bytes += sum(map(self._sizeof, items))
+
+    def _pop_many(self, n):
+        items = self._get_many(n)
+        if self._sizeof is not None:
+            self._bytes -= sum(map(self._sizeof, items))
+        return items
+
+    def _has_room(self, item):
+        if self._maxsize and self._maxsize <= self.qsize():
+            return False
+        if self._max_bytes and self._bytes and (
+                self._bytes + self._sizeof(item) > self._max_bytes):
+            return False
+        return True
+
+    def _serve_getter(self, getter):
+        # Resolve a waiting getter with an item, or a list for get_many().
+        if isinstance(getter, _LingerFuture):
+            self._serve_linger(getter)
+        elif isinstance(getter, _BatchGetterFuture):
+            getter.set_result(
+                self._pop_many(min(getter.max_items, self.qsize())))
+        else:
+            getter.set_result(self._pop())
+
+    def _serve_linger(self, getter):
+        # Add items to a get_batch() getter's batch; if it isn't full, put
+        # it back at the head of the line until its linger timer fires.
+        while True:
+            n = min(getter.max_items, self.qsize())
+            getter.items.extend(self._pop_many(n))
+            getter.max_items -= n
+            self._refill()
+            if not getter.max_items or not self.qsize():
+                break
+
+        if getter.max_items:
+            getter.start_linger()
+            self.getters.appendleft(getter)
+        else:
+            getter.set_result(getter.items)
+
+    def _next_putter_item(self):
+        putter = self.putters.peek()
+        if isinstance(putter, _BatchPutterFuture):
+            return putter.items[0]
+        return putter.item
+
+    def _put_from_putter(self):
+        # Move the first waiting putter's next item into the queue.
+        putter = self.putters.peek()
+        if isinstance(putter, _BatchPutterFuture):
+            self._push(putter.items.popleft())
+            if putter.items:
+                return
+        else:
+            self._push(putter.item)
+        self.putters.remove(putter)
+        putter.set_result(None)
+
+    def _refill(self):
+        # Move waiting putters' items into the queue while they fit.
+        while self.putters and self._has_room(self._next_putter_item()):
+            self._put_from_putter()
+
+    def _on_putter_discard(self, putter):
+        self._refill()
+
     def __repr__(self):
         return '<%s at %s %s>' % (
             type(self).__name__, hex(id(self)), self._format())
@@ -382,6 +1039,8 @@ class Queue(object):
 
     def _format(self):
         result = 'maxsize=%r' % (self.maxsize, )
+        if self._max_bytes:
+            result += ' bytes=%s/%s' % (self._bytes, self._max_bytes)
         if getattr(self, 'queue', None):
             result += ' queue=%r' % self.queue
         if self.getters:
@@ -390,30 +1049,41 @@ class Queue(object):
             result += ' putters[%s]' % len(self.putters)
         return result
 
-    def _consume_expired_putters(self):
-        # Delete waiters at the head of the queue who've timed out
-        while self.putters and self.putters[0][1].done():
-            self.putters.popleft()
-
     def qsize(self):
         """Number of items in the queue"""
         return len(self.queue)
 
+    def qbytes(self):
+        """Total size of the items in the queue, as measured by `sizeof`.
+
+        Always 0 if the queue has neither `max_bytes` nor `sizeof`.
+        """
+        return self._bytes
+
     @property
     def maxsize(self):
         """Number of items allowed in the queue."""
         return self._maxsize
 
+    @property
+    def max_bytes(self):
+        """Total size of the items allowed in the queue, or None."""
+        return self._max_bytes
+
     def empty(self):
         """Return ``True`` if the queue is empty, ``False`` otherwise."""
         return not self.queue
 
     def full(self):
-        """Return ``True`` if there are `maxsize` items in the queue.
+        """Return ``True`` if there are `maxsize` items in the queue, or
+        items totalling `max_bytes`.
 
         .. note:: if the Queue was initialized with `maxsize=0`
-          (the default), then :meth:`full` is never ``True``.
+          (the default) and no `max_bytes`, then :meth:`full` is never
+          ``True``.
         """
+        if self._max_bytes and self._bytes >= self._max_bytes:
+            return True
         if self.maxsize == 0:
             return False
         else:
@@ -430,42 +1100,39 @@ class Queue(object):
             (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
             deadline relative to the current time.
         """
-        _consume_expired_waiters(self.getters)
-        future = _TimeoutFuture(deadline, self.io_loop)
         if self.getters:
             assert not self.queue, "queue non-empty, why are getters waiting?"
             getter = self.getters.popleft()
 
             # Use _put and _get instead of passing item straight to getter, in
             # case a subclass has logic that must run (e.g. JoinableQueue).
-            self._put(item)
-            getter.set_result(self._get())
-            future.set_result(None)
+            self._push(item)
+            self._serve_getter(getter)
+        elif self.putters or not self._has_room(item):
+            # Only register the deadline if we actually have to wait.
+            future = _PutterFuture(item, deadline, self.io_loop)
+            self.putters.append(future)
+            return future
         else:
-            if self.maxsize and self.maxsize <= self.qsize():
-                self.putters.append((item, future))
-            else:
-                self._put(item)
-                future.set_result(None)
+            self._push(item)
 
-        return future
+        return _null_future
 
     def put_nowait(self, item):
         """Put an item into the queue without blocking.
 
         If no free slot is immediately available, raise queue.Full.
         """
-        _consume_expired_waiters(self.getters)
         if self.getters:
             assert not self.queue, "queue non-empty, why are getters waiting?"
             getter = self.getters.popleft()
 
-            self._put(item)
-            getter.set_result(self._get())
-        elif self.maxsize and self.maxsize <= self.qsize():
+            self._push(item)
+            self._serve_getter(getter)
+        elif self.putters or not self._has_room(item):
             raise Full
         else:
-            self._put(item)
+            self._push(item)
 
     def get(self, deadline=None):
         """Remove and return an item from the queue. Returns a Future.
@@ -478,19 +1145,14 @@ class Queue(object):
             (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
             deadline relative to the current time.
         """
-        self._consume_expired_putters()
-        future = _TimeoutFuture(deadline, self.io_loop)
-        if self.putters:
-            assert self.full(), "queue not full, why are putters waiting?"
-            item, putter = self.putters.popleft()
-            self._put(item)
-            putter.set_result(None)
-            future.set_result(self._get())
-        elif self.qsize():
-            future.set_result(self._get())
-        else:
+        if not self.qsize():
+            # Only register the deadline if we actually have to wait.
+            future = _TimeoutFuture(deadline, self.io_loop)
             self.getters.append(future)
+            return future
 
+        future = Future()
+        future.set_result(self._get_and_refill())
         return future
 
     def get_nowait(self):
@@ -499,18 +1161,155 @@ class Queue(object):
         Return an item if one is immediately available, else raise
         :exc:`queue.Empty`.
         """
-        self._consume_expired_putters()
-        if self.putters:
-            assert self.full(), "queue not full, why are putters waiting?"
-            item, putter = self.putters.popleft()
-            self._put(item)
-            putter.set_result(None)
-            return self._get()
-        elif self.qsize():
-            return self._get()
+        if self.qsize():
+            return self._get_and_refill()
         else:
             raise Empty
 
+    def _get_and_refill(self):
+        if self.putters and not self._max_bytes:
+            # The queue is full; make the first waiting item a candidate too.
+            assert self.full(), "queue not full, why are putters waiting?"
+            self._put_from_putter()
+            return self._pop()
+
+        item = self._pop()
+        self._refill()
+        return item
+
+    def put_many(self, items, deadline=None):
+        """Put several items into the queue. Returns a Future.
+
+        Waiting getters are served first, each with at most `maxsize` items,
+        then free slots are filled, and the rest of the items wait together
+        for slots to open. The Future
+        resolves once every item is in the queue, or raises
+        :exc:`toro.Timeout`; items not yet in the queue by then are dropped.
+
+        :Parameters:
+          - `items`: A sequence of items, put in order.
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        items = list(items)
+        start = 0
+        while self.getters and start < len(items):
+            assert not self.queue, "queue non-empty, why are getters waiting?"
+            getter = self.getters.popleft()
+            if isinstance(getter, _BatchGetterFuture):
+                n = getter.max_items
+                if self.maxsize:
+                    # Pass no more through the queue than fit in it.
+                    n = min(n, int(math.ceil(self.maxsize)))
+                end = start + n
+            else:
+                end = start + 1
+            self._push_many(items[start:end])
+            self._serve_getter(getter)
+            start = end
+
+        if self.putters:
+            end = start
+        elif self._max_bytes:
+            end = start
+            while end < len(items) and self._has_room(items[end]):
+                self._push(items[end])
+                end += 1
+        else:
+            if self.maxsize:
+                room = int(math.ceil(self.maxsize - self.qsize()))
+                end = start + max(0, room)
+            else:
+                end = len(items)
+            self._push_many(items[start:end])
+
+        if end >= len(items):
+            return _null_future
+
+        future = _BatchPutterFuture(
+            collections.deque(items[end:]), deadline, self.io_loop)
+        self.putters.append(future)
+        return future
+
+    def get_many(self, max_items, deadline=None):
+        """Remove and return up to `max_items` items. Returns a Future.
+
+        The Future resolves to a list of every item available, up to
+        `max_items`. It blocks only while the queue is empty, or raises
+        :exc:`toro.Timeout`.
+
+        :Parameters:
+          - `max_items`: The most items to return, at least 1.
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        if max_items < 1:
+            raise ValueError('max_items must be at least 1')
+
+        if not self.qsize():
+            # Only register the deadline if we actually have to wait.
+            future = _BatchGetterFuture(max_items, deadline, self.io_loop)
+            self.getters.append(future)
+            return future
+
+        items = self._pop_many(min(max_items, self.qsize()))
+        self._refill()
+
+        future = Future()
+        future.set_result(items)
+        return future
+
+    def get_batch(self, max_items, linger, deadline=None):
+        """Wait for an item, then collect more for a while. Returns a Future.
+
+        The Future resolves to a list of up to `max_items` items: those
+        available at once or, if the queue is empty, the first to arrive,
+        plus any that arrive within `linger` after them. It resolves as soon
+        as the list is full. This trades a little latency for fewer, larger
+        batches downstream:
+
+        >>> from datetime import timedelta
+        >>> from tornado import gen
+        >>> import toro
+        >>> q = toro.Queue()
+        >>>
+        >>> @gen.coroutine
+        ... def sink():
+        ...    while True:
+        ...        batch = yield q.get_batch(
+        ...            500, linger=timedelta(milliseconds=20))
+        ...        assert 1 <= len(batch) <= 500
+
+        The Future raises :exc:`toro.Timeout` if no item arrives before the
+        deadline; the deadline doesn't apply once the first item is in.
+
+        :Parameters:
+          - `max_items`: The most items to return, at least 1.
+          - `linger`: Seconds, or a ``datetime.timedelta``, to wait for more
+            items after the first.
+          - `deadline`: Optional timeout for the first item, either an
+            absolute timestamp (as returned by ``io_loop.time()``) or a
+            ``datetime.timedelta`` for a deadline relative to the current
+            time.
+        """
+        if max_items < 1:
+            raise ValueError('max_items must be at least 1')
+        if isinstance(linger, datetime.timedelta):
+            linger = _timedelta_to_seconds(linger)
+
+        if linger <= 0 or self.qsize() >= max_items:
+            return self.get_many(max_items, deadline)
+
+        if self.qsize():
+            future = _LingerFuture(max_items, linger, None, self.io_loop)
+            self._serve_linger(future)
+        else:
+            future = _LingerFuture(max_items, linger, deadline, self.io_loop)
+            self.getters.append(future)
+        return future
+
 
 class PriorityQueue(Queue):
     """A subclass of :class:`Queue` that retrieves entries in priority order
@@ -523,6 +1322,8 @@ class PriorityQueue(Queue):
       - `initial`: Optional sequence of initial items.
       - `io_loop`: Optional custom IOLoop.
     """
+    __slots__ = ()
+
     def _init(self, maxsize):
         self.queue = []
 
@@ -532,6 +1333,22 @@ class PriorityQueue(Queue):
     def _get(self, heappop=heapq.heappop):
         return heappop(self.queue)
 
+    def _put_many(self, items, heappush=heapq.heappush):
+        if len(items) > len(self.queue):
+            # Rebuilding the heap, O(n), beats pushing each item.
+            self.queue.extend(items)
+            heapq.heapify(self.queue)
+        else:
+            for item in items:
+                heappush(self.queue, item)
+
+    def _get_many(self, n, heappop=heapq.heappop):
+        if n == len(self.queue):
+            items = sorted(self.queue)
+            del self.queue[:]
+            return items
+        return [heappop(self.queue) for _ in xrange(n)]
+
 
 class LifoQueue(Queue):
     """A subclass of :class:`Queue` that retrieves most recently added entries
@@ -542,6 +1359,8 @@ class LifoQueue(Queue):
       - `initial`: Optional sequence of initial items.
       - `io_loop`: Optional custom IOLoop.
     """
+    __slots__ = ()
+
     def _init(self, maxsize):
         self.queue = []
 
@@ -551,6 +1370,45 @@ class LifoQueue(Queue):
     def _get(self):
         return self.queue.pop()
 
+    def _put_many(self, items):
+        self.queue.extend(items)
+
+    def _get_many(self, n):
+        items = self.queue[-n:]
+        del self.queue[-n:]
+        items.reverse()
+        return items
+
+
+class RingBufferQueue(Queue):
+    """A subclass of :class:`Queue` that stores its items in a list
+    preallocated to `maxsize`, instead of a deque.
+
+    A deque allocates and frees memory as it grows and shrinks; a
+    RingBufferQueue that fills and drains all day allocates no storage once
+    it's warm. Capacities over 4096 items are allocated in steps, doubling
+    up to `maxsize`.
+
+    :Parameters:
+      - `maxsize`: Size limit, greater than 0.
+      - `io_loop`: Optional custom IOLoop.
+      - `max_bytes`: Optional limit on the total size of the items.
+      - `sizeof`: Optional function returning an item's size.
+    """
+    __slots__ = ()
+
+    def __init__(self, maxsize, io_loop=None, max_bytes=None, sizeof=None):
+        if not maxsize or maxsize < 0:
+            raise ValueError('maxsize must be greater than 0')
+        Queue.__init__(
+            self, maxsize=maxsize, io_loop=io_loop, max_bytes=max_bytes,
+            sizeof=sizeof)
+
+    def _init(self, maxsize):
+        # One spare slot: a get from a full queue with putters waiting
+        # moves the first putter's item in before taking an item out.
+        self.queue = _RingBuffer(int(math.ceil(maxsize)) + 1)
+
 
 class JoinableQueue(Queue):
     """A subclass of :class:`Queue` that additionally has :meth:`task_done`
@@ -562,9 +1420,15 @@ class JoinableQueue(Queue):
       - `maxsize`: Optional size limit (no limit by default).
       - `initial`: Optional sequence of initial items.
       - `io_loop`: Optional custom IOLoop.
+      - `max_bytes`: Optional limit on the total size of the items.
+      - `sizeof`: Optional function returning an item's size.
     """
-    def __init__(self, maxsize=0, io_loop=None):
-        Queue.__init__(self, maxsize=maxsize, io_loop=io_loop)
+    __slots__ = ('unfinished_tasks', '_finished')
+
+    def __init__(self, maxsize=0, io_loop=None, max_bytes=None, sizeof=None):
+        Queue.__init__(
+            self, maxsize=maxsize, io_loop=io_loop, max_bytes=max_bytes,
+            sizeof=sizeof)
         self.unfinished_tasks = 0
         self._finished = Event(io_loop)
         self._finished.set()
@@ -621,54 +1485,2342 @@ class JoinableQueue(Queue):
         return self._finished.wait(deadline)
 
 
-class Semaphore(object):
-    """A lock that can be acquired a fixed number of times before blocking.
+class _Segment(object):
+    """A spill file of a _SpillingStore: records written, then read back."""
 
-    A Semaphore manages a counter representing the number of release() calls
-    minus the number of acquire() calls, plus an initial value. The acquire()
-    method blocks if necessary until it can return without making the counter
-    negative.
+    __slots__ = ('path', 'writer', 'reader', 'written', 'read')
 
-    If not given, value defaults to 1.
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(
+            prefix='toro-', suffix='.spill', dir=directory)
+        self.writer = os.fdopen(fd, 'wb')
+        self.reader = None
+        self.written = self.read = 0
 
-    :meth:`acquire` supports the context manager protocol:
+    def close(self):
+        for f in (self.writer, self.reader):
+            if f is not None:
+                f.close()
+        self.writer = self.reader = None
+        os.remove(self.path)
 
-    >>> from tornado import gen
-    >>> import toro
-    >>> semaphore = toro.Semaphore()
-    >>>
-    >>> @gen.coroutine
-    ... def f():
-    ...    with (yield semaphore.acquire()):
-    ...        assert semaphore.locked()
-    ...
-    ...    assert not semaphore.locked()
 
-    .. note:: Unlike the standard threading.Semaphore_, a :class:`Semaphore`
-      can tell you the current value of its :attr:`counter`, because code in a
-      single-threaded Tornado app can check these values and act upon them
-      without fear of interruption from another thread.
+class _PickleSerializer(object):
+    """SpillingQueue's default serializer."""
 
-    .. _threading.Semaphore: http://docs.python.org/library/threading.html#threading.Semaphore
+    @staticmethod
+    def dumps(item):
+        return pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
 
-    .. seealso:: :doc:`examples/web_spider_example`
+    @staticmethod
+    def loads(data):
+        return pickle.loads(data)
 
-    :Parameters:
-      - `value`: An int, the initial value (default 1).
-      - `io_loop`: Optional custom IOLoop.
+
+class _SpillingStore(object):
+    """A FIFO that holds its first `memory_items` items in memory and the
+    rest in segment files, reading them back in order as the head drains.
+
+    Once anything is on disk, new items go to disk too, to keep FIFO order;
+    each item read back refills the head, so while anything is spilled the
+    head is full.
     """
-    def __init__(self, value=1, io_loop=None):
+
+    __slots__ = ('_head', '_segments', '_spilled', '_memory_items',
+                 '_directory', '_segment_items', '_serializer', '_compress')
+
+    _record = struct.Struct('<I')
+
+    def __init__(self, memory_items, directory, segment_items, serializer,
+                 compress):
+        self._head = collections.deque()
+        self._segments = collections.deque()
+        self._spilled = 0
+        self._memory_items = memory_items
+        self._directory = directory
+        self._segment_items = segment_items
+        self._serializer = serializer
+        self._compress = compress
+
+    def __len__(self):
+        return len(self._head) + self._spilled
+
+    def __repr__(self):
+        return '<%s memory=%s spilled=%s>' % (
+            type(self).__name__, len(self._head), self._spilled)
+
+    @property
+    def spilled(self):
+        return self._spilled
+
+    def append(self, item):
+        if self._spilled or len(self._head) >= self._memory_items:
+            self._spill(item)
+        else:
+            self._head.append(item)
+
+    def popleft(self):
+        item = self._head.popleft()
+        if self._spilled:
+            self._head.append(self._unspill())
+        return item
+
+    def _spill(self, item):
+        data = self._serializer.dumps(item)
+        if self._compress:
+            data = zlib.compress(data)
+
+        segment = self._segments[-1] if self._segments else None
+        if segment is None or segment.writer is None:
+            segment = _Segment(self._directory)
+            self._segments.append(segment)
+
+        segment.writer.write(self._record.pack(len(data)))
+        segment.writer.write(data)
+        segment.written += 1
+        if segment.written == self._segment_items:
+            # Full: no more writes, so the reader needn't flush it.
+            segment.writer.close()
+            segment.writer = None
+        self._spilled += 1
+
+    def _unspill(self):
+        segment = self._segments[0]
+        if segment.reader is None:
+            segment.reader = open(segment.path, 'rb')
+        if segment.writer is not None:
+            segment.writer.flush()
+
+        size, = self._record.unpack(segment.reader.read(self._record.size))
+        data = segment.reader.read(size)
+        segment.read += 1
+        self._spilled -= 1
+        if segment.read == segment.written:
+            # Read to the end: delete it, and write new items to a new file.
+            segment.close()
+            self._segments.popleft()
+
+        if self._compress:
+            data = zlib.decompress(data)
+        return self._serializer.loads(data)
+
+    def close(self):
+        while self._segments:
+            self._segments.popleft().close()
+        self._spilled = 0
+
+
+class SpillingQueue(JoinableQueue):
+    """A :class:`JoinableQueue` that keeps at most `memory_items` items in
+    memory and spills the rest to files on disk.
+
+    Producers are never blocked by a backlog, nor is the process's memory
+    exhausted by one: while consumers are behind, each new item is
+    serialized to the end of a segment file, and each item consumed reads
+    one back, in order, so memory use stays flat and throughput falls to
+    the speed of the disk. Each segment file holds up to `segment_items`
+    items and is deleted once it's read. :meth:`get <Queue.get>`,
+    :meth:`put <Queue.put>`, :meth:`task_done <JoinableQueue.task_done>`
+    and :meth:`join <JoinableQueue.join>` work as usual.
+
+    .. note:: Files are read and written synchronously, on the IOLoop's
+      thread. Call :meth:`close` to delete the files when you're done
+      with the queue.
+
+    :Parameters:
+      - `memory_items`: The most items kept in memory (default 1000).
+      - `maxsize`: Optional size limit, counting items on disk.
+      - `io_loop`: Optional custom IOLoop.
+      - `directory`: Where to create segment files; by default, the
+        standard temporary directory.
+      - `segment_items`: The most items per segment file (default 10000).
+      - `serializer`: An object with ``dumps(item)`` and ``loads(data)``
+        methods; by default, items are pickled.
+      - `compress`: Whether to compress items on disk with zlib.
+    """
+    __slots__ = ('_store_args', )
+
+    def __init__(self, memory_items=1000, maxsize=0, io_loop=None,
+                 directory=None, segment_items=10000, serializer=None,
+                 compress=False):
+        if memory_items < 1:
+            raise ValueError('memory_items must be at least 1')
+        if segment_items < 1:
+            raise ValueError('segment_items must be at least 1')
+
+        self._store_args = (memory_items, directory, segment_items,
+                            serializer or _PickleSerializer, compress)
+        JoinableQueue.__init__(self, maxsize=maxsize, io_loop=io_loop)
+
+    def _init(self, maxsize):
+        self.queue = _SpillingStore(*self._store_args)
+
+    def spilled(self):
+        """Number of items on disk."""
+        return self.queue.spilled
+
+    def close(self):
+        """Delete the segment files. Items on disk are lost."""
+        self.queue.close()
+
+
+class _MappedSegment(object):
+    """A DurableQueue log file, preallocated and mapped into memory.
+
+    Records are a length and CRC-32, then the serialized item. The file is
+    zero-filled past the last record, so a zero length marks the end.
+    """
+
+    __slots__ = ('number', 'path', 'file', 'map', 'pos')
+
+    _header = struct.Struct('<II')
+
+    def __init__(self, directory, number, size=None):
+        self.number = number
+        self.path = os.path.join(directory, '%016x.log' % number)
+        if size is None:
+            self.file = open(self.path, 'r+b')
+        else:
+            self.file = open(self.path, 'w+b')
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.pos = 0
+
+    def room(self):
+        return len(self.map) - self.pos - self._header.size
+
+    def append(self, data):
+        header = self._header
+        header.pack_into(
+            self.map, self.pos, len(data), zlib.crc32(data) & 0xffffffff)
+        start = self.pos + header.size
+        self.map[start:start + len(data)] = data
+        self.pos = start + len(data)
+        return self.pos
+
+    def scan(self, pos):
+        """Yield (record, end position) from pos to the last intact record,
+        and leave self.pos there."""
+        header, size = self._header, len(self.map)
+        while pos + header.size <= size:
+            length, crc = header.unpack_from(self.map, pos)
+            start = pos + header.size
+            if not length or start + length > size:
+                break
+            data = self.map[start:start + length]
+            if zlib.crc32(data) & 0xffffffff != crc:
+                # Torn by a crash mid-write.
+                break
+            pos = start + length
+            yield data, pos
+        self.pos = pos
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+
+class DurableQueue(JoinableQueue):
+    """A :class:`JoinableQueue` whose items survive a restart.
+
+    Each :meth:`put <Queue.put>` appends a record to memory-mapped,
+    append-only log files in `path`, and each
+    :meth:`task_done <JoinableQueue.task_done>` advances a committed
+    offset. A new DurableQueue on the same `path` replays every item put
+    and not yet committed, in order, then carries on where the old one left
+    off:
+
+    >>> import shutil, tempfile
+    >>> from tornado import gen
+    >>> import toro
+    >>> path = tempfile.mkdtemp()
+    >>> q = toro.DurableQueue(path)
+    >>>
+    >>> @gen.coroutine
+    ... def worker():
+    ...    while True:
+    ...        job = yield q.get()
+    ...        yield run(job)
+    ...        q.task_done()
+    ...
+    >>> q.close()
+    >>> shutil.rmtree(path)
+
+    Writes go to memory, and are synced to disk together at most
+    `sync_interval` seconds later, so a crash loses at most the last
+    `sync_interval` of puts, and may replay the last `sync_interval` of
+    completed items. Set `sync_interval` to 0 to sync on every put and
+    task_done, or call :meth:`sync` when you must.
+
+    .. note:: :meth:`task_done <JoinableQueue.task_done>` commits items in
+      the order they were put. With several consumers, an item may be
+      committed while it's in progress because a later one finished first;
+      if the process then crashes, that item isn't replayed.
+
+    :Parameters:
+      - `path`: A directory for the log files, created if needed. Only one
+        DurableQueue at a time may use it.
+      - `maxsize`: Optional size limit (no limit by default).
+      - `io_loop`: Optional custom IOLoop.
+      - `segment_bytes`: The size of each log file (default 64 MB). A file
+        is deleted once all its items are committed.
+      - `sync_interval`: Seconds, or a ``datetime.timedelta``, between
+        syncs (default 0.01).
+      - `serializer`: An object with ``dumps(item)`` and ``loads(data)``
+        methods; by default, items are pickled.
+    """
+    __slots__ = ('_path', '_segment_bytes', '_sync_interval', '_serializer',
+                 '_segments', '_commit', '_pending', '_sync_timer')
+
+    _commit_record = struct.Struct('<QQ')
+
+    def __init__(self, path, maxsize=0, io_loop=None, segment_bytes=2 ** 26,
+                 sync_interval=0.01, serializer=None):
+        if isinstance(sync_interval, datetime.timedelta):
+            sync_interval = _timedelta_to_seconds(sync_interval)
+        if sync_interval < 0:
+            raise ValueError("sync_interval can't be negative")
+
+        JoinableQueue.__init__(self, maxsize=maxsize, io_loop=io_loop)
+        self._path = path
+        self._segment_bytes = segment_bytes
+        self._sync_interval = sync_interval
+        self._serializer = serializer or _PickleSerializer
+        self._sync_timer = None
+
+        # Log files from the oldest uncommitted one, and for each item not
+        # yet committed, the segment number and position just after it.
+        self._segments = collections.deque()
+        self._pending = collections.deque()
+        self._recover()
+
+    def _recover(self):
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path)
+
+        commit_path = os.path.join(self._path, 'commit')
+        with open(commit_path, 'a+b') as f:
+            if os.path.getsize(commit_path) < self._commit_record.size:
+                f.truncate(self._commit_record.size)
+        commit_file = open(commit_path, 'r+b')
+        self._commit = mmap.mmap(commit_file.fileno(), 0)
+        commit_file.close()  # The map keeps its own reference.
+        number, pos = self._commit_record.unpack_from(self._commit)
+
+        existing = sorted(
+            int(name[:-4], 16) for name in os.listdir(self._path)
+            if name.endswith('.log'))
+        for n in existing:
+            if n < number:
+                # Committed; sync() deletes these, unless we crashed first.
+                os.remove(os.path.join(self._path, '%016x.log' % n))
+                continue
+
+            segment = _MappedSegment(self._path, n)
+            self._segments.append(segment)
+            for data, end in segment.scan(pos if n == number else 0):
+                self._pending.append((n, end))
+                JoinableQueue._put(self, self._serializer.loads(data))
+
+        if not self._segments:
+            if existing or number or pos:
+                # Start after any file the commit record could refer to.
+                self._new_segment(max(existing + [number]) + 1)
+            else:
+                self._new_segment(0)
+
+    def _init(self, maxsize):
+        # Always a deque: replay may hold more than maxsize items, since it
+        # includes items that were got but not done before the restart.
+        self.queue = collections.deque()
+
+    def _check_open(self):
+        if self._commit is None:
+            raise RuntimeError('DurableQueue is closed')
+
+    def _new_segment(self, number, min_size=0):
+        segment = _MappedSegment(
+            self._path, number, max(self._segment_bytes, min_size))
+        self._segments.append(segment)
+        _fsync_directory(self._path)
+        return segment
+
+    def put(self, item, deadline=None):
+        """Like :meth:`Queue.put`, but raises ``RuntimeError`` once the
+        queue is closed."""
+        self._check_open()
+        return JoinableQueue.put(self, item, deadline)
+
+    def put_nowait(self, item):
+        """Like :meth:`Queue.put_nowait`, but raises ``RuntimeError`` once
+        the queue is closed."""
+        self._check_open()
+        JoinableQueue.put_nowait(self, item)
+
+    def put_many(self, items, deadline=None):
+        """Like :meth:`Queue.put_many`, but raises ``RuntimeError`` once
+        the queue is closed."""
+        self._check_open()
+        return JoinableQueue.put_many(self, items, deadline)
+
+    def _put(self, item):
+        self._check_open()
+        data = self._serializer.dumps(item)
+        segment = self._segments[-1]
+        if segment.room() < len(data):
+            segment.map.flush()
+            segment = self._new_segment(
+                segment.number + 1,
+                len(data) + _MappedSegment._header.size)
+
+        self._pending.append((segment.number, segment.append(data)))
+        JoinableQueue._put(self, item)
+        self._schedule_sync()
+
+    def task_done(self):
+        self._check_open()
+        JoinableQueue.task_done(self)
+        number, pos = self._pending.popleft()
+        self._commit_record.pack_into(self._commit, 0, number, pos)
+        self._schedule_sync()
+
+    def _schedule_sync(self):
+        if not self._sync_interval:
+            self.sync()
+        elif self._sync_timer is None:
+            self._sync_timer = _timer_wheel(self.io_loop).call_at(
+                self.io_loop.time() + self._sync_interval, self._on_sync)
+
+    def _on_sync(self):
+        self._sync_timer = None
+        self.sync()
+
+    def sync(self):
+        """Write puts and commits to disk now."""
+        self._check_open()
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+
+        self._segments[-1].map.flush()
+        self._commit.flush()
+
+        # Now that the commit is on disk, delete files it has passed.
+        number, pos = self._commit_record.unpack_from(self._commit)
+        segments = self._segments
+        while len(segments) > 1 and (
+                segments[0].number < number or
+                segments[0].number == number and segments[0].pos <= pos):
+            segment = segments.popleft()
+            segment.close()
+            os.remove(segment.path)
+
+    def close(self):
+        """Sync and close the log files. Items left in the queue will be
+        replayed by the next DurableQueue on this `path`.
+
+        Afterward, putting items, calling :meth:`task_done
+        <JoinableQueue.task_done>` or :meth:`sync` raises
+        ``RuntimeError``, and so do puts that were waiting for room.
+        """
+        if self._commit is None:
+            return
+
+        self.sync()
+        while self._segments:
+            self._segments.popleft().close()
+        self._commit.close()
+        self._commit = None
+        while self.putters:
+            self.putters.popleft().set_exception(
+                RuntimeError('DurableQueue is closed'))
+
+
+def _fsync_directory(path):
+    # Make a new file's directory entry durable.
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _KeyedFifo(object):
+    """CoalescingQueue's storage: (key, value) pairs in an OrderedDict."""
+
+    __slots__ = ('_entries', )
+
+    def __init__(self):
+        # Imported here so the rest of Toro runs on Python 2.6.
+        from collections import OrderedDict
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self._entries.items())
+
+    def append(self, item):
+        key, value = item
+        self._entries[key] = value
+
+    def popleft(self):
+        return self._entries.popitem(last=False)
+
+    def replace(self, key, value, move_to_back):
+        if move_to_back:
+            del self._entries[key]
+        self._entries[key] = value
+
+
+class CoalescingQueue(JoinableQueue):
+    """A :class:`JoinableQueue` of keys and values in which a put for a key
+    already waiting replaces its value.
+
+    :meth:`put` takes a key and a value, and :meth:`get <Queue.get>`
+    returns a ``(key, value)`` pair, so a key put many times before a
+    consumer gets to it is handled once, with its latest value:
+
+    >>> import toro
+    >>> q = toro.CoalescingQueue()
+    >>> q.put_nowait('user:1', 'v1')
+    >>> q.put_nowait('user:2', 'v1')
+    >>> q.put_nowait('user:1', 'v2')
+    >>> q.qsize()
+    2
+    >>> q.get_nowait()
+    ('user:1', 'v2')
+
+    A replaced entry keeps its place in line, or with `move_to_back`, goes
+    to the back. `maxsize` counts distinct keys, and a put for a waiting key
+    never blocks. Only new keys count as tasks for
+    :meth:`task_done <JoinableQueue.task_done>` and
+    :meth:`join <JoinableQueue.join>`.
+
+    Requires Python 2.7 or later, for ``collections.OrderedDict``.
+
+    :Parameters:
+      - `maxsize`: Optional limit on the number of keys (no limit by
+        default).
+      - `io_loop`: Optional custom IOLoop.
+      - `move_to_back`: Whether a put for a waiting key moves it to the back
+        of the line (default ``False``).
+    """
+    __slots__ = ('_move_to_back', )
+
+    def __init__(self, maxsize=0, io_loop=None, move_to_back=False):
+        self._move_to_back = move_to_back
+        JoinableQueue.__init__(self, maxsize=maxsize, io_loop=io_loop)
+
+    def _init(self, maxsize):
+        self.queue = _KeyedFifo()
+
+    def _put(self, item):
+        key, value = item
+        if key in self.queue:
+            self.queue.replace(key, value, self._move_to_back)
+        else:
+            JoinableQueue._put(self, item)
+
+    def put(self, key, value, deadline=None):
+        """Put `value` for `key` into the queue, or replace the value of a
+        waiting `key`. Returns a Future.
+
+        The Future blocks until there's room for a new key, or raises
+        :exc:`toro.Timeout`.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        if key in self.queue:
+            self._push((key, value))
+            return _null_future
+        return JoinableQueue.put(self, (key, value), deadline)
+
+    def put_nowait(self, key, value):
+        """Put `value` for `key` into the queue without blocking, or replace
+        the value of a waiting `key`.
+
+        If there's no room for a new key, raise queue.Full.
+        """
+        if key in self.queue:
+            self._push((key, value))
+        else:
+            JoinableQueue.put_nowait(self, (key, value))
+
+
+class Subscriber(object):
+    """A cursor into a :class:`BroadcastQueue`, from
+    :meth:`BroadcastQueue.subscribe`.
+
+    Each subscriber gets every item put after it subscribed, in order,
+    unless it falls so far behind that a :attr:`~BroadcastQueue.DROP` queue
+    drops items before it reads them; :attr:`missed` counts those.
+    """
+    __slots__ = ('_queue', '_cursor', '_missed', 'getters', '__weakref__')
+
+    def __init__(self, queue, cursor):
+        self._queue = queue
+        self._cursor = cursor
+        self._missed = 0
+
+        # _TimeoutFutures
+        self.getters = _WaiterList()
+
+    def __str__(self):
+        result = '<%s qsize=%s' % (type(self).__name__, self.qsize())
+        if self._missed:
+            result += ' missed=%s' % self._missed
+        if self.getters:
+            result += ' getters[%s]' % len(self.getters)
+        return result + '>'
+
+    @property
+    def missed(self):
+        """Number of items dropped before this subscriber read them."""
+        self._catch_up()
+        return self._missed
+
+    def qsize(self):
+        """Number of items this subscriber hasn't read yet."""
+        if self._cursor is None:
+            return 0
+        self._catch_up()
+        return self._queue._tail() - self._cursor
+
+    def empty(self):
+        """Return ``True`` if there are no items to read."""
+        return not self.qsize()
+
+    def get(self, deadline=None):
+        """Return this subscriber's next item. Returns a Future.
+
+        The Future blocks until an item is put, or raises
+        :exc:`toro.Timeout`.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        self._check_subscribed()
+        if self.qsize():
+            future = Future()
+            future.set_result(self._take())
+            self._queue._refill()
+            return future
+
+        # Only register the deadline if we actually have to wait.
+        future = _TimeoutFuture(deadline, self._queue.io_loop)
+        self.getters.append(future)
+        self._queue._waiting.add(self)
+        return future
+
+    def get_nowait(self):
+        """Return this subscriber's next item without blocking, or raise
+        :exc:`queue.Empty`."""
+        self._check_subscribed()
+        if not self.qsize():
+            raise Empty
+        item = self._take()
+        self._queue._refill()
+        return item
+
+    def close(self):
+        """Unsubscribe, so the queue no longer keeps items for this
+        subscriber. Waiting :meth:`get` calls raise ``RuntimeError``."""
+        if self._cursor is None:
+            return
+
+        self._catch_up()
+        queue = self._queue
+        queue._move_cursor(self._cursor, None)
+        self._cursor = None
+        queue._waiting.discard(self)
+        while self.getters:
+            self.getters.popleft().set_exception(
+                RuntimeError('unsubscribed'))
+        queue._refill()
+
+    def _check_subscribed(self):
+        if self._cursor is None:
+            raise RuntimeError('unsubscribed')
+
+    def _catch_up(self):
+        # A DROP queue moves lagging cursors to its base without telling
+        # their subscribers; count what they missed.
+        base = self._queue._base
+        if self._cursor is not None and self._cursor < base:
+            self._missed += base - self._cursor
+            self._cursor = base
+
+    def _take(self):
+        queue = self._queue
+        item = queue._log[queue._head + self._cursor - queue._base]
+        queue._move_cursor(self._cursor, self._cursor + 1)
+        self._cursor += 1
+        return item
+
+    def _serve(self):
+        # Give waiting getters the items put since they began waiting.
+        self._catch_up()
+        while self.getters and self._cursor < self._queue._tail():
+            self.getters.popleft().set_result(self._take())
+
+
+class BroadcastQueue(object):
+    """A queue that delivers every item to every subscriber.
+
+    Items are stored once, in a log shared by all subscribers; each
+    :class:`Subscriber` reads it through its own cursor, with its own
+    :meth:`~Subscriber.get`. An item is freed once every subscriber has
+    read it, so a put costs the same whatever the number of subscribers,
+    apart from waking those waiting for it:
+
+    >>> from tornado import gen
+    >>> import toro
+    >>> events = toro.BroadcastQueue(maxsize=1000)
+    >>>
+    >>> @gen.coroutine
+    ... def consumer():
+    ...    subscriber = events.subscribe()
+    ...    while True:
+    ...        event = yield subscriber.get()
+    ...        handle(event)
+
+    Items put while there are no subscribers are discarded.
+
+    When the slowest subscriber is `maxsize` items behind, the `policy`
+    decides: with :attr:`BLOCK` (the default), :meth:`put` blocks until it
+    catches up; with :attr:`DROP`, the oldest item is dropped, and each
+    subscriber that hadn't read it counts it in its
+    :attr:`~Subscriber.missed`.
+
+    :Parameters:
+      - `maxsize`: Optional limit on the items kept for the slowest
+        subscriber (no limit by default).
+      - `io_loop`: Optional custom IOLoop.
+      - `policy`: :attr:`BLOCK` (the default) or :attr:`DROP`.
+    """
+    BLOCK = 'block'
+    """Producers wait for the slowest subscriber."""
+
+    DROP = 'drop'
+    """The slowest subscribers miss the oldest items."""
+
+    __slots__ = ('io_loop', '_maxsize', '_policy', '_log', '_head', '_base',
+                 '_cursors', '_waiting', 'putters', '__weakref__')
+
+    def __init__(self, maxsize=0, io_loop=None, policy=BLOCK):
+        if maxsize < 0:
+            raise ValueError("maxsize can't be negative")
+        if policy not in (self.BLOCK, self.DROP):
+            raise ValueError('unknown policy %r' % (policy, ))
+
+        self.io_loop = io_loop or ioloop.IOLoop.current()
+        self._maxsize = maxsize
+        self._policy = policy
+
+        # The items from _log[_head] on are kept, and _log[_head] is item
+        # number _base. Subscribers' cursors are item numbers too.
+        self._log = []
+        self._head = 0
+        self._base = 0
+
+        # Item number -> how many subscribers' cursors are there.
+        self._cursors = {}
+        # Subscribers with getters waiting; some may have timed out.
+        self._waiting = set()
+        # _PutterFutures
+        self.putters = _WaiterList()
+
+    def __str__(self):
+        result = '<%s maxsize=%s qsize=%s subscribers=%s' % (
+            type(self).__name__, self._maxsize, self.qsize(),
+            sum(self._cursors.itervalues()))
+        if self.putters:
+            result += ' putters[%s]' % len(self.putters)
+        return result + '>'
+
+    @property
+    def maxsize(self):
+        """Number of items kept for the slowest subscriber."""
+        return self._maxsize
+
+    @property
+    def policy(self):
+        """:attr:`BLOCK` or :attr:`DROP`."""
+        return self._policy
+
+    def qsize(self):
+        """Number of items kept, which the slowest subscriber hasn't read."""
+        return len(self._log) - self._head
+
+    def full(self):
+        """Return ``True`` if `maxsize` items are kept."""
+        return bool(self._maxsize) and self.qsize() >= self._maxsize
+
+    def subscribe(self):
+        """Return a new :class:`Subscriber`, which reads the items put from
+        now on."""
+        cursor = self._tail()
+        self._move_cursor(None, cursor)
+        return Subscriber(self, cursor)
+
+    def put(self, item, deadline=None):
+        """Put an item for every subscriber. Returns a Future.
+
+        With the :attr:`BLOCK` policy, the Future blocks while the queue is
+        full, or raises :exc:`toro.Timeout`.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        if self.putters or self._blocked():
+            future = _PutterFuture(item, deadline, self.io_loop)
+            self.putters.append(future)
+            return future
+
+        self._append(item)
+        return _null_future
+
+    def put_nowait(self, item):
+        """Put an item for every subscriber without blocking.
+
+        With the :attr:`BLOCK` policy, raise :exc:`queue.Full` if the queue
+        is full.
+        """
+        if self.putters or self._blocked():
+            raise Full
+        self._append(item)
+
+    def _blocked(self):
+        return self._policy == self.BLOCK and self.full()
+
+    def _tail(self):
+        # The number the next item will have.
+        return self._base + len(self._log) - self._head
+
+    def _append(self, item):
+        if not self._cursors:
+            return
+
+        if self.full():
+            self._drop_oldest()
+        self._log.append(item)
+
+        waiting = self._waiting
+        for subscriber in list(waiting):
+            subscriber._serve()
+            if not subscriber.getters:
+                waiting.discard(subscriber)
+
+    def _move_cursor(self, old, new):
+        cursors = self._cursors
+        if old is not None:
+            count = cursors[old] - 1
+            if count:
+                cursors[old] = count
+            else:
+                del cursors[old]
+        if new is not None:
+            cursors[new] = cursors.get(new, 0) + 1
+        if old == self._base:
+            self._trim()
+
+    def _trim(self):
+        # Free the items every subscriber has read.
+        cursors, log = self._cursors, self._log
+        tail = self._tail()
+        while self._base < tail and self._base not in cursors:
+            log[self._head] = None
+            self._head += 1
+            self._base += 1
+        self._compact()
+
+    def _drop_oldest(self):
+        # Move the cursors at the oldest item past it; their subscribers
+        # notice in Subscriber._catch_up.
+        count = self._cursors.pop(self._base, 0)
+        self._log[self._head] = None
+        self._head += 1
+        self._base += 1
+        if count:
+            self._cursors[self._base] = self._cursors.get(
+                self._base, 0) + count
+        self._trim()
+
+    def _compact(self):
+        # Reclaim the freed prefix of the list once it's half the list.
+        if self._head == len(self._log):
+            del self._log[:]
+            self._head = 0
+        elif self._head > 64 and self._head * 2 > len(self._log):
+            del self._log[:self._head]
+            self._head = 0
+
+    def _refill(self):
+        # Let blocked putters in as subscribers catch up.
+        while self.putters and not self._blocked():
+            putter = self.putters.popleft()
+            self._append(putter.item)
+            putter.set_result(None)
+
+
+class _TopicNode(object):
+    """A node in PubSub's trie of topic patterns, one word per level."""
+
+    __slots__ = ('children', 'subscriptions', 'rest')
+
+    def __init__(self):
+        self.children = {}
+        # Subscriptions whose pattern ends here, and those ending in '#'.
+        self.subscriptions = []
+        self.rest = []
+
+    def __nonzero__(self):
+        return bool(self.children or self.subscriptions or self.rest)
+
+
+class Subscription(object):
+    """Messages from a :class:`PubSub` matching a topic pattern, from
+    :meth:`PubSub.subscribe`.
+
+    Each message is a ``(topic, message)`` pair.
+    """
+    __slots__ = ('_hub', '_pattern', '_queue', '_dropped', '__weakref__')
+
+    def __init__(self, hub, pattern, maxsize):
+        self._hub = hub
+        self._pattern = pattern
+        self._queue = Queue(maxsize, hub.io_loop)
+        self._dropped = 0
+
+    def __str__(self):
+        return '<%s pattern=%r qsize=%s dropped=%s>' % (
+            type(self).__name__, self._pattern, self.qsize(), self._dropped)
+
+    @property
+    def pattern(self):
+        """The topic pattern subscribed to."""
+        return self._pattern
+
+    @property
+    def dropped(self):
+        """Number of messages dropped because this subscription was full."""
+        return self._dropped
+
+    def qsize(self):
+        """Number of messages waiting."""
+        return self._queue.qsize()
+
+    def get(self, deadline=None):
+        """Remove and return the next ``(topic, message)``. Returns a
+        Future, as :meth:`Queue.get` does."""
+        return self._queue.get(deadline)
+
+    def get_nowait(self):
+        """Remove and return the next ``(topic, message)`` without blocking,
+        or raise :exc:`queue.Empty`."""
+        return self._queue.get_nowait()
+
+    def close(self):
+        """Unsubscribe. Messages already received can still be read.
+
+        Publishers waiting for room in this subscription stop waiting for
+        it; it doesn't get their messages.
+        """
+        self._hub._remove(self)
+        putters = self._queue.putters
+        while putters:
+            putters.popleft().set_result(None)
+
+
+class PubSub(object):
+    """A hub that routes each published message to the subscriptions whose
+    topic pattern matches.
+
+    Topics are words separated by dots, like ``'orders.eu.created'``. In a
+    pattern, ``*`` matches one word and a final ``#`` matches any number of
+    words, including none: ``'orders.*.created'`` and ``'orders.#'`` both
+    match ``'orders.eu.created'``. Patterns are indexed in a trie, so a
+    publish costs in proportion to the number of matching subscriptions,
+    not the number of subscriptions:
+
+    >>> from tornado import gen
+    >>> import toro
+    >>> hub = toro.PubSub(maxsize=100)
+    >>>
+    >>> @gen.coroutine
+    ... def audit():
+    ...    subscription = hub.subscribe('orders.#')
+    ...    while True:
+    ...        topic, order = yield subscription.get()
+    ...        log(topic, order)
+    ...
+    >>> @gen.coroutine
+    ... def place(order):
+    ...    yield hub.publish('orders.eu.created', order)
+
+    Each :class:`Subscription` has its own :class:`Queue` of up to `maxsize`
+    messages. When it's full, the `policy` decides: with :attr:`BLOCK` (the
+    default), :meth:`publish` waits for room; with :attr:`DROP_NEWEST`, the
+    new message is dropped; with :attr:`DROP_OLDEST`, the oldest message
+    waiting is dropped to make room.
+
+    :Parameters:
+      - `maxsize`: Optional limit on each subscription's messages (no limit
+        by default).
+      - `io_loop`: Optional custom IOLoop.
+      - `policy`: :attr:`BLOCK` (the default), :attr:`DROP_NEWEST` or
+        :attr:`DROP_OLDEST`.
+    """
+    BLOCK = 'block'
+    """Publishers wait for room."""
+
+    DROP_NEWEST = 'drop_newest'
+    """A full subscription doesn't get new messages."""
+
+    DROP_OLDEST = 'drop_oldest'
+    """A full subscription drops its oldest message for each new one."""
+
+    __slots__ = ('io_loop', '_maxsize', '_policy', '_root', '_count',
+                 '__weakref__')
+
+    def __init__(self, maxsize=0, io_loop=None, policy=BLOCK):
+        if maxsize < 0:
+            raise ValueError("maxsize can't be negative")
+        if policy not in (self.BLOCK, self.DROP_NEWEST, self.DROP_OLDEST):
+            raise ValueError('unknown policy %r' % (policy, ))
+
+        self.io_loop = io_loop or ioloop.IOLoop.current()
+        self._maxsize = maxsize
+        self._policy = policy
+        self._root = _TopicNode()
+        self._count = 0
+
+    def __str__(self):
+        return '<%s maxsize=%s policy=%s subscriptions=%s>' % (
+            type(self).__name__, self._maxsize, self._policy, self._count)
+
+    def __len__(self):
+        """The number of subscriptions."""
+        return self._count
+
+    @property
+    def policy(self):
+        """:attr:`BLOCK`, :attr:`DROP_NEWEST` or :attr:`DROP_OLDEST`."""
+        return self._policy
+
+    def subscribe(self, pattern):
+        """Return a new :class:`Subscription` to messages whose topic
+        matches `pattern`."""
+        words = pattern.split('.')
+        if '#' in words[:-1]:
+            raise ValueError("'#' must be the last word of %r" % (pattern, ))
+
+        subscription = Subscription(self, pattern, self._maxsize)
+        node = self._root
+        for word in words:
+            if word == '#':
+                node.rest.append(subscription)
+                break
+            node = node.children.setdefault(word, _TopicNode())
+        else:
+            node.subscriptions.append(subscription)
+        self._count += 1
+        return subscription
+
+    def _remove(self, subscription):
+        # Unlink subscription, and prune the nodes it leaves empty.
+        words = subscription.pattern.split('.')
+        rest = words[-1] == '#'
+        if rest:
+            words.pop()
+
+        path = [self._root]
+        for word in words:
+            node = path[-1].children.get(word)
+            if node is None:
+                return  # Already closed.
+            path.append(node)
+
+        entries = path[-1].rest if rest else path[-1].subscriptions
+        if subscription not in entries:
+            return
+        entries.remove(subscription)
+        self._count -= 1
+        for parent, word in reversed(zip(path, words)):
+            child = parent.children[word]
+            if child:
+                break
+            del parent.children[word]
+
+    def _match(self, node, words, i, result):
+        result.extend(node.rest)
+        if i == len(words):
+            result.extend(node.subscriptions)
+            return
+
+        child = node.children.get(words[i])
+        if child is not None:
+            self._match(child, words, i + 1, result)
+        child = node.children.get('*')
+        if child is not None:
+            self._match(child, words, i + 1, result)
+
+    def publish(self, topic, message, deadline=None):
+        """Send `message` to every subscription matching `topic`. Returns a
+        Future.
+
+        With the :attr:`BLOCK` policy, the Future blocks until every
+        matching subscription has room, or raises :exc:`toro.Timeout`;
+        subscriptions without room by then don't get the message.
+
+        :Parameters:
+          - `topic`: Words separated by dots, without wildcards.
+          - `message`: Any object.
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        words = topic.split('.')
+        if '*' in words or '#' in words:
+            raise ValueError("can't publish to a pattern, %r" % (topic, ))
+
+        subscriptions = []
+        self._match(self._root, words, 0, subscriptions)
+        item = (topic, message)
+        waiting = []
+        for subscription in subscriptions:
+            queue = subscription._queue
+            if self._policy == self.BLOCK:
+                future = queue.put(item, deadline)
+                if not future.done():
+                    waiting.append(future)
+            elif not queue.full():
+                queue.put_nowait(item)
+            elif self._policy == self.DROP_NEWEST:
+                subscription._dropped += 1
+            else:
+                queue.get_nowait()
+                queue.put_nowait(item)
+                subscription._dropped += 1
+
+        if not waiting:
+            return _null_future
+        return _all_futures(waiting)
+
+
+def _all_futures(futures):
+    # A Future that resolves when all of futures have, or fails with the
+    # first of them to fail.
+    result = Future()
+    remaining = [len(futures)]
+
+    def on_done(future):
+        if result.done():
+            return
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+            return
+        remaining[0] -= 1
+        if not remaining[0]:
+            result.set_result(None)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+    return result
+
+
+class _ReadFuture(_TimeoutFuture):
+    """A ByteChannel reader's Future: read up to `max_bytes` once at least
+    `min_bytes` are buffered, or up to and including `delim` if that's at
+    most `max_bytes` (None for no limit)."""
+
+    __slots__ = ('min_bytes', 'max_bytes', 'delim', 'scanned')
+
+    def __init__(self, min_bytes, max_bytes, delim):
+        # ByteChannel starts the timer only if the read has to wait.
+        super(_ReadFuture, self).__init__(None, None)
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.delim = delim
+        # How far read_until has searched without finding delim.
+        self.scanned = 0
+
+
+def _slice_bytes(buf, start, end):
+    # Copy buf[start:end] to a string, for searching across chunks.
+    piece = buf[start:end]
+    if isinstance(piece, memoryview):
+        return piece.tobytes()
+    return piece
+
+
+def _find_in(buf, delim, start):
+    if isinstance(buf, memoryview):
+        i = buf[start:].tobytes().find(delim)
+        return i if i < 0 else i + start
+    return buf.find(delim, start)
+
+
+class ByteChannel(object):
+    """A stream of bytes from writers to readers, without copying.
+
+    Written buffers are kept as they are, in order, and reads return
+    ``memoryview`` slices of them. A read is copied only if it spans
+    several writes, and then only once:
+
+    >>> from tornado import gen
+    >>> import toro
+    >>> channel = toro.ByteChannel(max_bytes=2**20)
+    >>>
+    >>> @gen.coroutine
+    ... def reader(connection):
+    ...    while True:
+    ...        chunk = yield connection.read_chunk()
+    ...        yield channel.write(chunk)
+    ...
+    >>> @gen.coroutine
+    ... def parser():
+    ...    while True:
+    ...        line = yield channel.read_until(b'\\r\\n')
+    ...        handle_header(line.tobytes())
+
+    Don't modify a buffer, such as a ``bytearray``, after writing it.
+
+    If `max_bytes` is given, :meth:`write` blocks while `max_bytes` or more
+    are buffered, unless the first waiting reader needs more bytes than are
+    buffered, as a :meth:`read_exactly` may. A write isn't split, so the
+    buffer can exceed `max_bytes`, or the bytes that reader needs, by one
+    write. Since the buffer can't grow past `max_bytes` while a
+    :meth:`read_until` waits, that's also the longest line it can read.
+
+    :Parameters:
+      - `max_bytes`: Optional limit on the bytes buffered.
+      - `io_loop`: Optional custom IOLoop.
+    """
+    __slots__ = ('io_loop', '_max_bytes', '_chunks', '_offset', '_size',
+                 '_readers', '_writers', '__weakref__')
+
+    def __init__(self, max_bytes=None, io_loop=None):
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError("max_bytes must be None or positive")
+
+        self.io_loop = io_loop or ioloop.IOLoop.current()
+        self._max_bytes = max_bytes
+
+        # Written buffers, and how much of the first one has been read.
+        self._chunks = collections.deque()
+        self._offset = 0
+        self._size = 0
+
+        # _ReadFutures; when one times out, the next may be satisfied.
+        self._readers = _NotifyingWaiterList(self._on_reader_discard)
+        # _PutterFutures
+        self._writers = _WaiterList()
+
+    def __repr__(self):
+        return '<%s at %s %s>' % (
+            type(self).__name__, hex(id(self)), self._format())
+
+    def __str__(self):
+        return '<%s %s>' % (type(self).__name__, self._format())
+
+    def _format(self):
+        result = 'buffered=%s' % self._size
+        if self._max_bytes:
+            result += ' max_bytes=%s' % self._max_bytes
+        if self._readers:
+            result += ' readers[%s]' % len(self._readers)
+        if self._writers:
+            result += ' writers[%s]' % len(self._writers)
+        return result
+
+    def __len__(self):
+        """The number of bytes buffered."""
+        return self._size
+
+    @property
+    def max_bytes(self):
+        """The limit on bytes buffered, or None."""
+        return self._max_bytes
+
+    def write(self, buf, deadline=None):
+        """Add `buf`, a string, ``bytearray`` or ``memoryview``, to the
+        stream. Returns a Future.
+
+        The Future blocks while the buffer is full, or raises
+        :exc:`toro.Timeout`; then `buf` is dropped.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        if not len(buf):
+            return _null_future
+
+        if self._writers or not self._has_room():
+            future = _PutterFuture(buf, deadline, self.io_loop)
+            self._writers.append(future)
+            return future
+
+        self._append(buf)
+        self._serve()
+        return _null_future
+
+    def read(self, max_bytes, deadline=None):
+        """Read at least one byte, and at most `max_bytes`. Returns a
+        Future.
+
+        The Future resolves to a ``memoryview`` once any bytes are buffered,
+        or raises :exc:`toro.Timeout`. It never spans writes, so it's never
+        copied.
+
+        :Parameters:
+          - `max_bytes`: The most bytes to read, at least 1.
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        if max_bytes < 1:
+            raise ValueError('max_bytes must be at least 1')
+        return self._read(_ReadFuture(1, max_bytes, None), deadline)
+
+    def read_exactly(self, n, deadline=None):
+        """Read `n` bytes. Returns a Future.
+
+        The Future resolves to a ``memoryview`` once `n` bytes are buffered,
+        or raises :exc:`toro.Timeout`.
+
+        :Parameters:
+          - `n`: The number of bytes to read, at least 1.
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        if n < 1:
+            raise ValueError('n must be at least 1')
+        return self._read(_ReadFuture(n, n, None), deadline)
+
+    def read_until(self, delim, deadline=None, max_bytes=None):
+        """Read up to and including `delim`. Returns a Future.
+
+        The Future resolves to a ``memoryview`` once `delim` is buffered, or
+        raises :exc:`toro.Timeout`. Bytes already searched aren't searched
+        again as more arrive.
+
+        If the bytes up to and including `delim` would be more than
+        `max_bytes`, or than the channel's :attr:`max_bytes`, the Future
+        raises ``ValueError`` and the bytes stay buffered.
+
+        :Parameters:
+          - `delim`: A non-empty string.
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+          - `max_bytes`: Optional limit on the bytes read.
+        """
+        if not delim:
+            raise ValueError('delim must not be empty')
+        if max_bytes is not None and max_bytes < len(delim):
+            raise ValueError('max_bytes must be at least len(delim)')
+        if self._max_bytes and (max_bytes is None or
+                                self._max_bytes < max_bytes):
+            max_bytes = self._max_bytes
+        return self._read(_ReadFuture(0, max_bytes, delim), deadline)
+
+    def _read(self, reader, deadline):
+        if not self._readers:
+            try:
+                result = self._try_read(reader)
+            except ValueError as e:
+                reader.set_exception(e)
+                return reader
+            if result is not None:
+                reader.set_result(result)
+                self._serve()
+                return reader
+
+        # Only register the deadline if we actually have to wait.
+        if deadline is not None:
+            reader._timer = _timer_wheel(self.io_loop).call_at(
+                deadline, reader._on_timeout)
+        self._readers.append(reader)
+        # A waiting reader may let writers in.
+        self._serve()
+        return reader
+
+    def _has_room(self):
+        if not self._max_bytes or self._size < self._max_bytes:
+            return True
+        # Over the limit, a write can only go in if the first reader can't
+        # be satisfied without it; a read_until always can be, or fails.
+        reader = self._readers.peek()
+        return reader is not None and self._size < reader.min_bytes
+
+    def _append(self, buf):
+        self._chunks.append(buf)
+        self._size += len(buf)
+
+    def _serve(self):
+        # Satisfy readers in order, and let in writers that now fit.
+        while True:
+            while self._readers:
+                reader = self._readers.peek()
+                try:
+                    result = self._try_read(reader)
+                except ValueError as e:
+                    self._readers.remove(reader)
+                    reader.set_exception(e)
+                    continue
+                if result is None:
+                    break
+                self._readers.remove(reader)
+                reader.set_result(result)
+
+            if not self._writers or not self._has_room():
+                return
+
+            writer = self._writers.popleft()
+            self._append(writer.item)
+            writer.set_result(None)
+
+    def _on_reader_discard(self, reader):
+        self._serve()
+
+    def _try_read(self, reader):
+        # Return reader's memoryview if the buffer can satisfy it, else None.
+        # Raise ValueError if it never can.
+        if reader.delim is not None:
+            limit = reader.max_bytes
+            i = self._find(reader.delim, reader.scanned)
+            if i < 0:
+                if limit is not None and self._size >= limit:
+                    raise ValueError(
+                        '%r not found in %d bytes' % (reader.delim, limit))
+                reader.scanned = max(0, self._size - len(reader.delim) + 1)
+                return None
+            n = i + len(reader.delim)
+            if limit is not None and n > limit:
+                raise ValueError(
+                    '%r not found in %d bytes' % (reader.delim, limit))
+            return self._take(n)
+
+        if self._size < reader.min_bytes:
+            return None
+        n = reader.max_bytes
+        if reader.min_bytes < n:
+            # Don't span writes if we needn't.
+            n = min(n, len(self._chunks[0]) - self._offset)
+        return self._take(n)
+
+    def _find(self, delim, start):
+        # Index of delim in the buffered bytes, searching from start, or -1.
+        tail_len = len(delim) - 1
+        pos = 0  # Index of the current chunk's first unread byte.
+        offset = self._offset
+        carry = ''  # The tail_len bytes before this chunk.
+        for buf in self._chunks:
+            n = len(buf) - offset
+            if pos + n > start:
+                if carry:
+                    # A match spanning the previous chunk and this one.
+                    window = carry + _slice_bytes(
+                        buf, offset, offset + min(n, tail_len))
+                    window_start = pos - len(carry)
+                    i = window.find(delim, max(0, start - window_start))
+                    if i >= 0:
+                        return window_start + i
+
+                i = _find_in(buf, delim, offset + max(0, start - pos))
+                if i >= 0:
+                    return pos + i - offset
+
+            if tail_len:
+                carry = (carry + _slice_bytes(
+                    buf, max(offset, len(buf) - tail_len), len(buf))
+                )[-tail_len:]
+            pos += n
+            offset = 0
+        return -1
+
+    def _take(self, n):
+        # Remove the first n buffered bytes and return them as a memoryview.
+        chunks = self._chunks
+        buf = chunks[0]
+        if n <= len(buf) - self._offset:
+            result = memoryview(buf)[self._offset:self._offset + n]
+            self._consume(buf, n)
+        else:
+            out = bytearray(n)
+            pos = 0
+            while pos < n:
+                buf = chunks[0]
+                k = min(n - pos, len(buf) - self._offset)
+                out[pos:pos + k] = memoryview(buf)[
+                    self._offset:self._offset + k]
+                self._consume(buf, k)
+                pos += k
+            result = memoryview(out)
+
+        self._size -= n
+        return result
+
+    def _consume(self, buf, k):
+        self._offset += k
+        if self._offset == len(buf):
+            self._chunks.popleft()
+            self._offset = 0
+
+
+class Batcher(object):
+    """Coalesce calls from many coroutines into one call per batch.
+
+    Each coroutine yields :meth:`submit` with one item and gets its own
+    result, while `fn` is called once per batch with a list of the items
+    and returns a list of results in the same order, or a Future for one:
+
+    >>> from tornado import gen
+    >>> import toro
+    >>>
+    >>> @gen.coroutine
+    ... def fetch_users(user_ids):
+    ...    rows = yield db.query_users(user_ids)  # One round trip.
+    ...    raise gen.Return([rows.get(user_id) for user_id in user_ids])
+    ...
+    >>> users = toro.Batcher(fetch_users, max_size=100, max_delay=0.005)
+    >>>
+    >>> @gen.coroutine
+    ... def handler(user_id):
+    ...    user = yield users.submit(user_id)
+
+    A batch is sent when it holds `max_size` items, or `max_delay` after its
+    first item, whichever comes first; the delay is rounded up to the timer
+    resolution (see :func:`set_timer_resolution`). If `fn` raises an
+    exception, or returns something that isn't a sequence of the right
+    length, each caller in the batch gets the exception. Batches are sent
+    without waiting for earlier ones to finish.
+
+    :Parameters:
+      - `fn`: A function taking a list of items.
+      - `max_size`: The most items in a batch (default 100).
+      - `max_delay`: Seconds, or a ``datetime.timedelta``, to wait for more
+        items after the first (default 0.01).
+      - `io_loop`: Optional custom IOLoop.
+    """
+    __slots__ = ('io_loop', '_fn', '_max_size', '_max_delay', '_items',
+                 '_futures', '_timer', '__weakref__')
+
+    def __init__(self, fn, max_size=100, max_delay=0.01, io_loop=None):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        if isinstance(max_delay, datetime.timedelta):
+            max_delay = _timedelta_to_seconds(max_delay)
+
+        self.io_loop = io_loop or ioloop.IOLoop.current()
+        self._fn = fn
+        self._max_size = max_size
+        self._max_delay = max_delay
+
+        # The batch being collected, and its callers' Futures.
+        self._items = []
+        self._futures = []
+        self._timer = None
+
+    def __str__(self):
+        return '<%s max_size=%s pending=%s>' % (
+            self.__class__.__name__, self._max_size, len(self._items))
+
+    def __len__(self):
+        """The number of items waiting to be sent."""
+        return len(self._items)
+
+    def submit(self, item):
+        """Add `item` to the next batch. Returns a Future.
+
+        The Future resolves to `item`'s result from `fn`.
+        """
+        future = Future()
+        self._items.append(item)
+        self._futures.append(future)
+        if len(self._items) >= self._max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = _timer_wheel(self.io_loop).call_at(
+                self.io_loop.time() + self._max_delay, self._on_timer)
+        return future
+
+    def _on_timer(self):
+        self._timer = None
+        self.flush()
+
+    def flush(self):
+        """Send the items waiting, if any, as a batch now."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._items:
+            return
+
+        items, futures = self._items, self._futures
+        self._items, self._futures = [], []
+        try:
+            results = self._fn(items)
+        except Exception as e:
+            self._fail(futures, e)
+            return
+
+        if isinstance(results, Future):
+            results.add_done_callback(partial(self._on_results, futures))
+        else:
+            self._deliver(futures, results)
+
+    def _on_results(self, futures, results_future):
+        if results_future.exception() is not None:
+            self._fail(futures, results_future.exception())
+        else:
+            self._deliver(futures, results_future.result())
+
+    def _deliver(self, futures, results):
+        try:
+            results = list(results)
+            if len(results) != len(futures):
+                raise ValueError(
+                    'batch function returned %d results for %d items' % (
+                        len(results), len(futures)))
+        except Exception as e:
+            self._fail(futures, e)
+            return
+
+        for future, result in zip(futures, results):
+            try:
+                future.set_result(result)
+            except Exception:
+                # A caller's callback failed; the rest still get results.
+                self.io_loop.handle_callback_exception(future)
+
+    def _fail(self, futures, exception):
+        for future in futures:
+            try:
+                future.set_exception(exception)
+            except Exception:
+                self.io_loop.handle_callback_exception(future)
+
+
+class Semaphore(object):
+    """A lock that can be acquired a fixed number of times before blocking.
+
+    A Semaphore manages a counter representing the number of release() calls
+    minus the number of acquire() calls, plus an initial value. The acquire()
+    method blocks if necessary until it can return without making the counter
+    negative.
+
+    If not given, value defaults to 1.
+
+    :meth:`acquire` supports the context manager protocol:
+
+    >>> from tornado import gen
+    >>> import toro
+    >>> semaphore = toro.Semaphore()
+    >>>
+    >>> @gen.coroutine
+    ... def f():
+    ...    with (yield semaphore.acquire()):
+    ...        assert semaphore.locked()
+    ...
+    ...    assert not semaphore.locked()
+
+    .. note:: Unlike the standard threading.Semaphore_, a :class:`Semaphore`
+      can tell you the current value of its :attr:`counter`, because code in a
+      single-threaded Tornado app can check these values and act upon them
+      without fear of interruption from another thread.
+
+    .. _threading.Semaphore: http://docs.python.org/library/threading.html#threading.Semaphore
+
+    .. seealso:: :doc:`examples/web_spider_example`
+
+    :Parameters:
+      - `value`: An int, the initial value (default 1).
+      - `io_loop`: Optional custom IOLoop.
+    """
+    __slots__ = (
+        'io_loop', '_value', '_waiters', '_unlock_waiters', '_acquired',
+        '__weakref__')
+
+    def __init__(self, value=1, io_loop=None):
         if value < 0:
             raise ValueError('semaphore initial value must be >= 0')
 
-        # The semaphore is implemented as a Queue with 'value' objects
-        self.q = Queue(io_loop=io_loop)
-        for _ in range(value):
-            self.q.put_nowait(None)
+        self.io_loop = io_loop or ioloop.IOLoop.current()
+        self._value = value
+
+        # _TimeoutFutures waiting for acquire() and for wait()
+        self._waiters = _WaiterList()
+        self._unlock_waiters = _WaiterList()
+
+        # Resolved acquire() Future, created on first use.
+        self._acquired = None
+
+    def __repr__(self):
+        return '<%s at %s%s>' % (
+            type(self).__name__, hex(id(self)), self._format())
+
+    def __str__(self):
+        return '<%s%s>' % (
+            self.__class__.__name__, self._format())
+
+    def _format(self):
+        result = ' counter=%s' % self.counter
+        if self._waiters:
+            result += ' waiters[%s]' % len(self._waiters)
+        return result
+
+    @property
+    def counter(self):
+        """An integer, the current semaphore value"""
+        return self._value
+
+    def locked(self):
+        """True if :attr:`counter` is zero"""
+        return self._value <= 0
+
+    def _acquired_future(self):
+        if self._acquired is None:
+            self._acquired = _ContextManagerFuture(None, self.release)
+        return self._acquired
+
+    def release(self):
+        """Increment :attr:`counter` and wake one waiter.
+        """
+        if self._waiters:
+            # Hand the unit straight to the first coroutine in line.
+            waiter = self._waiters.popleft()
+            waiter.set_result(self._acquired_future().result())
+        else:
+            self._value += 1
+            while self._unlock_waiters:
+                self._unlock_waiters.popleft().set_result(None)
+
+    def wait(self, deadline=None):
+        """Wait for :attr:`locked` to be False. Returns a Future.
+
+        The Future raises :exc:`toro.Timeout` after the deadline.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        if self._value > 0:
+            return _null_future
+
+        future = _TimeoutFuture(deadline, self.io_loop)
+        self._unlock_waiters.append(future)
+        return future
+
+    def acquire(self, deadline=None):
+        """Decrement :attr:`counter`. Returns a Future.
+
+        Block if the counter is zero and wait for a :meth:`release`. The
+        Future raises :exc:`toro.Timeout` after the deadline.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        if self._value > 0:
+            # Uncontended: no need for a new Future.
+            self._value -= 1
+            return self._acquired_future()
+
+        future = _TimeoutFuture(deadline, self.io_loop)
+        self._waiters.append(future)
+        return future
+
+    def try_acquire(self):
+        """Decrement :attr:`counter` if it's positive, without blocking.
+
+        Returns ``True`` if the semaphore was acquired, else ``False``. The
+        caller must call :meth:`release` later.
+        """
+        if self._value > 0:
+            self._value -= 1
+            return True
+        return False
+
+    def __enter__(self):
+        raise RuntimeError(
+            "Use Semaphore like 'with (yield semaphore)', not like"
+            " 'with semaphore'")
+
+    __exit__ = __enter__
+
+
+class BoundedSemaphore(Semaphore):
+    """A semaphore that prevents release() being called too often.
+
+    A bounded semaphore checks to make sure its current value doesn't exceed
+    its initial value. If it does, ``ValueError`` is raised. In most
+    situations semaphores are used to guard resources with limited capacity.
+    If the semaphore is released too many times it's a sign of a bug.
+
+    If not given, *value* defaults to 1.
+
+    .. seealso:: :doc:`examples/web_spider_example`
+    """
+    __slots__ = ('_initial_value', )
+
+    def __init__(self, value=1, io_loop=None):
+        super(BoundedSemaphore, self).__init__(value=value, io_loop=io_loop)
+        self._initial_value = value
+
+    def release(self):
+        if self.counter >= self._initial_value:
+            raise ValueError("Semaphore released too many times")
+        return super(BoundedSemaphore, self).release()
+
+
+class _WeightedFuture(_TimeoutFuture):
+    """A _TimeoutFuture for a blocked :meth:`WeightedSemaphore.acquire`."""
+
+    __slots__ = ('weight', )
+
+    def __init__(self, weight, deadline, io_loop):
+        super(_WeightedFuture, self).__init__(deadline, io_loop)
+        self.weight = weight
+
+
+class WeightedSemaphore(Semaphore):
+    """A semaphore from which each acquirer reserves a chosen number of units.
+
+    :meth:`acquire` takes a `weight` and blocks until it can decrement
+    :attr:`counter` by that much in one step; :meth:`release` gives `weight`
+    units back and wakes as many waiters as now fit. Use it to share a budget
+    like bytes in flight among requests of different sizes:
+
+    >>> from tornado import gen
+    >>> import toro
+    >>> budget = toro.WeightedSemaphore(1024 * 1024)
+    >>>
+    >>> @gen.coroutine
+    ... def f(size):
+    ...    with (yield budget.acquire(size)):
+    ...        assert budget.counter <= 1024 * 1024 - size
+
+    With the default policy, :attr:`FIFO`, waiters are served strictly in
+    order: a large request at the head of the line holds back smaller ones
+    behind it, so no request starves. With :attr:`BEST_FIT`, each release
+    serves the largest waiting request that fits, then the next largest, and
+    so on, and a new request that fits is granted at once. This keeps the
+    budget busier, but a large request may wait indefinitely while smaller
+    ones keep arriving.
+
+    :Parameters:
+      - `value`: An int, the initial value (default 1).
+      - `io_loop`: Optional custom IOLoop.
+      - `policy`: :attr:`FIFO` (the default) or :attr:`BEST_FIT`.
+    """
+    FIFO = 'fifo'
+    BEST_FIT = 'best_fit'
+
+    __slots__ = ('_policy', )
+
+    def __init__(self, value=1, io_loop=None, policy=FIFO):
+        if policy not in (self.FIFO, self.BEST_FIT):
+            raise ValueError('unknown policy %r' % (policy, ))
+
+        super(WeightedSemaphore, self).__init__(value=value, io_loop=io_loop)
+        self._policy = policy
+
+        # A waiter that times out at the head of the line may unblock others.
+        self._waiters = _NotifyingWaiterList(self._on_discard)
+
+    @property
+    def policy(self):
+        """The order in which waiters are served."""
+        return self._policy
+
+    def _format(self):
+        return super(WeightedSemaphore, self)._format() + (
+            ' policy=%s' % self._policy)
+
+    def _check_weight(self, weight):
+        if weight < 1:
+            raise ValueError('weight must be at least 1')
+
+    def _context_manager(self, weight):
+        if weight == 1:
+            return self._acquired_future().result()
+        return _ContextManager(partial(self.release, weight))
+
+    def _can_acquire(self, weight):
+        if self._policy == self.FIFO and self._waiters:
+            return False
+        return self._value >= weight
+
+    def acquire(self, weight=1, deadline=None):
+        """Decrement :attr:`counter` by `weight`. Returns a Future.
+
+        Block until :attr:`counter` is at least `weight` and it's this
+        caller's turn. The Future raises :exc:`toro.Timeout` after the
+        deadline.
+
+        :Parameters:
+          - `weight`: Number of units to reserve (default 1).
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for
+            a deadline relative to the current time.
+        """
+        self._check_weight(weight)
+        if self._can_acquire(weight):
+            self._value -= weight
+            if weight == 1:
+                return self._acquired_future()
+
+            future = Future()
+            future.set_result(self._context_manager(weight))
+            return future
+
+        future = _WeightedFuture(weight, deadline, self.io_loop)
+        self._waiters.append(future)
+        return future
+
+    def try_acquire(self, weight=1):
+        """Decrement :attr:`counter` by `weight` without blocking.
+
+        Returns ``True`` if the units were reserved, else ``False``. The
+        caller must call ``release(weight)`` later.
+        """
+        self._check_weight(weight)
+        if self._can_acquire(weight):
+            self._value -= weight
+            return True
+        return False
+
+    def release(self, weight=1):
+        """Increment :attr:`counter` by `weight` and wake waiters that fit."""
+        self._check_weight(weight)
+        self._value += weight
+        self._wake()
+
+    def _wake(self):
+        if self._policy == self.FIFO:
+            while self._waiters and self._waiters.peek().weight <= self._value:
+                self._grant(self._waiters.popleft())
+        else:
+            while self._waiters:
+                best = None
+                for waiter in self._waiters:
+                    if (waiter.weight <= self._value and
+                            (best is None or waiter.weight > best.weight)):
+                        best = waiter
+                if best is None:
+                    break
+                self._waiters.remove(best)
+                self._grant(best)
+
+        if self._value > 0:
+            while self._unlock_waiters:
+                self._unlock_waiters.popleft().set_result(None)
+
+    def _on_discard(self, waiter):
+        self._wake()
+
+    def _grant(self, waiter):
+        self._value -= waiter.weight
+        waiter.set_result(self._context_manager(waiter.weight))
+
+
+class BoundedWeightedSemaphore(WeightedSemaphore):
+    """A weighted semaphore that prevents release() being called too often.
+
+    Like :class:`BoundedSemaphore`, raises ``ValueError`` if a release would
+    raise :attr:`counter` above its initial value. :meth:`acquire` also
+    raises ``ValueError`` for a weight greater than the initial value, since
+    it could never be granted.
+    """
+    __slots__ = ('_initial_value', )
+
+    def __init__(self, value=1, io_loop=None, policy=WeightedSemaphore.FIFO):
+        super(BoundedWeightedSemaphore, self).__init__(
+            value=value, io_loop=io_loop, policy=policy)
+        self._initial_value = value
+
+    def _check_weight(self, weight):
+        super(BoundedWeightedSemaphore, self)._check_weight(weight)
+        if weight > self._initial_value:
+            raise ValueError('weight %r exceeds the initial value %r' % (
+                weight, self._initial_value))
+
+    def release(self, weight=1):
+        if self.counter + weight > self._initial_value:
+            raise ValueError("Semaphore released too many times")
+        return super(BoundedWeightedSemaphore, self).release(weight)
+
+
+class AIMDLimit(object):
+    """Additive-increase, multiplicative-decrease limit for
+    :class:`AdaptiveSemaphore`.
+
+    Each successful sample raises the limit by `increase`, provided the
+    caller is actually using at least half of it. A dropped sample, or one
+    slower than `latency_threshold`, multiplies the limit by `backoff_ratio`.
+
+    :Parameters:
+      - `increase`: Amount to add per successful sample (default 1).
+      - `backoff_ratio`: Factor to apply after a drop (default 0.9).
+      - `latency_threshold`: Optional latency in seconds above which a sample
+        counts as a drop.
+    """
+    def __init__(self, increase=1, backoff_ratio=0.9, latency_threshold=None):
+        if not 0 < backoff_ratio < 1:
+            raise ValueError('backoff_ratio must be between 0 and 1')
+        self.increase = increase
+        self.backoff_ratio = backoff_ratio
+        self.latency_threshold = latency_threshold
+
+    def update(self, semaphore, latency, dropped):
+        """Return `semaphore`'s new limit after a sample.
+
+        `latency` is this sample's latency in seconds; it may be None for a
+        dropped request.
+        """
+        # The unrounded limit, so that fractional growth accumulates.
+        limit = semaphore._limit
+        if dropped or (self.latency_threshold is not None and
+                       latency > self.latency_threshold):
+            return limit * self.backoff_ratio
+        if semaphore.in_flight * 2 >= limit:
+            return limit + self.increase
+        return limit
+
+
+class GradientLimit(object):
+    """Latency-gradient limit for :class:`AdaptiveSemaphore`, in the style
+    of TCP Vegas.
+
+    Compares the smoothed latency with the lowest latency seen, which
+    approximates the latency of an unloaded dependency. While the two are
+    within a factor of `tolerance` the limit grows by a queue allowance of
+    ``sqrt(limit)``; as latency rises above that the limit shrinks in
+    proportion, by up to half per sample. Each new limit is blended into the
+    old one by `smoothing`. A dropped sample halves the limit.
+
+    :Parameters:
+      - `tolerance`: Latency ratio tolerated before shrinking (default 2).
+      - `smoothing`: Weight of each new limit, from 0 to 1 (default 0.2).
+    """
+
+    # Latencies below this many seconds count as this many.
+    _resolution = 0.001
+
+    def __init__(self, tolerance=2.0, smoothing=0.2):
+        if tolerance < 1:
+            raise ValueError('tolerance must be at least 1')
+        if not 0 < smoothing <= 1:
+            raise ValueError('smoothing must be between 0 and 1')
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+
+    def update(self, semaphore, latency, dropped):
+        """Return `semaphore`'s new limit after a sample.
+
+        `latency` is this sample's latency in seconds; it may be None for a
+        dropped request.
+        """
+        # The unrounded limit, so that fractional growth accumulates.
+        limit = semaphore._limit
+        if dropped:
+            return limit * 0.5
+
+        # Below the clock's resolution latencies are noise, and zero would
+        # divide by zero.
+        latency = max(semaphore.latency, self._resolution)
+        min_latency = max(semaphore.min_latency, self._resolution)
+        gradient = max(0.5, min(1.0, self.tolerance * min_latency / latency))
+        new_limit = limit * gradient + math.sqrt(limit)
+        if semaphore.in_flight * 2 < limit:
+            # Not using the current limit, so there's no evidence it can grow.
+            new_limit = min(new_limit, limit)
+        return limit * (1 - self.smoothing) + new_limit * self.smoothing
+
+
+class _LatencySample(object):
+    """Context manager that reports how long an AdaptiveSemaphore was held."""
+
+    __slots__ = ('semaphore', 'start')
+
+    def __init__(self, semaphore, start):
+        self.semaphore = semaphore
+        self.start = start
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, typ, value, traceback):
+        # A coroutine returning from inside the block raises gen.Return.
+        dropped = typ is not None and not issubclass(
+            typ, (gen.Return, StopIteration))
+        semaphore = self.semaphore
+        semaphore.release(latency=semaphore.io_loop.time() - self.start,
+                          dropped=dropped)
+
+
+class AdaptiveSemaphore(Semaphore):
+    """A semaphore that tunes its own limit to the latency it observes.
+
+    Use it in place of a :class:`BoundedSemaphore` with a hand-picked value to
+    limit concurrent calls to a dependency whose capacity changes. Each time
+    a coroutine leaves the ``with`` block of an :meth:`acquire`, the
+    semaphore records how long it was held, and an algorithm adjusts the
+    :attr:`limit`: :class:`AIMDLimit` (the default) or
+    :class:`GradientLimit`. An exception raised from the block counts as a
+    dropped request, except ``gen.Return``.
+
+    >>> from tornado import gen
+    >>> import toro
+    >>> limiter = toro.AdaptiveSemaphore(
+    ...     limit=10, algorithm=toro.GradientLimit())
+    >>>
+    >>> @gen.coroutine
+    ... def fetch(url):
+    ...    with (yield limiter.acquire()):
+    ...        assert limiter.in_flight <= limiter.limit
+
+    :attr:`counter` is the number of permits available, ``limit`` minus
+    ``in_flight``. When the limit shrinks below the number of coroutines
+    holding the semaphore it's zero until enough of them release.
+
+    :Parameters:
+      - `limit`: The initial limit (default 10).
+      - `min_limit`: The lowest the limit may go (default 1).
+      - `max_limit`: The highest the limit may go (default 1000).
+      - `algorithm`: An :class:`AIMDLimit` (the default) or a
+        :class:`GradientLimit`.
+      - `io_loop`: Optional custom IOLoop.
+    """
+
+    # Weight of each sample in the smoothed latency.
+    _smoothing = 0.1
+
+    __slots__ = ('_limit', '_min_limit', '_max_limit', '_algorithm',
+                 '_in_flight', '_latency', '_min_latency')
+
+    def __init__(self, limit=10, min_limit=1, max_limit=1000, algorithm=None,
+                 io_loop=None):
+        if not 1 <= min_limit <= limit <= max_limit:
+            raise ValueError('need 1 <= min_limit <= limit <= max_limit')
+
+        super(AdaptiveSemaphore, self).__init__(value=limit, io_loop=io_loop)
+        self._limit = limit
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._algorithm = algorithm or AIMDLimit()
+        self._in_flight = 0
+        self._latency = None
+        self._min_latency = None
+
+    def _format(self):
+        return ' counter=%s limit=%s in_flight=%s' % (
+            self.counter, self.limit, self._in_flight)
+
+    @property
+    def counter(self):
+        """An integer, the number of permits available"""
+        return max(0, self._value)
+
+    @property
+    def limit(self):
+        """The current concurrency limit, an integer."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        """The number of coroutines holding the semaphore."""
+        return self._in_flight
+
+    @property
+    def latency(self):
+        """Smoothed latency in seconds, or None before the first sample."""
+        return self._latency
+
+    @property
+    def min_latency(self):
+        """The lowest latency seen, in seconds, or None.
+
+        It drifts slowly up toward :attr:`latency` so that the semaphore
+        adapts if the dependency becomes permanently slower.
+        """
+        return self._min_latency
+
+    def acquire(self, deadline=None):
+        """Take a permit. Returns a Future.
+
+        The Future's result is a context manager; leaving its block releases
+        the permit and records a latency sample. The Future raises
+        :exc:`toro.Timeout` after the deadline.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for
+            a deadline relative to the current time.
+        """
+        if self._value > 0 and not self._waiters:
+            future = Future()
+            self._grant(future)
+            return future
+
+        future = _TimeoutFuture(deadline, self.io_loop)
+        self._waiters.append(future)
+        return future
+
+    def try_acquire(self):
+        """Take a permit if one is free, without blocking.
+
+        Returns ``True`` or ``False``. No latency is measured; pass it to
+        :meth:`release` yourself.
+        """
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            self._in_flight += 1
+            return True
+        return False
+
+    def _grant(self, future):
+        self._value -= 1
+        self._in_flight += 1
+        future.set_result(_LatencySample(self, self.io_loop.time()))
+
+    def release(self, latency=None, dropped=False):
+        """Return a permit, and adjust the limit if given a sample.
+
+        Leaving the block of an :meth:`acquire` calls this for you.
+
+        :Parameters:
+          - `latency`: Optional seconds the permit was held.
+          - `dropped`: True if the request failed because of overload.
+        """
+        if not self._in_flight:
+            raise ValueError('Semaphore released too many times')
+
+        try:
+            if latency is not None or dropped:
+                self._sample(latency, dropped)
+        finally:
+            # Return the permit even if the algorithm fails.
+            self._in_flight -= 1
+            self._value += 1
+            while self._value > 0 and self._waiters:
+                self._grant(self._waiters.popleft())
+
+            if self._value > 0:
+                while self._unlock_waiters:
+                    self._unlock_waiters.popleft().set_result(None)
+
+    def _sample(self, latency, dropped):
+        if not dropped:
+            if self._latency is None:
+                self._latency = self._min_latency = latency
+            else:
+                self._latency += self._smoothing * (latency - self._latency)
+                self._min_latency = min(
+                    latency,
+                    self._min_latency + 0.001 * (
+                        self._latency - self._min_latency))
+
+        self._set_limit(self._algorithm.update(self, latency, dropped))
+
+    def _set_limit(self, limit):
+        limit = min(self._max_limit, max(self._min_limit, limit))
+        self._value += int(limit) - int(self._limit)
+        self._limit = limit
+
+
+class _KeyedFuture(_TimeoutFuture):
+    """A _TimeoutFuture for a blocked :meth:`KeyedSemaphore.acquire`."""
+
+    __slots__ = ('key', )
+
+    def __init__(self, key, deadline, io_loop):
+        super(_KeyedFuture, self).__init__(deadline, io_loop)
+        self.key = key
+
+
+class _KeyState(_WaiterList):
+    """A key's units in use, and its line of waiters for a unit.
+
+    `count` includes units `reserved` by waiters in the global line.
+    """
+
+    __slots__ = ('count', 'reserved')
+
+    def __init__(self):
+        super(_KeyState, self).__init__()
+        self.count = self.reserved = 0
+
 
-        self._unlocked = Event(io_loop=io_loop)
-        if value:
-            self._unlocked.set()
+class KeyedSemaphore(object):
+    """A bounded semaphore for each key, created when the key is first used.
+
+    Use it to limit concurrency per host, per user, and so on, across more
+    keys than it's practical to keep a :class:`BoundedSemaphore` for:
+
+    >>> from tornado import gen
+    >>> import toro
+    >>> per_host = toro.KeyedSemaphore(4, max_total=100)
+    >>>
+    >>> @gen.coroutine
+    ... def fetch(host, path):
+    ...    with (yield per_host.acquire(host)):
+    ...        assert per_host.counter(host) < 4
+
+    A key's state is small, and it's freed once no coroutine holds or waits
+    for the key, so memory grows with the number of busy keys rather than the
+    number of keys ever seen. Unlike a :class:`Semaphore` it's an error to
+    release a key that isn't held.
+
+    If `max_total` is given, at most that many units are held across all
+    keys. A coroutine that has its key's permission but not a global unit
+    waits in one line shared by all keys, in the order they got their key's
+    permission.
+
+    :Parameters:
+      - `value`: An int, the limit for each key (default 1).
+      - `max_total`: Optional int, the limit across all keys.
+      - `io_loop`: Optional custom IOLoop.
+    """
+    __slots__ = ('io_loop', '_value', '_max_total', '_total', '_keys',
+                 '_waiters', '__weakref__')
+
+    def __init__(self, value=1, max_total=None, io_loop=None):
+        if value < 1:
+            raise ValueError('keyed semaphore value must be >= 1')
+        if max_total is not None and max_total < 1:
+            raise ValueError('max_total must be None or >= 1')
+
+        self.io_loop = io_loop or ioloop.IOLoop.current()
+        self._value = value
+        self._max_total = max_total
+        self._total = 0
+
+        # Maps busy keys to _KeyStates.
+        self._keys = {}
+
+        # _KeyedFutures holding a unit of their key, waiting for a global one.
+        self._waiters = _NotifyingWaiterList(self._on_discard)
 
     def __repr__(self):
         return '<%s at %s%s>' % (
@@ -679,82 +3831,151 @@ class Semaphore(object):
             self.__class__.__name__, self._format())
 
     def _format(self):
-        return ' counter=%s' % self.counter
+        result = ' value=%s keys=%s total=%s' % (
+            self._value, len(self._keys), self._total)
+        if self._max_total is not None:
+            result += ' max_total=%s' % self._max_total
+        if self._waiters:
+            result += ' waiters[%s]' % len(self._waiters)
+        return result
+
+    def __len__(self):
+        """The number of keys held or waited for."""
+        return len(self._keys)
 
     @property
-    def counter(self):
-        """An integer, the current semaphore value"""
-        return self.q.qsize()
+    def value(self):
+        """The limit for each key."""
+        return self._value
 
-    def locked(self):
-        """True if :attr:`counter` is zero"""
-        return self.q.empty()
+    @property
+    def max_total(self):
+        """The limit across all keys, or None."""
+        return self._max_total
 
-    def release(self):
-        """Increment :attr:`counter` and wake one waiter.
-        """
-        self.q.put(None)
-        if not self.locked():
-            # No one was waiting on acquire(), so self.q.qsize() is positive
-            self._unlocked.set()
+    @property
+    def total(self):
+        """The number of units held across all keys."""
+        return self._total
+
+    def counter(self, key):
+        """The number of units of `key` that could be acquired at once,
+        ignoring :attr:`max_total`."""
+        state = self._keys.get(key)
+        if state is None:
+            return self._value
+        return self._value - state.count
+
+    def locked(self, key):
+        """True if acquiring `key` would block."""
+        return not self._can_acquire(self._keys.get(key))
+
+    def _can_acquire(self, state):
+        if state is not None and state.count >= self._value:
+            return False
+        return self._max_total is None or (
+            self._total < self._max_total and not self._waiters)
 
-    def wait(self, deadline=None):
-        """Wait for :attr:`locked` to be False. Returns a Future.
+    def acquire(self, key, deadline=None):
+        """Take a unit of `key`. Returns a Future.
 
-        The Future raises :exc:`toro.Timeout` after the deadline.
+        Block until fewer than :attr:`value` units of `key` are held, and
+        fewer than :attr:`max_total` in all. The Future raises
+        :exc:`toro.Timeout` after the deadline.
 
         :Parameters:
+          - `key`: Any hashable object.
           - `deadline`: Optional timeout, either an absolute timestamp
-            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
-            deadline relative to the current time.
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for
+            a deadline relative to the current time.
         """
-        return self._unlocked.wait(deadline)
-
-    def acquire(self, deadline=None):
-        """Decrement :attr:`counter`. Returns a Future.
-
-        Block if the counter is zero and wait for a :meth:`release`. The
-        Future raises :exc:`toro.Timeout` after the deadline.
+        state = self._keys.get(key)
+        if state is None:
+            state = self._keys[key] = _KeyState()
+
+        if self._can_acquire(state):
+            state.count += 1
+            self._total += 1
+            future = Future()
+            future.set_result(self._context_manager(key))
+            return future
 
-        :Parameters:
-          - `deadline`: Optional timeout, either an absolute timestamp
-            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
-            deadline relative to the current time.
-        """
-        queue_future = self.q.get(deadline)
-        if self.q.empty():
-            self._unlocked.clear()
-        future = _ContextManagerFuture(queue_future, self.release)
+        future = _KeyedFuture(key, deadline, self.io_loop)
+        if state.count < self._value:
+            # Reserve a unit of the key, then wait for a global unit.
+            state.count += 1
+            state.reserved += 1
+            self._waiters.append(future)
+        else:
+            state.append(future)
         return future
 
-    def __enter__(self):
-        raise RuntimeError(
-            "Use Semaphore like 'with (yield semaphore)', not like"
-            " 'with semaphore'")
-
-    __exit__ = __enter__
+    def try_acquire(self, key):
+        """Take a unit of `key` if it's free, without blocking.
 
+        Returns ``True`` or ``False``. The caller must call ``release(key)``
+        later.
+        """
+        state = self._keys.get(key)
+        if not self._can_acquire(state):
+            return False
 
-class BoundedSemaphore(Semaphore):
-    """A semaphore that prevents release() being called too often.
+        if state is None:
+            state = self._keys[key] = _KeyState()
+        state.count += 1
+        self._total += 1
+        return True
 
-    A bounded semaphore checks to make sure its current value doesn't exceed
-    its initial value. If it does, ``ValueError`` is raised. In most
-    situations semaphores are used to guard resources with limited capacity.
-    If the semaphore is released too many times it's a sign of a bug.
+    def release(self, key):
+        """Return a unit of `key`, and wake a waiter for it if any.
 
-    If not given, *value* defaults to 1.
+        Raises ``ValueError`` if `key` isn't held.
+        """
+        state = self._keys.get(key)
+        if state is None or state.count <= state.reserved:
+            raise ValueError('KeyedSemaphore released too many times')
+
+        state.count -= 1
+        self._total -= 1
+        self._promote(key, state)
+        self._wake()
+
+    def _promote(self, key, state):
+        # Move the first waiter for this key, if any, to the global line,
+        # or forget the key if it's idle.
+        if state:
+            state.count += 1
+            state.reserved += 1
+            self._waiters.append(state.popleft())
+        elif not state.count:
+            del self._keys[key]
+
+    def _wake(self):
+        while self._waiters and (
+                self._max_total is None or self._total < self._max_total):
+            waiter = self._waiters.popleft()
+            self._keys[waiter.key].reserved -= 1
+            self._total += 1
+            waiter.set_result(self._context_manager(waiter.key))
+
+    def _on_discard(self, waiter):
+        # A waiter gave up its reserved unit of its key.
+        key = waiter.key
+        state = self._keys[key]
+        state.count -= 1
+        state.reserved -= 1
+        self._promote(key, state)
+        self._wake()
+
+    def _context_manager(self, key):
+        return _ContextManager(partial(self.release, key))
 
-    .. seealso:: :doc:`examples/web_spider_example`
-    """
-    def __init__(self, value=1, io_loop=None):
-        super(BoundedSemaphore, self).__init__(value=value, io_loop=io_loop)
-        self._initial_value = value
+    def __enter__(self):
+        raise RuntimeError(
+            "Use KeyedSemaphore like 'with (yield semaphore.acquire(key))',"
+            " not like 'with semaphore'")
 
-    def release(self):
-        if self.counter >= self._initial_value:
-            raise ValueError("Semaphore released too many times")
-        return super(BoundedSemaphore, self).release()
+    __exit__ = __enter__
 
 
 class Lock(object):
@@ -796,6 +4017,8 @@ class Lock(object):
     :Parameters:
       - `io_loop`: Optional custom IOLoop.
     """
+    __slots__ = ('_block', '__weakref__')
+
     def __init__(self, io_loop=None):
         self._block = BoundedSemaphore(value=1, io_loop=io_loop)
 
@@ -840,10 +4063,285 @@ class Lock(object):
     __exit__ = __enter__
 
 
-if tornado.version_info[:2] >= (4, 2):
-    tornado_multi_future = gen.multi_future
-else:
-    tornado_multi_future = lambda futures, quiet_exceptions: futures
+class LockTable(object):
+    """A lock for each key, for coroutines.
+
+    Use it to serialize work per key, e.g. to compute each cache entry only
+    once, without keeping a :class:`Lock` for every key:
+
+    >>> from tornado import gen
+    >>> import toro
+    >>> locks = toro.LockTable()
+    >>>
+    >>> @gen.coroutine
+    ... def get(key):
+    ...    with (yield locks.acquire(key)):
+    ...        assert locks.locked(key)
+
+    By default a key's lock is created when it's first acquired and dropped
+    once it's unlocked with no coroutines waiting, so memory grows with the
+    number of keys in use. If `stripes` is given, keys are instead hashed onto
+    a fixed pool of that many locks: memory is constant, but keys sharing a
+    stripe block each other, and a coroutine holding one key deadlocks if it
+    waits for another key on the same stripe.
+
+    :Parameters:
+      - `stripes`: Optional int, the number of locks to share among all keys.
+      - `io_loop`: Optional custom IOLoop.
+    """
+    __slots__ = ('_block', '_stripes', '__weakref__')
+
+    def __init__(self, stripes=None, io_loop=None):
+        if stripes is None:
+            self._block = KeyedSemaphore(1, io_loop=io_loop)
+            self._stripes = None
+        else:
+            if stripes < 1:
+                raise ValueError('stripes must be None or >= 1')
+            self._block = None
+            self._stripes = [Lock(io_loop=io_loop) for _ in xrange(stripes)]
+
+    def __str__(self):
+        if self._stripes is None:
+            return '<%s keys=%s>' % (self.__class__.__name__, len(self._block))
+        return '<%s stripes=%s>' % (
+            self.__class__.__name__, len(self._stripes))
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def acquire(self, key, deadline=None):
+        """Attempt to lock `key`. Returns a Future.
+
+        The Future raises :exc:`toro.Timeout` if the deadline passes.
+
+        :Parameters:
+          - `key`: Any hashable object.
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        if self._stripes is None:
+            return self._block.acquire(key, deadline)
+        return self._stripe(key).acquire(deadline)
+
+    def release(self, key):
+        """Unlock `key`.
+
+        If any coroutines are waiting for :meth:`acquire`,
+        the first in line is awakened.
+
+        If not locked, raise a RuntimeError.
+        """
+        if not self.locked(key):
+            raise RuntimeError('release unlocked lock')
+        if self._stripes is None:
+            self._block.release(key)
+        else:
+            self._stripe(key).release()
+
+    def locked(self, key):
+        """``True`` if the lock for `key` has been acquired"""
+        if self._stripes is None:
+            return self._block.locked(key)
+        return self._stripe(key).locked()
+
+    def __enter__(self):
+        raise RuntimeError(
+            "Use LockTable like 'with (yield table.acquire(key))', not like"
+            " 'with table'")
+
+    __exit__ = __enter__
+
+
+class _OwnerContext(stack_context.StackContext):
+    """A StackContext that marks the code run within it as one lock owner."""
+
+    def __init__(self):
+        super(_OwnerContext, self).__init__(None)
+
+    def enter(self):
+        pass
+
+    def exit(self, type, value, traceback):
+        pass
+
+
+def owner_context():
+    """Make a lock owner for :class:`RLock`. Returns a ``StackContext``.
+
+    Coroutines started within the ``with`` block, and the coroutines and
+    callbacks they start in turn, belong to the owner:
+
+    >>> @gen.coroutine
+    ... def handler():
+    ...    with toro.owner_context():
+    ...        future = process_request()
+    ...
+    ...    yield future
+
+    Don't ``yield`` inside the ``with`` block. Tornado's
+    ``stack_context.run_with_stack_context`` does the same thing in one call.
+    """
+    return _OwnerContext()
+
+
+def _current_owner():
+    for context in reversed(stack_context._state.contexts[0]):
+        if isinstance(context, _OwnerContext):
+            return context
+    return None
+
+
+class _OwnerFuture(_TimeoutFuture):
+    """A _TimeoutFuture for a blocked :meth:`RLock.acquire`."""
+
+    __slots__ = ('owner', )
+
+    def __init__(self, owner, deadline, io_loop):
+        super(_OwnerFuture, self).__init__(deadline, io_loop)
+        self.owner = owner
+
+
+class RLock(object):
+    """A reentrant lock for coroutines.
+
+    An RLock can be acquired again by the owner holding it, without blocking;
+    it's unlocked once the owner has called :meth:`release` as many times as
+    :meth:`acquire`. An owner is a chain of coroutines started within one
+    :func:`owner_context`, so layered code can take the same fine-grained
+    lock at several levels:
+
+    >>> from tornado import gen
+    >>> import toro
+    >>> lock = toro.RLock()
+    >>>
+    >>> @gen.coroutine
+    ... def update(key):
+    ...    with (yield lock.acquire()):
+    ...        yield validate(key)
+    ...
+    >>> @gen.coroutine
+    ... def validate(key):
+    ...    with (yield lock.acquire()):
+    ...        assert lock.owned()
+    ...
+    >>> @gen.coroutine
+    ... def handler(key):
+    ...    with toro.owner_context():
+    ...        future = update(key)
+    ...
+    ...    yield future
+
+    Calling :meth:`acquire` outside any :func:`owner_context` raises
+    RuntimeError, as does calling :meth:`release` from an owner that doesn't
+    hold the lock. When more than one owner is waiting for the lock, the
+    first one registered is awakened when it's released.
+
+    :Parameters:
+      - `io_loop`: Optional custom IOLoop.
+    """
+    __slots__ = ('io_loop', '_owner', '_count', '_waiters', '_acquired',
+                 '__weakref__')
+
+    def __init__(self, io_loop=None):
+        self.io_loop = io_loop or ioloop.IOLoop.current()
+        self._owner = None
+        self._count = 0
+
+        # _OwnerFutures waiting for acquire()
+        self._waiters = _WaiterList()
+
+        # Resolved acquire() Future, created on first use.
+        self._acquired = None
+
+    def __str__(self):
+        result = '<%s' % self.__class__.__name__
+        if self._owner is not None:
+            result += ' count=%s' % self._count
+        if self._waiters:
+            result += ' waiters[%s]' % len(self._waiters)
+        return result + '>'
+
+    def _acquired_future(self):
+        if self._acquired is None:
+            self._acquired = _ContextManagerFuture(None, self.release)
+        return self._acquired
+
+    def acquire(self, deadline=None):
+        """Attempt to lock, or lock again if the current owner holds it.
+        Returns a Future.
+
+        The Future raises :exc:`toro.Timeout` if the deadline passes.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for a
+            deadline relative to the current time.
+        """
+        owner = _current_owner()
+        if owner is None:
+            raise RuntimeError('RLock acquired outside an owner_context()')
+
+        if self._owner is owner:
+            self._count += 1
+            return self._acquired_future()
+
+        if self._owner is None and not self._waiters:
+            self._owner = owner
+            self._count = 1
+            return self._acquired_future()
+
+        future = _OwnerFuture(owner, deadline, self.io_loop)
+        self._waiters.append(future)
+        return future
+
+    def release(self):
+        """Unlock once.
+
+        When the owner has released as many times as it acquired, the first
+        coroutine waiting for :meth:`acquire`, if any, is awakened.
+
+        If the current owner doesn't hold the lock, raise a RuntimeError.
+        """
+        if self._owner is None or self._owner is not _current_owner():
+            raise RuntimeError('cannot release un-acquired lock')
+
+        self._count -= 1
+        if not self._count:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                self._owner = waiter.owner
+                self._count = 1
+                waiter.set_result(self._acquired_future().result())
+            else:
+                self._owner = None
+
+    def locked(self):
+        """``True`` if the lock has been acquired"""
+        return self._owner is not None
+
+    def owned(self):
+        """``True`` if the current owner holds the lock"""
+        return self._owner is not None and self._owner is _current_owner()
+
+    def __enter__(self):
+        raise RuntimeError(
+            "Use RLock like 'with (yield lock.acquire())', not like"
+            " 'with lock'")
+
+    __exit__ = __enter__
+
+
+class _RWFuture(_TimeoutFuture):
+    """A _TimeoutFuture for a blocked :meth:`RWLock.acquire_read` or
+    :meth:`RWLock.acquire_write`, numbered in order of arrival."""
+
+    __slots__ = ('seq', )
+
+    def __init__(self, seq, deadline, io_loop):
+        super(_RWFuture, self).__init__(deadline, io_loop)
+        self.seq = seq
 
 
 class RWLock(object):
@@ -862,8 +4360,8 @@ class RWLock(object):
     The :meth:`release_write` method should only be called in the locked on
     write state; an attempt to release an unlocked lock raises RuntimeError.
 
-    When more than one coroutine is waiting for the lock, the first one
-    registered is awakened by :meth:`release_read`/:meth:`release_write`.
+    The lock is a count of readers and a flag for the writer, so acquiring and
+    releasing it takes the same time whatever `max_readers` is.
 
     :meth:`acquire_read`/:meth:`acquire_write` support the context manager
     protocol:
@@ -882,18 +4380,157 @@ class RWLock(object):
     ...
     ...    assert not lock.locked()
 
+    The `policy` decides who goes next when readers and writers are waiting:
+
+    - :attr:`FIFO` (the default): Coroutines are awakened in the order they
+      called :meth:`acquire_read`/:meth:`acquire_write`. A reader waits
+      behind a waiting writer even if there's room for it.
+    - :attr:`READER_PREFERENCE`: Readers get in whenever no writer holds the
+      lock and there's room. Best for read throughput, but under steady reads
+      a writer may wait forever.
+    - :attr:`WRITER_PREFERENCE`: A waiting writer blocks new readers, and
+      writers are served before readers. Waiting readers are admitted
+      together once no writer holds or wants the lock.
+    - :attr:`PHASE_FAIR`: Reading and writing phases alternate. A waiting
+      writer blocks new readers and gets the lock once the current readers
+      leave; when a writer releases the lock, every reader then waiting is
+      admitted at once, up to `max_readers`, ahead of the next writer.
+      Neither side can starve the other.
+
+    To read and then maybe write without letting another writer in between,
+    take an upgradeable read hold with :meth:`acquire_upgradeable`. Only one
+    coroutine at a time holds it, alongside ordinary readers; it can
+    :meth:`upgrade` to a write hold, which waits for the other readers to
+    leave and blocks new ones. A writer can :meth:`downgrade` to a read hold,
+    letting waiting readers in without another writer going first; with
+    :attr:`FIFO`, only the readers that arrived before the first waiting
+    writer:
+
+    >>> cache_lock = toro.RWLock(max_readers=100)
+    >>>
+    >>> @gen.coroutine
+    ... def refresh_if_stale(cache):
+    ...    with (yield cache_lock.acquire_upgradeable()):
+    ...        if cache.stale():
+    ...            yield cache_lock.upgrade()
+    ...            yield cache.refresh()
+    ...            cache_lock.downgrade()
+    ...
+    ...        raise gen.Return(cache.value())
+
     :Parameters:
       - `max_readers`: Optional max readers value, default 1.
       - `io_loop`: Optional custom IOLoop.
+      - `policy`: :attr:`FIFO` (the default), :attr:`READER_PREFERENCE`,
+        :attr:`WRITER_PREFERENCE`, or :attr:`PHASE_FAIR`.
     """
-    def __init__(self, max_readers=1, io_loop=None):
+    FIFO = 'fifo'
+    READER_PREFERENCE = 'reader_preference'
+    WRITER_PREFERENCE = 'writer_preference'
+    PHASE_FAIR = 'phase_fair'
+
+    __slots__ = ('io_loop', '_max_readers', '_policy', '_readers', '_writer',
+                 '_upgrader', '_upgraded', '_read_waiters', '_write_waiters',
+                 '_upgradeable_waiters', '_upgrading', '_seq',
+                 '_read_acquired', '_write_acquired', '_upgradeable_acquired',
+                 '__weakref__')
+
+    def __init__(self, max_readers=1, io_loop=None, policy=FIFO):
+        if max_readers < 1:
+            raise ValueError('max_readers must be >= 1')
+        if policy not in (self.FIFO, self.READER_PREFERENCE,
+                          self.WRITER_PREFERENCE, self.PHASE_FAIR):
+            raise ValueError('unknown policy %r' % (policy, ))
+
+        self.io_loop = io_loop or ioloop.IOLoop.current()
         self._max_readers = max_readers
-        self._block = BoundedSemaphore(value=max_readers, io_loop=io_loop)
+        self._policy = policy
+        self._readers = 0
+        self._writer = False
+
+        # Whether a coroutine holds the upgradeable read hold, which counts
+        # as one of the readers, and whether it has upgraded to write.
+        self._upgrader = False
+        self._upgraded = False
+
+        # _RWFutures waiting for acquire_read(), acquire_write() and
+        # acquire_upgradeable(). A writer that times out may let readers in,
+        # and vice versa.
+        self._read_waiters = _NotifyingWaiterList(self._on_discard)
+        self._write_waiters = _NotifyingWaiterList(self._on_discard)
+        self._upgradeable_waiters = _NotifyingWaiterList(self._on_discard)
+
+        # At most one _TimeoutFuture, for a pending upgrade().
+        self._upgrading = _NotifyingWaiterList(self._on_discard)
+
+        # Arrival order across both lines, for FIFO.
+        self._seq = 0
+
+        # Resolved acquire_read(), acquire_write() and acquire_upgradeable()
+        # Futures.
+        self._read_acquired = None
+        self._write_acquired = None
+        self._upgradeable_acquired = None
 
     def __str__(self):
-        return "<%s _block=%s>" % (
-            self.__class__.__name__,
-            self._block)
+        result = '<%s readers=%s/%s' % (
+            self.__class__.__name__, self._readers, self._max_readers)
+        if self._writer:
+            result += ' writer'
+        if self._upgrader:
+            result += ' upgraded' if self._upgraded else ' upgrader'
+        if self._upgrading:
+            result += ' upgrading'
+        waiters = (len(self._read_waiters) + len(self._write_waiters) +
+                   len(self._upgradeable_waiters))
+        if waiters:
+            result += ' waiters[%s]' % waiters
+        return result + ' policy=%s>' % self._policy
+
+    @property
+    def policy(self):
+        """The order in which readers and writers are served."""
+        return self._policy
+
+    def _read_acquired_future(self):
+        if self._read_acquired is None:
+            self._read_acquired = _ContextManagerFuture(
+                None, self.release_read)
+        return self._read_acquired
+
+    def _write_acquired_future(self):
+        if self._write_acquired is None:
+            self._write_acquired = _ContextManagerFuture(
+                None, self._exit_write)
+        return self._write_acquired
+
+    def _upgradeable_acquired_future(self):
+        if self._upgradeable_acquired is None:
+            self._upgradeable_acquired = _ContextManagerFuture(
+                None, self.release_upgradeable)
+        return self._upgradeable_acquired
+
+    def _can_read(self):
+        return (not self._writer and not self._upgrading and
+                self._readers < self._max_readers)
+
+    def _can_write(self):
+        return not self._writer and not self._readers
+
+    def _can_acquire_upgradeable(self):
+        return not self._upgrader and self._can_read()
+
+    def _admits_reader(self):
+        # Whether a reader arriving now may skip the lines.
+        return (not self._read_waiters and not self._upgradeable_waiters and
+                (not self._write_waiters or
+                 self._policy == self.READER_PREFERENCE))
+
+    def _enqueue(self, waiters, deadline):
+        self._seq += 1
+        future = _RWFuture(self._seq, deadline, self.io_loop)
+        waiters.append(future)
+        return future
 
     def acquire_read(self, deadline=None):
         """Attempt to lock for read. Returns a Future.
@@ -905,9 +4542,86 @@ class RWLock(object):
             (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for
             a deadline relative to the current time.
         """
-        return self._block.acquire(deadline)
+        if self._can_read() and self._admits_reader():
+            self._readers += 1
+            return self._read_acquired_future()
+
+        return self._enqueue(self._read_waiters, deadline)
+
+    def acquire_upgradeable(self, deadline=None):
+        """Attempt to lock for read, with the right to :meth:`upgrade`.
+        Returns a Future.
+
+        Only one coroutine at a time holds the upgradeable read hold; it
+        shares the lock with ordinary readers and counts toward
+        `max_readers`. Leaving the ``with`` block, or calling
+        :meth:`release_upgradeable`, releases it whether or not it was
+        upgraded. The Future raises :exc:`toro.Timeout` if the deadline
+        passes.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for
+            a deadline relative to the current time.
+        """
+        if self._can_acquire_upgradeable() and self._admits_reader():
+            self._readers += 1
+            self._upgrader = True
+            return self._upgradeable_acquired_future()
+
+        return self._enqueue(self._upgradeable_waiters, deadline)
+
+    def upgrade(self, deadline=None):
+        """Turn the upgradeable read hold into a write hold. Returns a Future.
+
+        New readers wait from now on; the Future resolves once the other
+        readers have released the lock. If it raises :exc:`toro.Timeout`
+        after the deadline, the caller still holds the upgradeable read hold.
+
+        If the caller doesn't hold the upgradeable read hold, or is already
+        upgrading, raise a RuntimeError.
+
+        :Parameters:
+          - `deadline`: Optional timeout, either an absolute timestamp
+            (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for
+            a deadline relative to the current time.
+        """
+        if not self._upgrader or self._upgraded or self._upgrading:
+            raise RuntimeError('upgrade without upgradeable read hold')
+
+        if self._readers == 1:
+            self._complete_upgrade()
+            return _null_future
+
+        future = _TimeoutFuture(deadline, self.io_loop)
+        self._upgrading.append(future)
+        return future
+
+    def _complete_upgrade(self):
+        self._readers -= 1
+        self._writer = self._upgraded = True
+
+    def downgrade(self):
+        """Turn a write hold into a read hold, and wake waiting readers.
+
+        Which readers get in depends on the policy. With :attr:`FIFO`, waiters
+        are admitted in order of arrival up to the first waiting writer,
+        which still can't get in; readers that came after it keep waiting.
+        With the other policies, every waiting reader is admitted, up to
+        `max_readers`, ahead of waiting writers.
+
+        If the write hold came from :meth:`upgrade`, it becomes the
+        upgradeable read hold again. Leaving the ``with`` block of
+        :meth:`acquire_write` after downgrading releases the read hold.
+
+        If not locked for write, raise a RuntimeError.
+        """
+        if not self._writer:
+            raise RuntimeError('downgrade unlocked lock')
+        self._writer = self._upgraded = False
+        self._readers += 1
+        self._wake(readers_first=True)
 
-    @gen.coroutine
     def acquire_write(self, deadline=None):
         """Attempt to lock for write. Returns a Future.
 
@@ -918,18 +4632,12 @@ class RWLock(object):
             (as returned by ``io_loop.time()``) or a ``datetime.timedelta`` for
             a deadline relative to the current time.
         """
-        futures = [self._block.acquire(deadline) for _ in
-                   xrange(self._max_readers)]
-        try:
-            managers = yield tornado_multi_future(futures,
-                                                  quiet_exceptions=Timeout)
-        except Timeout:
-            for f in futures:
-                # Avoid traceback logging.
-                f.exception()
-            raise
+        if (self._can_write() and not self._write_waiters and
+                not self._read_waiters and not self._upgradeable_waiters):
+            self._writer = True
+            return self._write_acquired_future()
 
-        raise gen.Return(_ContextManagerList(managers))
+        return self._enqueue(self._write_waiters, deadline)
 
     def release_read(self):
         """Releases one reader.
@@ -937,27 +4645,127 @@ class RWLock(object):
         If any coroutines are waiting for :meth:`acquire_read` (in case of full
         readers queue), the first in line is awakened.
 
-        If not locked, raise a RuntimeError.
+        If not locked for read, raise a RuntimeError.
         """
-        if self._block.counter == self._max_readers:
+        if not self._readers:
             raise RuntimeError('release unlocked lock')
-        self._block.release()
+        self._readers -= 1
+        self._wake(readers_first=self._policy == self.READER_PREFERENCE)
 
     def release_write(self):
         """Releases after write.
 
         The first in queue will be awakened after release.
 
-        If not locked, raise a RuntimeError.
+        If not locked for write, raise a RuntimeError. A write hold from
+        :meth:`upgrade` is released with :meth:`release_upgradeable`.
         """
-        if not self.locked():
+        if not self._writer or self._upgraded:
+            raise RuntimeError('release unlocked lock')
+        self._writer = False
+        self._wake_after_write()
+
+    def release_upgradeable(self):
+        """Releases the upgradeable read hold, or the write hold it was
+        upgraded to.
+
+        If not locked for upgradeable read, raise a RuntimeError.
+        """
+        if not self._upgrader:
             raise RuntimeError('release unlocked lock')
-        for i in xrange(self._max_readers):
-            self._block.release()
+        self._upgrader = False
+        if self._upgraded:
+            self._writer = self._upgraded = False
+            self._wake_after_write()
+        else:
+            self._readers -= 1
+            if self._upgrading:
+                # Abandon the pending upgrade.
+                self._upgrading.popleft().set_exception(
+                    RuntimeError('upgradeable read hold released'))
+            self._wake(readers_first=self._policy == self.READER_PREFERENCE)
+
+    def _exit_write(self):
+        # Leaving an acquire_write() block; the writer may have downgraded.
+        if self._writer:
+            self.release_write()
+        else:
+            self.release_read()
+
+    def _wake_after_write(self):
+        self._wake(readers_first=self._policy in (
+            self.READER_PREFERENCE, self.PHASE_FAIR))
+
+    def _wake(self, readers_first):
+        if self._upgrading:
+            # A pending upgrade goes first, and blocks everyone else.
+            if self._readers == 1:
+                self._complete_upgrade()
+                self._upgrading.popleft().set_result(None)
+            return
+
+        read_waiters, write_waiters = self._read_waiters, self._write_waiters
+        upgradeable_waiters = self._upgradeable_waiters
+        if self._policy == self.FIFO:
+            # Grant waiters in order of arrival until one can't proceed.
+            while True:
+                first = None
+                for waiters in (read_waiters, upgradeable_waiters,
+                                write_waiters):
+                    if waiters and (first is None or
+                                    waiters.peek().seq < first.peek().seq):
+                        first = waiters
+                if first is None:
+                    break
+                elif first is read_waiters:
+                    if not self._can_read():
+                        break
+                    self._grant_read()
+                elif first is upgradeable_waiters:
+                    if not self._can_acquire_upgradeable():
+                        break
+                    self._grant_upgradeable()
+                else:
+                    if not self._can_write():
+                        break
+                    self._grant_write()
+            return
+
+        if not readers_first and write_waiters:
+            # Readers wait until no writer wants the lock.
+            if self._can_write():
+                self._grant_write()
+            return
+
+        while read_waiters and self._can_read():
+            self._grant_read()
+        if upgradeable_waiters and self._can_acquire_upgradeable():
+            self._grant_upgradeable()
+        if write_waiters and self._can_write():
+            self._grant_write()
+
+    def _grant_read(self):
+        self._readers += 1
+        self._read_waiters.popleft().set_result(
+            self._read_acquired_future().result())
+
+    def _grant_upgradeable(self):
+        self._readers += 1
+        self._upgrader = True
+        self._upgradeable_waiters.popleft().set_result(
+            self._upgradeable_acquired_future().result())
+
+    def _grant_write(self):
+        self._writer = True
+        self._write_waiters.popleft().set_result(
+            self._write_acquired_future().result())
+
+    def _on_discard(self, waiter):
+        self._wake(readers_first=self._policy == self.READER_PREFERENCE)
 
     def locked(self):
         """``True`` if the lock has been acquired"""
-        return self._block.locked()
+        return self._writer or self._readers >= self._max_readers
 
     def __enter__(self):
         raise RuntimeError(